@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the compact mavlinkencoder byte skeletons against the previous
+str.format over pretty-printed JSON templates, for every message Mavlink2RestHelper sends.
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+from math import radians
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dvl"))
+
+import mavlinkencoder  # noqa: E402
+
+# Templates as they were used by Mavlink2RestHelper before the encoder layer
+VISION_TEMPLATE = """
+{{
+  "header": {{
+    "system_id": 255,
+    "component_id": 0,
+    "sequence": 0
+  }},
+  "message": {{
+    "type": "VISION_POSITION_DELTA",
+    "time_usec": 0,
+    "time_delta_usec": {dt},
+    "angle_delta": [
+      {dRoll},
+      {dPitch},
+      {dYaw}
+    ],
+    "position_delta": [
+      {dx},
+      {dy},
+      {dz}
+    ],
+    "confidence": {confidence}
+  }}
+}}"""
+
+VISION_SPEED_ESTIMATE_TEMPLATE = """
+        {{
+  "header": {{
+    "system_id": 255,
+    "component_id": 0,
+    "sequence": 0
+  }},
+  "message": {{
+    "type": "VISION_SPEED_ESTIMATE",
+    "usec": {us},
+    "x": {vx},
+    "y": {vy},
+    "z": {vz},
+    "covariance": [
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0
+    ],
+    "reset_counter": 0
+  }}
+}}"""
+
+GLOBAL_VISION_POSITION_ESTIMATE_TEMPLATE = """
+{{
+  "header": {{
+    "system_id": 255,
+    "component_id": 0,
+    "sequence": 0
+  }},
+  "message": {{
+    "type": "GLOBAL_VISION_POSITION_ESTIMATE",
+    "usec": {us},
+    "x": {x},
+    "y": {y},
+    "z": {z},
+    "roll": {roll},
+    "pitch": {pitch},
+    "yaw": {yaw},
+    "covariance": [
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0,
+      0.0
+    ],
+    "reset_counter": {reset_counter}
+  }}
+}}"""
+
+GPS_ORIGIN_TEMPLATE = """
+{{
+  "header": {{
+    "system_id": 255,
+    "component_id": 0,
+    "sequence": 0
+  }},
+  "message": {{
+    "type": "SET_GPS_GLOBAL_ORIGIN",
+    "latitude": {lat},
+    "longitude": {lon},
+    "altitude": 0,
+    "target_system": 0,
+    "time_usec": 0
+  }}
+}}
+        """
+
+RANGEFINDER_TEMPLATE = """
+{{
+  "header": {{
+    "system_id": 255,
+    "component_id": 0,
+    "sequence": 0
+  }},
+  "message": {{
+    "type": "DISTANCE_SENSOR",
+    "time_boot_ms": 0,
+    "min_distance": 0,
+    "max_distance": 5000,
+    "current_distance": {0},
+    "mavtype": {{
+      "type": "MAV_DISTANCE_SENSOR_LASER"
+    }},
+    "id": 0,
+    "orientation": {{
+      "type": "{1}"
+    }},
+    "covariance": 0,
+    "horizontal_fov": 0.0,
+    "vertical_fov": 0.0,
+    "quaternion": [
+      0.0,
+      0.0,
+      0.0,
+      0.0
+    ],
+    "signal_quality": 0
+  }}
+}}
+"""
+
+STATUSTEXT_TEMPLATE = """
+{{
+  "header": {{
+    "system_id": 1,
+    "component_id": 1,
+    "sequence": 0
+  }},
+  "message": {{
+    "type": "STATUSTEXT",
+    "severity": {{
+      "type": "{0}"
+    }},
+    "text": {1},
+    "id": 0,
+    "chunk_seq": 0
+  }}
+}}
+"""
+
+
+def legacy_vision_position_delta():
+    return VISION_TEMPLATE.format(
+        dt=int(125000), dRoll=0, dPitch=0, dYaw=0, dx=0.0123, dy=-0.0045, dz=0.0011, confidence=87
+    ).encode("ascii")
+
+
+def legacy_vision_speed_estimate():
+    return VISION_SPEED_ESTIMATE_TEMPLATE.format(us=123456789, vx=0.25, vy=-0.03, vz=0.01).encode("ascii")
+
+
+def legacy_global_vision_position_estimate():
+    return GLOBAL_VISION_POSITION_ESTIMATE_TEMPLATE.format(
+        us=int(1690000000.123 * 1e3),
+        roll=radians(0.01),
+        pitch=radians(-0.02),
+        yaw=radians(1.5),
+        x=1234.5,
+        y=-678.9,
+        z=-2.5,
+        reset_counter=3,
+    ).encode("ascii")
+
+
+def legacy_set_gps_global_origin():
+    return GPS_ORIGIN_TEMPLATE.format(lat=int(float(-27.5934) * 1e7), lon=int(float(-48.5478) * 1e7)).encode("ascii")
+
+
+def legacy_distance_sensor():
+    return RANGEFINDER_TEMPLATE.format(int(3.21 * 100), str("MAV_SENSOR_ROTATION_PITCH_270").replace("'", '"')).encode(
+        "ascii"
+    )
+
+
+def legacy_statustext():
+    data = STATUSTEXT_TEMPLATE.format("MAV_SEVERITY_INFO", str(list("DVL lock acquired")).replace("'", '"'))
+    return json.dumps(json.loads(data)).encode("ascii")
+
+
+BENCHMARKS = [
+    (
+        "VISION_POSITION_DELTA",
+        legacy_vision_position_delta,
+        lambda: mavlinkencoder.encode_vision_position_delta(125000, (0, 0, 0), (0.0123, -0.0045, 0.0011), 87),
+    ),
+    (
+        "VISION_SPEED_ESTIMATE",
+        legacy_vision_speed_estimate,
+        lambda: mavlinkencoder.encode_vision_speed_estimate(123456789, (0.25, -0.03, 0.01)),
+    ),
+    (
+        "GLOBAL_VISION_POSITION_ESTIMATE",
+        legacy_global_vision_position_estimate,
+        lambda: mavlinkencoder.encode_global_vision_position_estimate(
+            int(1690000000.123 * 1e3), (1234.5, -678.9, -2.5), (0.01, -0.02, 1.5), 3
+        ),
+    ),
+    (
+        "SET_GPS_GLOBAL_ORIGIN",
+        legacy_set_gps_global_origin,
+        lambda: mavlinkencoder.encode_set_gps_global_origin(-27.5934, -48.5478),
+    ),
+    (
+        "DISTANCE_SENSOR",
+        legacy_distance_sensor,
+        lambda: mavlinkencoder.encode_distance_sensor(int(3.21 * 100), b"MAV_SENSOR_ROTATION_PITCH_270"),
+    ),
+    (
+        "STATUSTEXT",
+        legacy_statustext,
+        lambda: mavlinkencoder.encode_statustext("DVL lock acquired", "MAV_SEVERITY_INFO"),
+    ),
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100000, help="encodes per measurement")
+    args = parser.parse_args()
+
+    print(f"{'message':>32} {'template':>12} {'encoder':>12} {'speedup':>8} {'bytes':>11}")
+    for name, legacy, encoder in BENCHMARKS:
+        # both paths must describe the same message
+        assert json.loads(legacy()) == json.loads(encoder()), name
+        legacy_time = min(timeit.repeat(legacy, number=args.number, repeat=3)) / args.number
+        encoder_time = min(timeit.repeat(encoder, number=args.number, repeat=3)) / args.number
+        print(
+            f"{name:>32} {legacy_time * 1e6:9.2f} us {encoder_time * 1e6:9.2f} us {legacy_time / encoder_time:7.1f}x"
+            f" {len(legacy()):5d}/{len(encoder()):<5d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the whole driver: the DVL simulator sends UDP traffic to a DvlDriver
+running its real run() loop, which posts to the stub mavlink2rest.
+
+Measures, in order:
+    startup: seconds from start() to the "Running" status
+    latency: $DVPDL datagram sent to VISION_POSITION_DELTA received by the stub, at the normal rate
+    sweep: delivery, latency and driver CPU per sentence at increasing rates, and the highest rate sustained
+    soak: resident memory growth over a long run at 10x the normal rate
+
+Results are written as JSON, and --compare prints the change from a previous results file.
+The simulator and the stub run in this process too, so CPU is measured on the driver's threads only.
+
+    python3 bench_end_to_end.py --output before.json
+    python3 bench_end_to_end.py --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dvl"))
+
+from loguru import logger  # noqa: E402
+
+from dvl import DvlDriver  # noqa: E402
+from mavlink2resthelper import Mavlink2RestHelper  # noqa: E402
+from mavlink2reststub import Mavlink2RestStub  # noqa: E402
+from simulator import EXT_RATE, GPS_RATE, PDL_RATE, DvlSimulator, sentence  # noqa: E402
+
+# rates, as multiples of the normal DVL rate, tried by the sweep
+SPEEDUPS = [1, 2, 5, 10, 20, 50, 100, 200]
+# a rate is sustained if this fraction of the datagrams reached the stub...
+MIN_DELIVERY = 0.99
+# ... with a p99 latency under this many seconds
+MAX_P99 = 0.1
+# seconds allowed for the last messages of a phase to arrive
+GRACE = 0.5
+
+
+class BenchSimulator(DvlSimulator):
+    """
+    Sends $DVPDL with a sequence number in the time delta field, which the driver copies to
+    VISION_POSITION_DELTA, so every POST can be matched to its datagram even if some are dropped
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.sequence = 0
+        self.sent_at: Dict[int, float] = {}
+
+    def send_pdl(self, now: float, dt: float) -> None:
+        self.sequence += 1
+        self.sent_at[self.sequence] = time.monotonic()
+        self.send(sentence(f"DVPDL,{self.timestamp_us(now)},{self.sequence},0,0,0,0.01,0.0,0.0,90.0"))
+        self.sent["PDL"] += 1
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1e3, 3),
+        "p90_ms": round(ordered[int(len(ordered) * 0.9)] * 1e3, 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e3, 3),
+        "max_ms": round(ordered[-1] * 1e3, 3),
+    }
+
+
+def thread_cpu(threads: List[threading.Thread]) -> float:
+    """
+    CPU seconds used so far by "threads", from /proc, or by the whole process where that is not available
+    """
+    ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+    total = 0.0
+    for thread in threads:
+        try:
+            with open(f"/proc/self/task/{thread.native_id}/stat") as stat:
+                # the command name may contain spaces, the fields after it don't
+                fields = stat.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / ticks
+        except (OSError, AttributeError, IndexError, ValueError):
+            return time.process_time()
+    return total
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+class Bench:
+    def __init__(self, port: int, command_port: int) -> None:
+        self.stub = Mavlink2RestStub().start()
+        self.simulator = BenchSimulator(("127.0.0.1", port), command_port)
+        self.settings = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+        self.settings.close()
+        os.remove(self.settings.name)
+        self.driver = DvlDriver(mav=Mavlink2RestHelper(url=self.stub.url))
+        self.driver.daemon = True
+        self.driver.settings_path = self.settings.name
+        self.driver.hostname = "127.0.0.1"
+        self.driver.port = port
+        self.driver.command_port = command_port
+
+    def driver_threads(self) -> List[threading.Thread]:
+        threads: List[threading.Thread] = [self.driver, *self.driver.sender.threads]
+        if self.driver.mav.subscriber is not None:
+            threads.append(self.driver.mav.subscriber)
+        return threads
+
+    def received(self) -> Dict[int, float]:
+        """
+        Arrival time of each VISION_POSITION_DELTA, by sequence number
+        """
+        with self.stub.lock:
+            return {
+                message["time_delta_usec"]: timestamp
+                for timestamp, message in self.stub.received
+                if message.get("type") == "VISION_POSITION_DELTA"
+            }
+
+    def clear(self) -> None:
+        with self.stub.lock:
+            self.stub.received.clear()
+
+    def startup(self) -> float:
+        threading.Thread(target=self.simulator.run, name="DvlSimulator", daemon=True).start()
+        start = time.monotonic()
+        self.driver.start()
+        while self.driver.status != "Running":
+            time.sleep(0.01)
+        return time.monotonic() - start
+
+    def phase(self, speedup: float, duration: float) -> Dict[str, Any]:
+        """
+        Runs the simulator at "speedup" for "duration" seconds, returns delivery, latency and CPU figures
+        """
+        self.simulator.speedup = speedup
+        time.sleep(min(1.0, duration / 4))  # settle at the new rate
+        self.clear()
+        first = self.simulator.sequence + 1
+        sentences = sum(self.simulator.sent.values())
+        cpu = thread_cpu(self.driver_threads())
+        time.sleep(duration)
+        last = self.simulator.sequence
+        sentences = sum(self.simulator.sent.values()) - sentences
+        cpu = thread_cpu(self.driver_threads()) - cpu
+        time.sleep(GRACE)
+        received = self.received()
+        sent_at = self.simulator.sent_at
+        latencies = [received[i] - sent_at[i] for i in range(first, last + 1) if i in received]
+        stats = percentiles(latencies)
+        delivery = len(latencies) / max(1, last - first + 1)
+        return {
+            "speedup": speedup,
+            "sentences_per_s": round(sentences / duration, 1),
+            "delivery": round(delivery, 4),
+            "latency": stats,
+            "cpu_us_per_sentence": round(cpu / max(1, sentences) * 1e6, 2),
+            "sender": self.driver.sender.get_status(),
+            "sustained": delivery >= MIN_DELIVERY and stats.get("p99_ms", float("inf")) < MAX_P99 * 1e3,
+        }
+
+    def soak(self, duration: float, speedup: float = 10) -> Dict[str, Any]:
+        self.simulator.speedup = speedup
+        samples = []
+        start = time.monotonic()
+        while time.monotonic() - start < duration:
+            samples.append((time.monotonic() - start, rss_mb()))
+            self.clear()  # the stub's own log is not the driver's memory
+            time.sleep(1)
+        grown = samples[-1][1] - samples[0][1]
+        return {
+            "speedup": speedup,
+            "duration": round(duration, 1),
+            "rss_start_mb": round(samples[0][1], 2),
+            "rss_end_mb": round(samples[-1][1], 2),
+            "rss_growth_mb": round(grown, 2),
+            "rss_growth_mb_per_hour": round(grown / max(samples[-1][0], 1) * 3600, 2),
+        }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def lookup(results: Dict[str, Any], path: List[str]) -> Optional[float]:
+    """
+    Value at "path" in "results", None if it is missing or not a number
+    """
+    value: Any = results
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value if isinstance(value, (int, float)) else None
+
+
+# name printed and path in the results of each compared value
+COMPARED = [
+    ("startup_s", ["startup_s"]),
+    ("latency p50_ms", ["latency", "latency", "p50_ms"]),
+    ("latency p99_ms", ["latency", "latency", "p99_ms"]),
+    ("max_sustained_sentences_per_s", ["max_sustained_sentences_per_s"]),
+    ("cpu_us_per_sentence at 10x", ["cpu_us_per_sentence"]),
+    ("rss_growth_mb_per_hour", ["soak", "rss_growth_mb_per_hour"]),
+]
+
+
+def compare(results: Dict[str, Any], previous: Dict[str, Any]) -> None:
+    def number(value: Optional[float]) -> str:
+        return f"{value:10.3f}" if value is not None else f"{'n/a':>10}"
+
+    print(f"compared with {previous.get('commit')}:")
+    for name, path in COMPARED:
+        now, before = lookup(results, path), lookup(previous, path)
+        ratio = f"{(now - before) / before * 100:+.1f}%" if now is not None and before else "n/a"
+        print(f"{name:>32}: {number(before)} -> {number(now)} ({ratio})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10, help="seconds of the latency phase")
+    parser.add_argument("--step", type=float, default=3, help="seconds of each sweep step")
+    parser.add_argument("--soak", type=float, default=60, help="seconds of the memory soak")
+    parser.add_argument("--port", type=int, default=27000, help="driver data port")
+    parser.add_argument("--command-port", type=int, default=50000, help="simulator command port")
+    parser.add_argument("--output", default="bench_end_to_end.json", help="results file")
+    parser.add_argument("--compare", help="previous results file")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+
+    bench = Bench(args.port, args.command_port)
+    results: Dict[str, Any] = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "normal_sentences_per_s": PDL_RATE + EXT_RATE + GPS_RATE,
+    }
+    results["startup_s"] = round(bench.startup(), 3)
+    print(f"startup: {results['startup_s']} s", file=sys.stderr)
+
+    results["latency"] = bench.phase(1, args.duration)
+    print(f"latency: {results['latency']['latency']}", file=sys.stderr)
+
+    results["sweep"] = []
+    for speedup in SPEEDUPS:
+        step = bench.phase(speedup, args.step)
+        results["sweep"].append(step)
+        print(
+            f"{speedup:5}x {step['sentences_per_s']:8.1f} sentences/s  delivery {step['delivery']:.3f}"
+            f"  p99 {step['latency'].get('p99_ms')} ms  {step['cpu_us_per_sentence']} us/sentence",
+            file=sys.stderr,
+        )
+        if not step["sustained"]:
+            break
+    sustained = [step for step in results["sweep"] if step["sustained"]]
+    results["max_sustained_sentences_per_s"] = max((step["sentences_per_s"] for step in sustained), default=0.0)
+    at_10x = [step for step in results["sweep"] if step["speedup"] == 10]
+    results["cpu_us_per_sentence"] = at_10x[0]["cpu_us_per_sentence"] if at_10x else None
+
+    results["soak"] = bench.soak(args.soak)
+    print(f"soak: {results['soak']}", file=sys.stderr)
+
+    bench.simulator.stop()
+    bench.stub.stop()
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+    print(f"results written to {args.output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Converts a synthetic track of GPS fixes around an origin to north/east offsets one fix at a time
+with the scalar geodesy functions and all at once with the NumPy batch ones, checking that
+both give the same offsets and that the inverse gives back the original fixes.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dvl"))
+
+import geodesy  # noqa: E402
+
+ORIGIN = [-27.5934, -48.5478]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=1000000, help="fixes in the synthetic track")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # a random walk of roughly a metre per fix
+    lat = ORIGIN[0] + np.cumsum(rng.normal(0, 1e-5, args.points))
+    lon = ORIGIN[1] + np.cumsum(rng.normal(0, 1e-5, args.points))
+
+    start = time.perf_counter()
+    scalar = [geodesy.lat_lng_to_NE_XY_cm(a, b, ORIGIN) for a, b in zip(lat.tolist(), lon.tolist())]
+    scalar_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = geodesy.lat_lng_to_NE_XY_cm_batch(lat, lon, ORIGIN)
+    batch_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    back_lat, back_lon = geodesy.NE_XY_cm_to_lat_lng_batch(batch, ORIGIN)
+    inverse_elapsed = time.perf_counter() - start
+
+    difference = np.abs(batch - np.array(scalar)).max()
+    round_trip = max(np.abs(back_lat - lat).max(), np.abs(back_lon - lon).max())
+    print(f"points: {args.points}")
+    print(f"  scalar forward: {args.points / scalar_elapsed:12.0f} points/s")
+    print(f"   batch forward: {args.points / batch_elapsed:12.0f} points/s ({scalar_elapsed / batch_elapsed:.0f}x)")
+    print(f"   batch inverse: {args.points / inverse_elapsed:12.0f} points/s")
+    print(f"max scalar/batch difference: {difference:g}")
+    print(f"max round trip error: {round_trip:g} deg")
+
+
+if __name__ == "__main__":
+    main()
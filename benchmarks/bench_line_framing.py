@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Feeds a large synthetic NMEA capture through the LineFramer and through the previous
+str buffer path (decode, concatenate, split("\\n", 1) per line), reporting lines per second
+for live-sized datagrams and for a backlog drained in large datagrams.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dvl"))
+
+from lineframer import LineFramer  # noqa: E402
+
+
+def checksum(sentence: str) -> str:
+    value = 0
+    for char in sentence:
+        value ^= ord(char)
+    return f"${sentence}*{value:02X}\r\n"
+
+
+def synthetic_capture(lines: int) -> bytes:
+    rng = random.Random(0)
+    out = []
+    for i in range(lines):
+        kind = i % 10
+        if kind == 9:
+            out.append(
+                "GPS:" + checksum(f"GPGGA,{120000 + i % 6000:06d}.00,2735.6040,S,04832.8680,W,1,09,0.9,0.0,M,0.0,M,,")
+            )
+        elif kind % 2:
+            out.append(
+                checksum(f"DVEXT,{i},1,1,1,1,1,1,1,{rng.uniform(20, 40):.1f},30.0,30.0,30.0,{rng.uniform(1, 20):.3f}")
+            )
+        else:
+            deltas = ",".join(f"{rng.uniform(-0.1, 0.1):.4f}" for _ in range(6))
+            out.append(checksum(f"DVPDL,{i * 66000},66000,{deltas},{rng.randint(0, 100)},1,4"))
+    return "".join(out).encode()
+
+
+def datagrams(capture: bytes, size: int) -> List[bytes]:
+    return [capture[i : i + size] for i in range(0, len(capture), size)]
+
+
+def legacy(chunks: List[bytes]) -> int:
+    buf = ""
+    count = 0
+    for chunk in chunks:
+        buf += chunk.decode()
+        while True:
+            lines = buf.split("\n", 1)
+            if len(lines) < 2:
+                break
+            buf = lines[1]
+            count += 1
+    return count
+
+
+def framer(chunks: List[bytes]) -> int:
+    line_framer = LineFramer()
+    count = 0
+    for chunk in chunks:
+        count += len(line_framer.feed(chunk))
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=200000, help="lines in the synthetic capture")
+    args = parser.parse_args()
+
+    capture = synthetic_capture(args.lines)
+    print(f"capture: {args.lines} lines, {len(capture) / 1e6:.1f} MB")
+    for name, size in [("live", 80), ("backlog", 60000)]:
+        chunks = datagrams(capture, size)
+        for path, function in [("str", legacy), ("framer", framer)]:
+            start = time.perf_counter()
+            count = function(chunks)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>8} {size:6d} B datagrams {path:>7}: {count / elapsed:12.0f} lines/s ({count} lines)")
+
+
+if __name__ == "__main__":
+    main()
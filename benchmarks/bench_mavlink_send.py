@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Benchmarks VISION_POSITION_DELTA sends against the local stub mavlink2rest.
+Compares the old one-connection-per-message urllib path with the pooled keep-alive connections
+used by Mavlink2RestHelper, reporting sends per second and latency percentiles.
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dvl"))
+
+from blueoshelper import post  # noqa: E402
+from mavlink2resthelper import Mavlink2RestHelper  # noqa: E402
+from mavlink2reststub import Mavlink2RestStub  # noqa: E402
+from mavlinkencoder import encode_vision_position_delta  # noqa: E402
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(name: str, send: Callable[[], None], count: int) -> None:
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        t0 = time.perf_counter()
+        send()
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:>10}: {count / elapsed:8.1f} sends/s"
+        f"  p50 {percentile(latencies, 0.5) * 1e3:6.3f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1e3:6.3f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=2000, help="messages sent per transport")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the stub adds to every request")
+    args = parser.parse_args()
+
+    stub = Mavlink2RestStub(latency=args.latency).start()
+    url = stub.url
+
+    mav = Mavlink2RestHelper(url=url)
+    data = encode_vision_position_delta(125000, (0, 0, 0), (0.01, 0.02, 0.0), 100)
+
+    run("urllib", lambda: post(url + "/mavlink", data=data.decode()), args.count)
+    run("pool", lambda: mav.post(data), args.count)
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Measures what the hot-path metrics cost per sentence: dispatches lines to no-op handlers the way
+DvlDriver.handle_line does, with and without the counters, the handler timer and the per-datagram
+counters of the receive loop, and reports the difference in microseconds per sentence.
+"""
+
+import argparse
+import os
+import sys
+import time
+from time import perf_counter
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dvl"))
+
+from metrics import Registry  # noqa: E402
+
+LINES = [b"$DVPDL,1,2,3*00", b"$DVEXT,1,2,3*00", b"$DVPDL,1,2,3*00", b"GPS:$GPGGA,1,2*00", b"$DVEXT,1,2,3*00"]
+LINE_TYPES = {b"$DVPD": "pdl", b"$DVEX": "ext", b"GPS:$": "gps", b"$DVNV": "configuration"}
+
+
+def bare(handlers: dict, lines: List[bytes]) -> None:
+    for line in lines:
+        handler = handlers.get(line[:5])
+        if handler is not None:
+            handler(line)
+
+
+def instrumented(handlers: dict, lines: List[bytes], registry: Registry) -> Callable[[], None]:
+    datagrams = registry.counter("datagrams", "")
+    received = registry.counter("bytes", "")
+    framed = registry.counter("lines", "")
+    line_metrics = {
+        prefix: (registry.counter("sentences", "", type=kind), registry.histogram("handler", "", type=kind))
+        for prefix, kind in LINE_TYPES.items()
+    }
+    other = (registry.counter("sentences", "", type="other"), registry.histogram("handler", "", type="other"))
+
+    def run() -> None:
+        # one datagram per line, as the DVL sends them
+        for line in lines:
+            datagrams.value += 1
+            received.value += len(line)
+            framed.value += 1
+            started = perf_counter()
+            prefix = line[:5]
+            handler = handlers.get(prefix)
+            if handler is not None:
+                handler(line)
+            sentences, seconds = line_metrics.get(prefix, other)
+            sentences.value += 1
+            seconds.observe(perf_counter() - started)
+
+    return run
+
+
+def best(function: Callable[[], None], repeats: int) -> float:
+    elapsed = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sentences", type=int, default=200000, help="sentences per run")
+    parser.add_argument("--repeats", type=int, default=5, help="runs, the fastest is reported")
+    args = parser.parse_args()
+
+    lines = (LINES * (args.sentences // len(LINES) + 1))[: args.sentences]
+    handlers = {prefix: (lambda line: None) for prefix in LINE_TYPES}
+    registry = Registry()
+
+    without = best(lambda: bare(handlers, lines), args.repeats)
+    with_metrics = best(instrumented(handlers, lines, registry), args.repeats)
+
+    print(f"{'without metrics':>16}: {without / len(lines) * 1e6:8.3f} us/sentence")
+    print(f"{'with metrics':>16}: {with_metrics / len(lines) * 1e6:8.3f} us/sentence")
+    print(f"{'overhead':>16}: {(with_metrics - without) / len(lines) * 1e6:8.3f} us/sentence")
+    print(f"{'render':>16}: {best(registry.render, args.repeats) * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Throughput of the dedicated $DVPDL/$DVEXT parsers against pynmea2, in sentences per second.
+Reads DVL output captured to a text file (one sentence per line), or generates a synthetic one.
+Needs the Cerulean pynmea2 fork the driver depends on, for the reference DV sentences.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Callable, List
+
+import pynmea2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dvl"))
+
+from nmeaparser import ExtSentence, PdlSentence, checksum, parse_ext, parse_pdl  # noqa: E402
+
+
+def sentence(body: str) -> bytes:
+    return f"${body}*{checksum(body.encode()):02X}".encode()
+
+
+def synthetic_capture(count: int) -> List[bytes]:
+    rng = random.Random(0)
+    lines = []
+    for i in range(count):
+        if i % 2:
+            gains = ",".join(f"{rng.uniform(20, 40):.1f}" for _ in range(4))
+            lines.append(sentence(f"DVEXT,{i * 66000},Y,1,1,1,1,1,1,{gains},{rng.uniform(1, 20):.3f}"))
+        else:
+            deltas = ",".join(f"{rng.uniform(-0.1, 0.1):.4f}" for _ in range(6))
+            lines.append(sentence(f"DVPDL,{i * 66000},66000,{deltas},{rng.randint(0, 100)}"))
+    return lines
+
+
+def fast(line: bytes):
+    return parse_pdl(line) if line.startswith(b"$DVPDL") else parse_ext(line)
+
+
+def slow(line: bytes):
+    data = pynmea2.parse(line.decode("ascii"))
+    # pynmea2 converts fields lazily, read them all like the handlers do
+    for field in PdlSentence._fields if data.sentence_type == "PDL" else ExtSentence._fields:
+        getattr(data, field)
+    return data
+
+
+def throughput(function: Callable, lines: List[bytes]) -> float:
+    start = time.perf_counter()
+    for line in lines:
+        function(line)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("capture", nargs="?", help="text capture of DVL output, synthetic if omitted")
+    parser.add_argument("--count", type=int, default=100000, help="synthetic sentences")
+    args = parser.parse_args()
+
+    if not {"PDL", "EXT"} <= set(pynmea2.TalkerSentence.sentence_types):
+        sys.exit("pynmea2 has no DV sentences, install the Cerulean fork listed in dvl/setup.py")
+
+    if args.capture:
+        with open(args.capture, "rb") as capture:
+            lines = [line.strip() for line in capture if line.startswith((b"$DVPDL", b"$DVEXT"))]
+    else:
+        lines = synthetic_capture(args.count)
+
+    # both paths must agree on every field the handlers use
+    for line in lines[:1000]:
+        ours, theirs = fast(line), slow(line)
+        for field in type(ours)._fields:
+            assert getattr(ours, field) == getattr(theirs, field), (line, field)
+
+    print(f"{len(lines)} sentences")
+    print(f"pynmea2    : {throughput(slow, lines):10.0f} sentences/s")
+    print(f"nmeaparser : {throughput(fast, lines):10.0f} sentences/s")
+
+
+if __name__ == "__main__":
+    main()
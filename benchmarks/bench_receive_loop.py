@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Measures datagram-to-handler latency and idle CPU of the DvlDriver receive loop,
+comparing the previous polling loop (zero-timeout select, one line per pass, 3 ms sleep)
+with the event-driven loop (blocking select, every complete line handled on arrival).
+"""
+
+import argparse
+import socket
+import threading
+import time
+from select import select
+from typing import Callable, List
+
+RECEIVE_TIMEOUT = 0.5
+
+
+def polling_loop(sock: socket.socket, handle: Callable[[str], None], stop: threading.Event) -> None:
+    buf = ""
+    while not stop.is_set():
+        r, _, _ = select([sock], [], [], 0)
+        line = None
+        if r:
+            buf += sock.recv(1024).decode()
+        if len(buf) > 0:
+            lines = buf.split("\n", 1)
+            if len(lines) > 1:
+                buf = lines[1]
+                line = lines[0]
+        if line:
+            handle(line)
+        time.sleep(0.003)
+
+
+def event_loop(sock: socket.socket, handle: Callable[[str], None], stop: threading.Event) -> None:
+    buf = ""
+    while not stop.is_set():
+        r, _, _ = select([sock], [], [], RECEIVE_TIMEOUT)
+        if not r:
+            continue
+        buf += sock.recv(1024).decode()
+        *lines, buf = buf.split("\n")
+        for line in lines:
+            handle(line)
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(name: str, loop, rate: float, burst: int, seconds: float) -> None:
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.setblocking(False)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    latencies: List[float] = []
+
+    def handle(line: str) -> None:
+        latencies.append(time.perf_counter() - float(line.split(",")[1]))
+
+    stop = threading.Event()
+    thread = threading.Thread(target=loop, args=(receiver, handle, stop), daemon=True)
+    thread.start()
+
+    # idle: no traffic at all
+    cpu = time.process_time()
+    time.sleep(seconds / 2)
+    idle_cpu = (time.process_time() - cpu) / (seconds / 2)
+
+    # traffic: "burst" lines per datagram, like a DVPDL + DVEXT + GPS passthrough group
+    sent = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        payload = "".join(f"$DVPDL,{time.perf_counter()!r},0,0,0,0,0,0,0,100*00\r\n" for _ in range(burst))
+        sender.sendto(payload.encode(), receiver.getsockname())
+        sent += burst
+        time.sleep(1 / rate)
+    time.sleep(0.5)
+    stop.set()
+    thread.join()
+    receiver.close()
+    sender.close()
+
+    print(
+        f"{name:>8}: handled {len(latencies)}/{sent} lines, idle CPU {idle_cpu * 100:5.2f}%,"
+        f" latency p50 {percentile(latencies, 0.5) * 1e3:7.3f} ms"
+        f" p99 {percentile(latencies, 0.99) * 1e3:7.3f} ms max {max(latencies) * 1e3:7.3f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rate", type=float, default=15, help="datagrams per second")
+    parser.add_argument("--burst", type=int, default=3, help="lines per datagram")
+    parser.add_argument("--seconds", type=float, default=4, help="duration of the traffic phase")
+    args = parser.parse_args()
+    measure("polling", polling_loop, args.rate, args.burst, args.seconds)
+    measure("event", event_loop, args.rate, args.burst, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
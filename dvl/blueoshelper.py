@@ -1,4 +1,10 @@
+import http.client
+import queue
+import select
 import urllib
+import urllib.parse
+import urllib.request
+from typing import Dict, Optional, Tuple
 
 from loguru import logger
 
@@ -32,3 +38,89 @@ def post(url, data):
         logger.warning(f"Error in request: {url}: {error}")
         logger.warning(data)
         return None
+
+
+def connection_dropped(connection: http.client.HTTPConnection) -> bool:
+    """
+    True if the server closed the idle "connection". Nothing is expected on an idle connection,
+    so a readable socket means the server closed it, or sent something we can't use
+    """
+    if connection.sock is None:
+        return True
+    try:
+        return bool(select.select([connection.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP connections to a single server.
+    Every request is bounded by "timeout" seconds per socket operation.
+    """
+
+    def __init__(self, url: str, size: int = 4, timeout: float = 1.0):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self.idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+
+    def _acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """
+        Returns an idle connection the server didn't close, or a new one if there is none, and whether it was reused
+        """
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+            if not connection_dropped(connection):
+                return connection, True
+            # checked before writing, so a POST is never lost to a connection closed while idle
+            connection.close()
+
+    def _release(self, connection: http.client.HTTPConnection) -> None:
+        try:
+            self.idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(
+        self, method: str, path: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, bytes]:
+        """
+        Sends a request to "path" (relative to the pool url) and returns (status, body).
+        A reused connection that the server already closed is retried on a fresh one, for GETs, or when
+        the request could not be written. A POST the server may have handled is never sent twice.
+        Raises on connection errors and timeouts.
+        """
+        while True:
+            connection, reused = self._acquire()
+            written = False
+            try:
+                connection.request(method, self.prefix + path, body=body, headers=headers or {})
+                written = True
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused and (method == "GET" or not written):
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return response.status, data
+
+    def close(self) -> None:
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,240 @@
+"""
+Paced, acknowledged commands to the DVL command port.
+
+Callers queue a command line and get a concurrent.futures.Future right away. A worker thread
+sends the queued commands in order, at most one every "spacing" seconds, and keeps each one in
+flight until the DVL acknowledges it by name with $DVACK,<name>,OK|ERR. Commands not acknowledged
+within "timeout" are sent again, waiting "backoff" times longer each time, until their retries run out.
+
+The futures resolve to True when the DVL accepted the command and False when it rejected it.
+Acknowledgements are only waited for once a $DVACK matched a command sent: until then the DVL is
+assumed not to send them, and commands resolve to None, unconfirmed, as soon as they are sent,
+as the bare datagrams used to be. Commands with a reply, like "?" answered by $DVNVM, always wait
+for it, but the reply doesn't count as an acknowledgement.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# seconds between commands, the DVL drops commands sent back to back
+COMMAND_SPACING = 0.1
+# seconds to wait for the acknowledgement of the first attempt
+ACK_TIMEOUT = 1.0
+# each retry waits this many times longer than the previous attempt
+BACKOFF = 2.0
+# attempts after the first one, for commands that are safe to repeat
+RETRIES = 2
+
+
+class Command:
+    __slots__ = ("name", "data", "retries", "reply", "future", "attempts", "deadline", "resolved")
+
+    def __init__(self, line: str, retries: int, reply: bool) -> None:
+        # the DVL acknowledges commands by their first word
+        self.name = line.split(" ", 1)[0].upper()
+        self.data = (line + "\r\n").encode("ascii")
+        self.retries = retries
+        # resolved by answer() rather than by an acknowledgement
+        self.reply = reply
+        self.future: Future = Future()
+        self.attempts = 0
+        self.deadline = 0.0
+        # claimed under the lock, so the future is resolved exactly once
+        self.resolved = False
+
+
+# future and its result, or the exception it raises
+Resolution = Tuple[Future, Any]
+
+
+def resolve(resolutions: List[Resolution]) -> None:
+    for future, result in resolutions:
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+class CommandChannel:
+    """
+    Sends command lines with "send", see the module docstring for the pacing, acknowledgement and retries
+    """
+
+    def __init__(
+        self,
+        send: Callable[[bytes], None],
+        spacing: float = COMMAND_SPACING,
+        timeout: float = ACK_TIMEOUT,
+        backoff: float = BACKOFF,
+    ) -> None:
+        self.send = send
+        self.spacing = spacing
+        self.timeout = timeout
+        self.backoff = backoff
+        self.queue: Deque[Command] = deque()
+        # sent and waiting for their acknowledgement, oldest first. Commands resolved as unconfirmed
+        # stay until their deadline, so a first $DVACK can still be matched to them
+        self.in_flight: List[Command] = []
+        self.condition = threading.Condition()
+        self.last_sent = float("-inf")
+        self.thread: Optional[threading.Thread] = None
+        # set by the first $DVACK matching a command sent
+        self.supports_ack = False
+        self.sent = 0
+        self.acknowledged = 0
+        self.rejected = 0
+        self.retried = 0
+        self.unconfirmed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="CommandChannel", daemon=True)
+            self.thread.start()
+
+    def submit(self, line: str, retries: int = RETRIES, reply: bool = False) -> Future:
+        """
+        Queues the command "line", without the line ending, and returns the future of its acknowledgement.
+        Commands that must not run twice, like REBOOT, should be submitted with no retries.
+        Commands with a "reply" are resolved by answer() instead
+        """
+        command = Command(line, retries, reply)
+        with self.condition:
+            self.queue.append(command)
+            self.condition.notify()
+        return command.future
+
+    def find(self, name: str) -> Optional[Command]:
+        for command in self.in_flight:
+            if command.name == name:
+                return command
+        return None
+
+    def acknowledge(self, name: str, ok: bool) -> None:
+        """
+        Resolves the oldest in-flight command called "name", called for each $DVACK received
+        """
+        name = name.upper()
+        with self.condition:
+            command = self.find(name)
+            if command is None:
+                logger.debug(f"Acknowledgement of {name} matches no command in flight")
+                return
+            if not self.supports_ack:
+                logger.info("DVL acknowledges commands, waiting for the acknowledgements from now on")
+                self.supports_ack = True
+            self.acknowledged += 1
+            if not ok:
+                self.rejected += 1
+                logger.warning(f"DVL rejected {command.data.strip()!r}")
+            if command.reply:
+                # still waiting for the reply itself
+                return
+            self.in_flight.remove(command)
+            self.condition.notify()
+            if command.resolved:
+                return
+            command.resolved = True
+        command.future.set_result(ok)
+
+    def answer(self, name: str) -> None:
+        """
+        Resolves the oldest in-flight command called "name" that waits for a reply, called when the reply arrives
+        """
+        name = name.upper()
+        with self.condition:
+            command = self.find(name)
+            if command is None or not command.reply:
+                return
+            self.in_flight.remove(command)
+            self.condition.notify()
+            if command.resolved:
+                return
+            command.resolved = True
+        command.future.set_result(True)
+
+    def expire(self, now: float) -> List[Resolution]:
+        """
+        Retries or gives up on the commands whose acknowledgement is overdue, returns the futures to resolve
+        """
+        resolutions: List[Resolution] = []
+        for command in [command for command in self.in_flight if command.deadline <= now]:
+            self.in_flight.remove(command)
+            if command.resolved:
+                # resolved as unconfirmed when it was sent
+                continue
+            if command.attempts <= command.retries:
+                self.retried += 1
+                self.queue.appendleft(command)
+            else:
+                command.resolved = True
+                self.failed += 1
+                logger.warning(f"No answer to {command.data.strip()!r} after {command.attempts} attempts")
+                resolutions.append((command.future, TimeoutError(f"No answer to {command.name}")))
+        return resolutions
+
+    def next_command(self) -> Tuple[Optional[Command], List[Resolution]]:
+        """
+        Waits until a command may be sent or overdue ones need resolving. Marks the command returned in flight
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                resolutions = self.expire(now)
+                if resolutions:
+                    return None, resolutions
+                wait: Optional[float] = None
+                if self.queue:
+                    wait = self.last_sent + self.spacing - now
+                    if wait <= 0:
+                        break
+                if self.in_flight:
+                    overdue = min(command.deadline for command in self.in_flight) - now
+                    wait = overdue if wait is None else min(wait, overdue)
+                self.condition.wait(wait)
+            command = self.queue.popleft()
+            command.deadline = now + self.timeout * self.backoff**command.attempts
+            command.attempts += 1
+            # in flight before it is sent, so a fast acknowledgement finds it
+            self.in_flight.append(command)
+            self.last_sent = now
+            return command, []
+
+    def run(self) -> None:
+        while True:
+            command, resolutions = self.next_command()
+            resolve(resolutions)
+            if command is None:
+                continue
+            try:
+                self.send(command.data)
+                self.sent += 1
+            except OSError as error:
+                # left in flight, so it is retried like a lost command
+                logger.warning(f"Unable to send {command.data.strip()!r}: {error}")
+                continue
+            with self.condition:
+                # no acknowledgement to wait for, the command stays in flight only to be matched
+                unconfirmed = not self.supports_ack and not command.reply and not command.resolved
+                if unconfirmed:
+                    command.resolved = True
+                    self.unconfirmed += 1
+            if unconfirmed:
+                command.future.set_result(None)
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "supports_ack": self.supports_ack,
+            "queued": len(self.queue),
+            "in_flight": len(self.in_flight),
+            "sent": self.sent,
+            "acknowledged": self.acknowledged,
+            "rejected": self.rejected,
+            "retried": self.retried,
+            "unconfirmed": self.unconfirmed,
+            "failed": self.failed,
+        }
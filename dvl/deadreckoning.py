@@ -0,0 +1,134 @@
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# poses kept in the track, ~9 hours at the default interval, 2 MB
+TRACK_CAPACITY = 65536
+# seconds between poses stored in the track, the pose itself is updated on every delta
+TRACK_INTERVAL = 0.5
+# default number of points returned by get_track()
+TRACK_POINTS = 1000
+# columns of a track row
+TIME, NORTH, EAST, DOWN = range(4)
+
+
+class PoseTrack:
+    """
+    Fixed-size ring buffer of (time, north, east, down) rows in one preallocated array.
+    Appending is O(1) and overwrites the oldest row once the buffer is full
+    """
+
+    def __init__(self, capacity: int = TRACK_CAPACITY) -> None:
+        self.rows = np.zeros((capacity, 4))
+        self.capacity = capacity
+        # index of the next row to write, and rows written so far up to capacity
+        self.head = 0
+        self.size = 0
+
+    def append(self, timestamp: float, north: float, east: float, down: float) -> None:
+        self.rows[self.head] = (timestamp, north, east, down)
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def decimated(self, points: int) -> np.ndarray:
+        """
+        Returns at most "points" rows, oldest first, evenly spread over the buffer.
+        The newest row is always included
+        """
+        if self.size == 0 or points <= 0:
+            return self.rows[:0]
+        start = (self.head - self.size) % self.capacity
+        step = max(1, math.ceil(self.size / points))
+        # count back from the newest row so it is always part of the track
+        offsets = np.arange(self.size - 1, -1, -step)[::-1]
+        return self.rows[(start + offsets) % self.capacity]
+
+    def clear(self) -> None:
+        self.head = 0
+        self.size = 0
+
+
+def body_to_ned(delta: Sequence[float], roll: float, pitch: float, yaw: float) -> List[float]:
+    """
+    Rotates a vehicle frame (forward, right, down) vector to north, east, down
+    """
+    cr, sr = math.cos(roll), math.sin(roll)
+    cp, sp = math.cos(pitch), math.sin(pitch)
+    cy, sy = math.cos(yaw), math.sin(yaw)
+    x, y, z = delta
+    return [
+        cp * cy * x + (sr * sp * cy - cr * sy) * y + (cr * sp * cy + sr * sy) * z,
+        cp * sy * x + (sr * sp * sy + cr * cy) * y + (cr * sp * sy - sr * cy) * z,
+        -sp * x + sr * cp * y + cr * cp * z,
+    ]
+
+
+class DeadReckoning:
+    """
+    Integrates the DVL position deltas into a position relative to where it was last reset,
+    rotating each one from the vehicle frame by the vehicle's attitude
+    """
+
+    def __init__(self, capacity: int = TRACK_CAPACITY, interval: float = TRACK_INTERVAL) -> None:
+        self.track = PoseTrack(capacity)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.position = [0.0, 0.0, 0.0]
+        self.last_stored = 0.0
+        # deltas integrated, and skipped because the attitude was unknown
+        self.updates = 0
+        self.skipped = 0
+        self.last_update: Optional[float] = None
+
+    def update(self, delta: Sequence[float], attitude: Optional[Sequence[float]], now: Optional[float] = None) -> None:
+        """
+        Adds "delta", in meters in the vehicle frame, rotated by "attitude" (roll, pitch, yaw in rad)
+        """
+        if attitude is None:
+            self.skipped += 1
+            return
+        now = time.time() if now is None else now
+        north, east, down = body_to_ned(delta, *attitude)
+        with self.lock:
+            position = self.position
+            position[0] += north
+            position[1] += east
+            position[2] += down
+            self.updates += 1
+            self.last_update = now
+            if now - self.last_stored >= self.interval:
+                self.last_stored = now
+                self.track.append(now, *position)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.position = [0.0, 0.0, 0.0]
+            self.last_stored = 0.0
+            self.track.clear()
+
+    def get_pose(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "north": self.position[0],
+                "east": self.position[1],
+                "down": self.position[2],
+                "time": self.last_update,
+                "updates": self.updates,
+                "skipped": self.skipped,
+            }
+
+    def get_track(self, points: int = TRACK_POINTS) -> Dict[str, List[float]]:
+        """
+        Returns the decimated track as columns, ready to be serialized
+        """
+        with self.lock:
+            rows = self.track.decimated(points)
+            return {
+                "time": rows[:, TIME].tolist(),
+                "north": rows[:, NORTH].tolist(),
+                "east": rows[:, EAST].tolist(),
+                "down": rows[:, DOWN].tolist(),
+            }
@@ -1,7 +1,6 @@
 """
 Code for integration of Cerulean DVL with Companion and ArduSub
 """
-import json
 import math
 import os
 import socket
@@ -9,21 +8,68 @@ import threading
 import time
 from enum import Enum
 from select import select
-from typing import Any, Dict, List
+from time import perf_counter
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
 import pynmea2
 
 from loguru import logger
 
+import geodesy
 from blueoshelper import request
+from commandchannel import CommandChannel
+from deadreckoning import DeadReckoning
+from dvlconfiguration import DvlConfiguration
+from lineframer import LineFramer
 # from dvlfinder import find_the_dvl
-from mavlink2resthelper import GPS_GLOBAL_ORIGIN_ID, Mavlink2RestHelper
+from mavlink2resthelper import GPS_GLOBAL_ORIGIN_ID, TRANSPORT_HTTP, Mavlink2RestHelper
+from mavlinksender import MavlinkSender, SendPolicy
+from metrics import REGISTRY
+from nmeaparser import parse_ack, parse_configuration, parse_ext, parse_pdl
+from origintracker import OriginState, OriginTracker
+from paramsync import Param, ParamSync
+from rangefinderoutput import RangefinderOutput
+from recorder import Recorder
+from settingsstore import SettingsStore
+from telemetry import TelemetryEntry
 
 HOSTNAME = "192.168.2.3"
 DVL_DOWN = 1
 DVL_FORWARD = 2
-LATLON_TO_CM = 1.1131884502145034e5
 POOL_MODE_COMMAND = "MANUAL-MODE 0.001,10.0,0.5,56,0.1,50,20.6,-0.671,100,100"
 AUTOMATIC_MODE_COMMAND = "MANUAL-MODE OFF"
+# SET-SENSOR-ORIENTATION angles of each mounting
+ORIENTATION_ANGLES = {DVL_DOWN: "0,0,0", DVL_FORWARD: "0,90,0"}
+# ms, older cached telemetry is not used for GPS position estimates
+TELEMETRY_MAX_AGE_MS = 500
+# seconds the receive loop waits for a datagram before checking for timeouts
+RECEIVE_TIMEOUT = 0.5
+# lines are dispatched on this many leading bytes, enough to tell the DVL sentences apart
+LINE_PREFIX_LENGTH = 5
+# metrics label of each line prefix
+LINE_TYPES = {b"$DVPD": "pdl", b"$DVEX": "ext", b"GPS:$": "gps", b"$DVNV": "configuration", b"$DVAC": "ack"}
+
+DATAGRAMS = REGISTRY.counter("dvl_datagrams_received_total", "UDP datagrams received from the DVL")
+BYTES = REGISTRY.counter("dvl_bytes_received_total", "Bytes received from the DVL")
+LINES = REGISTRY.counter("dvl_lines_framed_total", "Complete lines split out of the datagrams")
+TIMEOUTS = REGISTRY.counter("dvl_receive_timeouts_total", "Times the DVL was silent for longer than the timeout")
+RECONNECTS = REGISTRY.counter("dvl_reconnects_total", "Times the DVL socket was set up again")
+PARSE_FAILURES = {
+    kind: REGISTRY.counter("dvl_parse_failures_total", "Sentences that failed to parse", type=kind)
+    for kind in ["pdl", "ext", "gps"]
+}
+# (sentences, handler seconds) by line prefix
+LINE_METRICS = {
+    prefix: (
+        REGISTRY.counter("dvl_sentences_total", "Lines received, by sentence", type=kind),
+        REGISTRY.histogram("dvl_handler_seconds", "Time spent handling each line, by sentence", type=kind),
+    )
+    for prefix, kind in LINE_TYPES.items()
+}
+OTHER_LINE_METRICS = (
+    REGISTRY.counter("dvl_sentences_total", "Lines received, by sentence", type="other"),
+    REGISTRY.histogram("dvl_handler_seconds", "Time spent handling each line, by sentence", type="other"),
+)
 
 
 class MessageType(str, Enum):
@@ -48,7 +94,6 @@ class DvlDriver(threading.Thread):
 
     status = "Starting"
     version = ""
-    mav = Mavlink2RestHelper()
     socket = None
     command_port = 50000
     port = 27000
@@ -63,10 +108,16 @@ class DvlDriver(threading.Thread):
     origin = [0, 0]
     settings_path = os.path.join(os.path.expanduser(
         "~"), ".config", "dvl", "settings.json")
-    configuration = []
+    param_sync_report: Dict[str, Any] = {}
 
     should_send = MessageType.POSITION_DELTA
+    transport = TRANSPORT_HTTP
     reset_counter = 0
+    # time source of the GPS, rangefinder and origin timeouts, replaced by a virtual clock when replaying
+    clock = staticmethod(time.monotonic)
+    # time source of the MAVLink timestamps and the dead-reckoning track, replaced by the same virtual clock
+    # when replaying
+    wall_clock = staticmethod(time.time)
     #timestamp = 0
 
     # Cerulean DVL Info
@@ -84,63 +135,91 @@ class DvlDriver(threading.Thread):
     dvl_altitude = -1
     pool_mode = False
 
-    def __init__(self, orientation=DVL_DOWN) -> None:
-        threading.Thread.__init__(self)
+    def __init__(self, orientation=DVL_DOWN, mav: Optional[Mavlink2RestHelper] = None) -> None:
+        threading.Thread.__init__(self, name="DvlDriver")
         self.current_orientation = orientation
+        # per driver, it holds this driver's listeners, telemetry and connections
+        self.mav = mav or Mavlink2RestHelper()
+        # the receive thread only parses and submits, the sender threads talk to mavlink2rest
+        self.sender = MavlinkSender()
+        self.rangefinder_output = RangefinderOutput()
+        self.framer = LineFramer()
+        # paced commands to the DVL, acknowledged through the data socket
+        self.commands = CommandChannel(self.send_command)
+        # what the DVL reported in its last $DVNVM, plus the settings it acknowledged since
+        self.dvl_configuration = DvlConfiguration()
+        # the pending "?" of setup_dvl, the settings are sent from the receive loop once it is answered
+        self.configuration_request: Optional[Future] = None
+        self.dead_reckoning = DeadReckoning()
+        # off until enabled from the web API
+        self.recorder = Recorder()
+        self.mav.outgoing_listeners.append(self.recorder.record_mavlink)
+        # through a lambda, replay replaces the clock after the driver is created
+        self.origin_tracker = OriginTracker(self.request_origin, clock=lambda: self.clock())
+        self.mav.telemetry.listeners.append(self.on_telemetry)
+        # written in the background, so setters called from the receive loop never wait on the disk
+        self.settings_store = SettingsStore(self.settings_values())
+        # state already counted elsewhere, replacing the gauges of any previous driver
+        for name, help_text, function in [
+            ("dvl_sender_queue_depth", "Messages waiting to be sent", lambda: len(self.sender.queue)),
+            ("dvl_sender_dropped_total", "Messages dropped by the send policies",
+             lambda: sum(self.sender.dropped.values())),
+            ("dvl_sender_sent_total", "Messages handed to mavlink2rest", lambda: self.sender.sent),
+            ("dvl_sender_failed_total", "Messages mavlink2rest did not accept", lambda: self.sender.failed),
+            ("dvl_framing_overflows_total", "Lines dropped for being too long", lambda: self.framer.overflows),
+        ]:
+            REGISTRY.unregister(name)
+            REGISTRY.gauge(name, help_text, function)
+        # keyed by the first LINE_PREFIX_LENGTH bytes of $DVPDL, $DVEXT, GPS:$, $DVNVM and $DVACK, lines
+        self.line_handlers = {
+            b"$DVPD": self.handle_pdl_line,
+            b"$DVEX": self.handle_ext_line,
+            b"GPS:$": self.handle_gps_line,
+            b"$DVNV": self.handle_configuration_line,
+            b"$DVAC": self.handle_ack_line,
+        }
 
     def report_status(self, msg: str) -> None:
         self.status = msg
         logger.debug(msg)
 
+    def settings_values(self) -> Dict[str, Any]:
+        """
+        Returns the persisted settings, as saved in .config/dvl/settings.json
+        """
+        return {
+            "enabled": self.enabled,
+            "orientation": self.current_orientation,
+            "hostname": self.hostname,
+            "origin": list(self.origin),
+            "rangefinder_enable": self.rangefinder_enable,
+            "should_send": getattr(self.should_send, "value", self.should_send),
+            "transport": self.transport,
+            "rangefinder_rate": self.rangefinder_output.rate,
+            "rangefinder_threshold": self.rangefinder_output.threshold,
+        }
+
     def load_settings(self) -> None:
         """
         Load settings from .config/dvl/settings.json
         """
-        try:
-            with open(self.settings_path) as settings:
-                data = json.load(settings)
-                self.enabled = data["enabled"]
-                self.current_orientation = data["orientation"]
-                self.hostname = data["hostname"]
-                self.origin = data["origin"]
-                self.rangefinder_enable = data["rangefinder_enable"]
-                self.should_send = data["should_send"]
-
-        except FileNotFoundError:
-            logger.warning("Settings file not found, using default.")
-        except ValueError:
-            logger.warning("File corrupted, using default settings.")
-        except KeyError as error:
-            logger.warning("key not found: ", error)
-            logger.warning("using default instead")
+        data = self.settings_store.load(self.settings_path, self.settings_values())
+        self.enabled = data["enabled"]
+        self.current_orientation = data["orientation"]
+        self.hostname = data["hostname"]
+        self.origin = data["origin"]
+        self.rangefinder_enable = data["rangefinder_enable"]
+        if MessageType.contains(data["should_send"]):
+            self.should_send = data["should_send"]
+        self.transport = data["transport"]
+        if not self.rangefinder_output.configure(data["rangefinder_rate"], data["rangefinder_threshold"]):
+            logger.warning("Invalid rangefinder output settings, using default.")
 
     def save_settings(self) -> None:
         """
-        Load settings from .config/dvl/settings.json
+        Queues the settings for the background writer of .config/dvl/settings.json, without waiting for the disk
         """
-
-        def ensure_dir(file_path) -> None:
-            """
-            Helper to guarantee that the file path exists
-            """
-            directory = os.path.dirname(file_path)
-            if not os.path.exists(directory):
-                os.makedirs(directory)
-
-        ensure_dir(self.settings_path)
-        with open(self.settings_path, "w") as settings:
-            settings.write(
-                json.dumps(
-                    {
-                        "enabled": self.enabled,
-                        "orientation": self.current_orientation,
-                        "hostname": self.hostname,
-                        "origin": self.origin,
-                        "rangefinder_enable": self.rangefinder_enable,
-                        "should_send": self.should_send,
-                    }
-                )
-            )
+        self.settings_store.update(self.settings_values())
 
     def get_status(self) -> dict:
         """
@@ -152,8 +231,21 @@ class DvlDriver(threading.Thread):
             "orientation": self.current_orientation,
             "hostname": self.hostname,
             "origin": self.origin,
+            "origin_tracker": self.origin_tracker.get_status(),
             "rangefinder_enable": self.rangefinder_enable,
             "should_send": self.should_send,
+            "transport": self.transport,
+            "websocket_connected": self.mav.websocket_connected,
+            "template_cache": self.mav.templates.stats(),
+            "settings": self.settings_store.get_status(),
+            "param_sync": self.param_sync_report,
+            "latency": self.get_latency(),
+            "sender": self.sender.get_status(),
+            "rangefinder_output": self.rangefinder_output.get_status(),
+            "framing_overflows": self.framer.overflows,
+            "recorder": self.recorder.get_status(),
+            "commands": self.commands.get_status(),
+            "dvl_configuration_received": self.dvl_configuration.received_at,
             "dvl_lock": self.dvl_lock,
             "dvl_gps_status": self.dvl_gps_status,
             "dvl_calibration": self.dvl_calibration,
@@ -200,24 +292,20 @@ class DvlDriver(threading.Thread):
         self.report_status("Waiting for vehicle...")
         while not self.mav.get("/HEARTBEAT"):
             time.sleep(1)
+        self.mav.check_restart()
 
-    def set_orientation(self, orientation: int) -> bool:
+    def set_orientation(self, orientation: int) -> Optional[Future]:
         """
-        Sets the DVL orientation, either DVL_FORWARD or DVL_DOWN
+        Sets the DVL orientation, either DVL_FORWARD or DVL_DOWN.
+        Returns the future of the DVL's acknowledgement, None if the orientation is invalid
         """
 
-        if orientation in [DVL_FORWARD, DVL_DOWN]:
-            if orientation == DVL_DOWN:
-                angles = "0,0,0"
-            elif orientation == DVL_FORWARD:
-                angles = "0,90,0"
-            message = "SET-SENSOR-ORIENTATION " + angles + "\r\n"
-            self.socket.sendto(
-                message.encode(), (self.host, self.command_port))
+        if orientation in ORIENTATION_ANGLES:
+            future = self.send_setting("SET-SENSOR-ORIENTATION", ORIENTATION_ANGLES[orientation])
             self.current_orientation = orientation
             self.save_settings()
-            return True
-        return False
+            return future
+        return None
 
     def set_should_send(self, should_send):
         if not MessageType.contains(should_send):
@@ -225,86 +313,87 @@ class DvlDriver(threading.Thread):
         self.should_send = should_send
         self.save_settings()
 
+    def set_transport(self, transport: str) -> bool:
+        """
+        Selects the mavlink2rest transport used for outgoing messages, "http" or "websocket"
+        """
+        if not self.mav.set_transport(transport):
+            return False
+        self.transport = transport
+        self.save_settings()
+        return True
+
     @staticmethod
     def longitude_scale(lat: float):
         """
         from https://github.com/ArduPilot/ardupilot/blob/Sub-4.1/libraries/AP_Common/Location.cpp#L325
         """
-        scale = math.cos(math.radians(lat))
-        return max(scale, 0.01)
+        return geodesy.longitude_scale(lat)
 
     def lat_lng_to_NE_XY_cm(self, lat: float, lon: float) -> List[float]:
         """
         From https://github.com/ArduPilot/ardupilot/blob/Sub-4.1/libraries/AP_Common/Location.cpp#L206
         """
-        x = (lat - self.origin[0]) * LATLON_TO_CM
-        y = self.longitude_scale(
-            (lat + self.origin[0]) / 2) * LATLON_TO_CM * (lon - self.origin[1])
-        return [x, y]
+        return geodesy.lat_lng_to_NE_XY_cm(lat, lon, self.origin)
 
-    def has_origin_set(self) -> bool:
-        try:
-            old_time = self.mav.get_float(
-                "/GPS_GLOBAL_ORIGIN/message/time_usec")
-            if math.isnan(old_time):
-                logger.warning(
-                    "Unable to read current time for GPS_GLOBAL_ORIGIN, using 0")
-                old_time = 0
-        except Exception as e:
-            logger.warning(
-                f"Unable to read current time for GPS_GLOBAL_ORIGIN, using 0: {e}")
-            old_time = 0
-
-        for attempt in range(5):
-            logger.debug(f"Trying to read origin, try # {attempt}")
-            self.mav.request_message(GPS_GLOBAL_ORIGIN_ID)
-            time.sleep(0.1)  # make this a timeout?
-            try:
-                new_origin_data = json.loads(
-                    self.mav.get("/GPS_GLOBAL_ORIGIN/message"))
-                if new_origin_data["time_usec"] != old_time:
-                    self.origin = [new_origin_data["latitude"]
-                                   * 1e-7, new_origin_data["longitude"] * 1e-7]
-                    return True
-                continue  # try again
-            except Exception as e:
-                logger.warning(e)
-                return False
-        return False
+    def on_telemetry(self, name: str, entry: TelemetryEntry) -> None:
+        """
+        Keeps self.origin in sync with the origin reported by the autopilot
+        """
+        self.origin_tracker.on_telemetry(name, entry)
+        if name == "GPS_GLOBAL_ORIGIN" and self.origin_tracker.origin is not None:
+            self.origin = self.origin_tracker.origin
+
+    def request_origin(self) -> None:
+        """
+        Queues a GPS_GLOBAL_ORIGIN request, the answer reaches the origin tracker through the telemetry cache
+        """
+        self.sender.submit(
+            "REQUEST_GPS_GLOBAL_ORIGIN", SendPolicy.REPLACE, self.mav.request_message, GPS_GLOBAL_ORIGIN_ID
+        )
 
     def set_current_position(self, lat: float, lon: float):
         """
         Sets the EKF origin to lat, lon
         """
         # If origin has never been set, set it
-        now = time.time()
+        now = self.clock()
         if (now < (self.last_gps_timestamp + (self.gps_update_interval))):
             # TODO this is to limit the rate of the GPS updates. Unfortunately this is necessary.
             return
         self.last_gps_timestamp = now
-        if not self.has_origin_set():
+        self.origin_tracker.tick(self.clock())
+        if self.origin_tracker.state == OriginState.UNKNOWN:
             logger.info("Origin was never set, trying to set it.")
             self.set_gps_origin(lat, lon)
+        elif not self.origin_tracker.usable:
+            logger.debug(f"Origin is {self.origin_tracker.state.value}, waiting for the autopilot")
         else:
             logger.info(
                 "Origin has already been set, sending POSITION_ESTIMATE instead")
             # if we already have an origin set, send a new position instead
             x, y = self.lat_lng_to_NE_XY_cm(lat, lon)
-            depth = float(self.mav.get("/VFR_HUD/message/alt"))
-
-            attitude = json.loads(self.mav.get("/ATTITUDE/message"))
-            attitudes = [attitude["roll"], attitude["pitch"], attitude["yaw"]]
+            vfr_hud = self.mav.get_telemetry("VFR_HUD", TELEMETRY_MAX_AGE_MS)
+            attitude = self.mav.get_telemetry("ATTITUDE", TELEMETRY_MAX_AGE_MS)
+            if vfr_hud is None or attitude is None:
+                logger.warning("No recent VFR_HUD/ATTITUDE, skipping position estimate")
+                return
+            depth = float(vfr_hud.message["alt"])
+            attitudes = [attitude.message["roll"], attitude.message["pitch"], attitude.message["yaw"]]
             positions = [x, y, -depth]
             self.reset_counter += 1
-            self.mav.send_vision_position_estimate(
-                self.last_gps_timestamp, positions, attitudes, reset_counter=self.reset_counter
+            self.sender.submit(
+                "GLOBAL_VISION_POSITION_ESTIMATE", SendPolicy.REPLACE, self.mav.send_vision_position_estimate,
+                self.wall_clock(), positions, attitudes, self.reset_counter
             )
 
     def set_gps_origin(self, lat: float, lon: float) -> None:
         """
         Sets the EKF origin to lat, lon
         """
-        self.mav.set_gps_origin(lat, lon)
+        # before sending, so a fast confirmation isn't overwritten
+        self.origin_tracker.expect()
+        self.sender.submit("SET_GPS_GLOBAL_ORIGIN", SendPolicy.REPLACE, self.mav.set_gps_origin, lat, lon)
         self.origin = [float(lat), float(lon)]
         self.save_settings()
 
@@ -331,28 +420,59 @@ class DvlDriver(threading.Thread):
                 "RNGFND1_TYPE", "MAV_PARAM_TYPE_UINT8", 10)  # MAVLINK
         return True
 
-    def set_pool_mode(self, enable: bool) -> bool:
+    def set_recording(self, enable: bool) -> bool:
         """
-        Enables/disables DISTANCE_SENSOR messages
+        Starts/stops recording the DVL datagrams and the MAVLink messages sent
         """
-        self.pool_mode = enable
-        # self.save_settings()
         if enable:
-            message = POOL_MODE_COMMAND + "\r\n"
-            self.socket.sendto(
-                message.encode(), (self.host, self.command_port))
-        else:
-            message = AUTOMATIC_MODE_COMMAND + "\r\n"
-            self.socket.sendto(
-                message.encode(), (self.host, self.command_port))
+            return self.recorder.start()
+        return self.recorder.stop()
+
+    def set_rangefinder_output(self, rate: float, threshold: float) -> bool:
+        """
+        Sets the maximum DISTANCE_SENSOR rate (Hz) and the altitude change (m) worth sending
+        """
+        if not self.rangefinder_output.configure(rate, threshold):
+            return False
+        self.save_settings()
         return True
 
+    def send_rangefinder(self, distance: float, orientation: int = DVL_DOWN) -> None:
+        """
+        Queues a DISTANCE_SENSOR message, unless the rangefinder output stage suppresses it
+        """
+        distance = self.rangefinder_output.update(distance, self.clock())
+        if distance is not None:
+            self.sender.submit("DISTANCE_SENSOR", SendPolicy.REPLACE, self.mav.send_rangefinder, distance, orientation)
+
+    def flush_rangefinder(self) -> None:
+        """
+        Queues the latest altitude the rangefinder output stage held back, once it is due
+        """
+        if not self.rangefinder_enable:
+            return
+        distance = self.rangefinder_output.flush(self.clock())
+        if distance is not None:
+            self.sender.submit(
+                "DISTANCE_SENSOR", SendPolicy.REPLACE, self.mav.send_rangefinder, distance, self.current_orientation
+            )
+
+    def set_pool_mode(self, enable: bool) -> Future:
+        """
+        Switches the DVL between the pool mode and the automatic mode, returns the future of its acknowledgement
+        """
+        self.pool_mode = enable
+        # self.save_settings()
+        name, value = (POOL_MODE_COMMAND if enable else AUTOMATIC_MODE_COMMAND).split(" ", 1)
+        return self.send_setting(name, value)
+
     def setup_mavlink(self) -> None:
         """
         Sets up mavlink streamrates so we have the needed messages at the
         appropriate rates
         """
         self.report_status("Setting up MAVLink streams...")
+        self.mav.templates.preload(["COMMAND_LONG", "PARAM_SET", "PARAM_REQUEST_READ"])
         self.mav.ensure_message_frequency("ATTITUDE", 30, 30)
         self.mav.ensure_message_frequency("GLOBAL_POSITION_INT", 33, 30)
         self.mav.ensure_message_frequency("LOCAL_POSITION_NED", 32, 30)
@@ -362,33 +482,55 @@ class DvlDriver(threading.Thread):
         Sets up the required params for DVL integration
         """
         # https://ardupilot.org/copter/docs/parameters.html#rngfnd1-parameters
-
-        self.mav.set_param("AHRS_EKF_TYPE", "MAV_PARAM_TYPE_UINT8", 3)
-        # TODO: Check if really required. It doesn't look like the ekf2 stops at all
-        self.mav.set_param("EK2_ENABLE", "MAV_PARAM_TYPE_UINT8", 0)
-
-        self.mav.set_param("EK3_ENABLE", "MAV_PARAM_TYPE_UINT8", 1)
-        self.mav.set_param("VISO_TYPE", "MAV_PARAM_TYPE_UINT8", 1)
-        self.mav.set_param("EK3_GPS_TYPE", "MAV_PARAM_TYPE_UINT8", 3)
-        self.mav.set_param("GPS_TYPE", "MAV_PARAM_TYPE_UINT8", 1)
-        self.mav.set_param(
-            "EK3_SRC1_POSXY", "MAV_PARAM_TYPE_UINT8", 6)  # EXTNAV
-        self.mav.set_param(
-            "EK3_SRC1_VELXY", "MAV_PARAM_TYPE_UINT8", 6)  # EXTNAV
-        self.mav.set_param("EK3_SRC1_POSZ", "MAV_PARAM_TYPE_UINT8", 1)  # BARO
+        self.report_status("Setting up parameters...")
+        params = [
+            Param("AHRS_EKF_TYPE", "MAV_PARAM_TYPE_UINT8", 3),
+            # TODO: Check if really required. It doesn't look like the ekf2 stops at all
+            Param("EK2_ENABLE", "MAV_PARAM_TYPE_UINT8", 0),
+            Param("EK3_ENABLE", "MAV_PARAM_TYPE_UINT8", 1),
+            Param("VISO_TYPE", "MAV_PARAM_TYPE_UINT8", 1),
+            Param("EK3_GPS_TYPE", "MAV_PARAM_TYPE_UINT8", 3),
+            Param("GPS_TYPE", "MAV_PARAM_TYPE_UINT8", 1),
+            Param("EK3_SRC1_POSXY", "MAV_PARAM_TYPE_UINT8", 6),  # EXTNAV
+            Param("EK3_SRC1_VELXY", "MAV_PARAM_TYPE_UINT8", 6),  # EXTNAV
+            Param("EK3_SRC1_POSZ", "MAV_PARAM_TYPE_UINT8", 1),  # BARO
+        ]
         if self.rangefinder_enable:
-            self.mav.set_param(
-                "RNGFND1_TYPE", "MAV_PARAM_TYPE_UINT8", 10)  # MAVLINK
-            self.mav.set_param(
-                "RNGFND1_MAX_CM", "MAV_PARAM_TYPE_UINT8", 5000)
+            params.append(Param("RNGFND1_TYPE", "MAV_PARAM_TYPE_UINT8", 10))  # MAVLINK
+            params.append(Param("RNGFND1_MAX_CM", "MAV_PARAM_TYPE_UINT8", 5000))
+        self.param_sync_report = ParamSync(self.mav).sync(params)
 
-    def setup_dvl(self):
-        self.set_gps_enabled()
-        self.set_dvpdl_enabled()
-        self.set_dvext_enabled()
-        self.set_retweet_imu_enabled(False)
-        self.set_gprmc_enabled(False)
-        self.set_orientation(self.current_orientation)
+    def desired_configuration(self) -> Dict[str, str]:
+        """
+        Returns the DVL settings the driver needs, by command name
+        """
+        return {
+            "RETWEET-GPS": "ON",
+            "SEND-DVPDL": "ON",
+            "SEND-DVEXT": "ON",
+            "RETWEET-IMU": "OFF",
+            "SEND-GPRMC": "OFF",
+            "SET-SENSOR-ORIENTATION": ORIENTATION_ANGLES.get(self.current_orientation, ORIENTATION_ANGLES[DVL_DOWN]),
+        }
+
+    def setup_dvl(self) -> Future:
+        """
+        Asks the DVL for its settings. Once the answer is in, or the DVL didn't answer, the receive loop
+        sends the settings that differ from the desired configuration with apply_configuration()
+        """
+        self.configuration_request = self.get_configuration()
+        return self.configuration_request
+
+    def apply_configuration(self) -> None:
+        """
+        Sends the settings that differ from the desired configuration, all of them if the DVL never reported its own
+        """
+        changes = self.dvl_configuration.diff(self.desired_configuration())
+        if not changes:
+            logger.info("DVL configuration is up to date")
+        for name, value in changes.items():
+            logger.info(f"Setting DVL {name} to {value}")
+            self.send_setting(name, value)
 
     # TCP
     def setup_connections(self, timeout=300) -> None:
@@ -419,7 +561,7 @@ class DvlDriver(threading.Thread):
                 self.socket.setsockopt(
                     socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
                 self.socket.setblocking(False)
-                self.socket.bind(('0.0.0.0', 27000))
+                self.socket.bind(('0.0.0.0', self.port))
                 return True
             except socket.error:
                 time.sleep(0.1)
@@ -431,6 +573,7 @@ class DvlDriver(threading.Thread):
         return False
 
     def reconnect(self):
+        RECONNECTS.inc()
         if self.socket:
             try:
                 self.socket.shutdown(socket.SHUT_RDWR)
@@ -473,7 +616,7 @@ class DvlDriver(threading.Thread):
         angles = [0, 0, 0]
 
         if self.rangefinder_enable:
-            self.mav.send_rangefinder(alt)
+            self.send_rangefinder(alt)
 
         if not valid:
             logger.info("Invalid  dvl reading, ignoring it.")
@@ -481,16 +624,20 @@ class DvlDriver(threading.Thread):
 
         if self.should_send == MessageType.POSITION_DELTA:
             if self.current_orientation == DVL_DOWN:
-                self.mav.send_vision(
-                    [dx, dy, dz], angles, dt=data["time"] * 1e3, confidence=confidence)
+                self.sender.submit(
+                    "VISION_POSITION_DELTA", SendPolicy.KEEP, self.mav.send_vision,
+                    [dx, dy, dz], angles, confidence, data["time"] * 1e3)
             elif self.current_orientation == DVL_FORWARD:
-                self.mav.send_vision(
-                    [dz, dy, -dx], angles, dt=data["time"] * 1e3, confidence=confidence)
+                self.sender.submit(
+                    "VISION_POSITION_DELTA", SendPolicy.KEEP, self.mav.send_vision,
+                    [dz, dy, -dx], angles, confidence, data["time"] * 1e3)
         elif self.should_send == MessageType.SPEED_ESTIMATE:
             if self.current_orientation == DVL_DOWN:
-                self.mav.send_vision_speed_estimate([vx, vy, vz])
+                self.sender.submit(
+                    "VISION_SPEED_ESTIMATE", SendPolicy.REPLACE, self.mav.send_vision_speed_estimate, [vx, vy, vz])
             elif self.current_orientation == DVL_FORWARD:
-                self.mav.send_vision_speed_estimate([vz, vy, -vx])
+                self.sender.submit(
+                    "VISION_SPEED_ESTIMATE", SendPolicy.REPLACE, self.mav.send_vision_speed_estimate, [vz, vy, -vx])
 
     def handle_PDL(self, data):
         dx, dy, dz = data.pdx, data.pdy, data.pdz
@@ -499,16 +646,28 @@ class DvlDriver(threading.Thread):
 
         angles = [0, 0, 0]
 
+        self.dead_reckon(dx, dy, dz)
         if self.should_send == MessageType.POSITION_DELTA:
             if self.current_orientation == DVL_DOWN:
-                self.mav.send_vision(
-                    [dx, dy, dz], angles, dt=dt, confidence=c)
+                self.sender.submit(
+                    "VISION_POSITION_DELTA", SendPolicy.KEEP, self.mav.send_vision, [dx, dy, dz], angles, c, dt)
                 return True
             elif self.current_orientation == DVL_FORWARD:
-                self.mav.send_vision(
-                    [dz, dy, -dx], angles, dt=dt, confidence=c)
+                self.sender.submit(
+                    "VISION_POSITION_DELTA", SendPolicy.KEEP, self.mav.send_vision, [dz, dy, -dx], angles, c, dt)
                 return True
 
+    def dead_reckon(self, dx: float, dy: float, dz: float) -> None:
+        """
+        Integrates a DVL position delta into the on-board dead-reckoning position
+        """
+        delta = [dx, dy, dz] if self.current_orientation == DVL_DOWN else [dz, dy, -dx]
+        # the latest attitude, however old, beats dropping the delta
+        attitude = self.mav.get_telemetry("ATTITUDE", math.inf)
+        if attitude is not None:
+            attitude = (attitude.message["roll"], attitude.message["pitch"], attitude.message["yaw"])
+        self.dead_reckoning.update(delta, attitude, self.wall_clock())
+
     def handle_EXT(self, data):
 
         self.dvl_lock = data.v
@@ -525,18 +684,12 @@ class DvlDriver(threading.Thread):
         self.dvl_altitude = data.t
 
         if self.rangefinder_enable and self.dvl_altitude > 0.05:
-            self.mav.send_rangefinder(
-                self.dvl_altitude, self.current_orientation)
-
-    def handle_configuration(self, cfg):
-        # Clear Config
-        self.configuration = []
-        # Set new config
-        for i in cfg.split(","):
-            item = i.split("=")
-            if len(item) > 1:
-                self.configuration.append(item)
-                print(item)
+            self.send_rangefinder(self.dvl_altitude, self.current_orientation)
+
+    def handle_configuration(self, values: Dict[str, str]) -> None:
+        changed = self.dvl_configuration.update(values)
+        if changed:
+            logger.info(f"DVL configuration: {changed}")
 
     # def handle_position_local(self, data):
     #     # if True:
@@ -548,80 +701,151 @@ class DvlDriver(threading.Thread):
     #                                         yaw], reset_counter=self.reset_counter
     #         )
 
-    def is_nmea(self, packet):
-        try:
-            if pynmea2.parse(packet):
-                return True
-            else:
-                return False
-        except Exception as error:
-            pass
-
-    def is_gps_passthrough(self, packet):
-        # print(packet)
-        try:
-            if (packet[0:5] == 'GPS:$'):
-                return True
-            else:
-                return False
-        except Exception as error:
-            pass
-
-    def is_configuration(self, packet):
-        # print(packet)
-        try:
-            if (packet[0:7] == "$DVNVM,"):
-                return True
-            else:
-                return False
-        except Exception as error:
-            pass
-
     def set_gps_enabled(self, enable=True):
         setting = "RETWEET-GPS"
-        self.set_dvl_setting(setting, enable)
+        return self.set_dvl_setting(setting, enable)
 
     def set_dvpdl_enabled(self, enable=True):
         setting = "SEND-DVPDL"
-        self.set_dvl_setting(setting, enable)
+        return self.set_dvl_setting(setting, enable)
 
     def set_dvext_enabled(self, enable=True):
         setting = "SEND-DVEXT"
-        self.set_dvl_setting(setting, enable)
+        return self.set_dvl_setting(setting, enable)
 
     def set_retweet_imu_enabled(self, enable=True):
         setting = "RETWEET-IMU"
-        self.set_dvl_setting(setting, enable)
+        return self.set_dvl_setting(setting, enable)
 
     def set_gprmc_enabled(self, enable=True):
         setting = "SEND-GPRMC"
-        self.set_dvl_setting(setting, enable)
+        return self.set_dvl_setting(setting, enable)
 
-    def set_dvl_setting(self, setting, enable=True):
+    def set_dvl_setting(self, setting, enable=True) -> Future:
         command = ""
         if enable:
             command = "ON"
         else:
             command = "OFF"
-        message = setting + " " + command + "\r\n"
-        self.socket.sendto(message.encode(), (self.host, self.command_port))
-        time.sleep(0.1)
+        return self.send_setting(setting, command)
 
-    def get_configuration(self):
-        message = "?" + "\r\n"
-        self.socket.sendto(message.encode(), (self.host, self.command_port))
+    def send_setting(self, name: str, value: str) -> Future:
+        """
+        Queues the command setting "name" to "value", which is cached once the DVL acknowledges it,
+        or once it is sent to a DVL that doesn't acknowledge commands
+        """
+        future = self.commands.submit(f"{name} {value}")
 
-    def resume(self):
-        message = "RESUME" + "\r\n"
-        self.socket.sendto(message.encode(), (self.host, self.command_port))
+        def on_done(done: Future) -> None:
+            if done.exception() is None and done.result() is not False:
+                self.dvl_configuration.set(name, value)
 
-    def pause(self):
-        message = "PAUSE" + "\r\n"
-        self.socket.sendto(message.encode(), (self.host, self.command_port))
+        future.add_done_callback(on_done)
+        return future
 
-    def reboot(self):
-        message = "REBOOT" + "\r\n"
-        self.socket.sendto(message.encode(), (self.host, self.command_port))
+    def send_command(self, data: bytes) -> None:
+        """
+        Sends one command datagram to the DVL command port, from the data socket the DVL answers to
+        """
+        if self.socket is None:
+            raise OSError("DVL socket is not set up")
+        self.socket.sendto(data, (self.host, self.command_port))
+
+    def get_configuration(self) -> Future:
+        return self.commands.submit("?", reply=True)
+
+    def resume(self) -> Future:
+        return self.commands.submit("RESUME")
+
+    def pause(self) -> Future:
+        return self.commands.submit("PAUSE")
+
+    def reboot(self) -> Future:
+        # never repeated, a late acknowledgement would reboot it twice
+        return self.commands.submit("REBOOT", retries=0)
+
+    def parse_nmea(self, line: bytes):
+        """
+        Parses a NMEA sentence with pynmea2, returns None if it is malformed
+        """
+        try:
+            return pynmea2.parse(line.decode("ascii"))
+        except (pynmea2.ParseError, UnicodeDecodeError) as error:
+            logger.debug(f"Unable to parse {line}: {error}")
+            return None
+
+    def handle_pdl_line(self, line: bytes) -> None:
+        data = parse_pdl(line)
+        if data is None:
+            PARSE_FAILURES["pdl"].inc()
+            logger.debug(f"Unable to parse {line}")
+            return
+        self.handle_PDL(data)
+
+    def handle_ext_line(self, line: bytes) -> None:
+        data = parse_ext(line)
+        if data is None:
+            PARSE_FAILURES["ext"].inc()
+            logger.debug(f"Unable to parse {line}")
+            return
+        self.handle_EXT(data)
+
+    def handle_gps_line(self, line: bytes) -> None:
+        data = self.parse_nmea(line[4:])
+        if data is None:
+            PARSE_FAILURES["gps"].inc()
+        try:
+            if data is not None and data.latitude and data.longitude:
+                if data.gps_qual > 0 and float(data.horizontal_dil) < 1.8 and float(data.num_sats) > 5:
+                    self.set_current_position(data.latitude, data.longitude)
+        except (AttributeError, TypeError, ValueError) as error:
+            # not a GGA sentence, or one with empty fields
+            logger.debug(f"Ignoring GPS passthrough {line}: {error}")
+
+    def handle_configuration_line(self, line: bytes) -> None:
+        values = parse_configuration(line)
+        if values is None:
+            logger.debug(f"Unable to parse {line}")
+            return
+        self.handle_configuration(values)
+        # the settings are the reply to "?", resolved once they are cached
+        self.commands.answer("?")
+
+    def handle_ack_line(self, line: bytes) -> None:
+        ack = parse_ack(line)
+        if ack is None:
+            logger.debug(f"Unable to parse {line}")
+            return
+        self.commands.acknowledge(*ack)
+
+    def handle_line(self, line: bytes) -> None:
+        """
+        Dispatches one line received from the DVL to its handler, by prefix
+        """
+        started = perf_counter()
+        prefix = line[:LINE_PREFIX_LENGTH]
+        handler = self.line_handlers.get(prefix)
+        if handler is not None:
+            handler(line)
+        elif not line.startswith(b"$"):
+            # other NMEA sentences are not used, anything else is worth a look
+            print(line.decode("ascii", errors="replace"))
+        sentences, seconds = LINE_METRICS.get(prefix, OTHER_LINE_METRICS)
+        sentences.value += 1
+        seconds.observe(perf_counter() - started)
+
+    def get_latency(self) -> Dict[str, float]:
+        """
+        Returns percentiles, in ms, of the recent packet-to-MAVLink latencies
+        """
+        samples = sorted(self.sender.latencies)
+        if not samples:
+            return {}
+        return {
+            "p50": round(samples[len(samples) // 2] * 1e3, 3),
+            "p99": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e3, 3),
+            "max": round(samples[-1] * 1e3, 3),
+        }
 
     def run(self):
         """
@@ -629,92 +853,69 @@ class DvlDriver(threading.Thread):
         """
         self.load_settings()
         self.save_settings()
+        self.mav.set_transport(self.transport)
         # self.look_for_dvl()
         self.setup_connections_udp()
+        self.commands.start()
         self.wait_for_vehicle()
+        self.mav.start_telemetry()
         self.setup_mavlink()
         self.setup_params()
-        self.setup_dvl()
+        self.sender.start()
+        self.origin_tracker.start()
         time.sleep(1)
         self.last_recv_time = time.time()
-        buf = ""
-        connected = True
         if (self.enabled):
             self.resume()
-            self.get_configuration()
         else:
             self.pause()
+        # sent right before the loop that reads the answer, so it doesn't time out waiting
+        self.setup_dvl()
         self.report_status("Running")
 
         while True:
+            self.origin_tracker.tick(self.clock())
+            if self.configuration_request is not None and self.configuration_request.done():
+                self.configuration_request = None
+                self.apply_configuration()
             if not self.enabled:
                 time.sleep(1)
-                buf = ""  # Reset buf when disabled
+                self.framer.clear()  # Reset buf when disabled
+                continue
+            # Sleep until a datagram arrives, waking up now and then to check for timeouts
+            r, _, _ = select([self.socket], [], [], RECEIVE_TIMEOUT)
+            if not r:
+                if time.time() - self.last_recv_time > self.timeout:
+                    TIMEOUTS.inc()
+                    self.framer.clear()
+                    self.report_status("timeout, restarting")
+                    self.reconnect()
                 continue
-            r, _, _ = select([self.socket], [], [], 0)
-            data = None
-            line = None
-            if r:
-                try:
-                    recv = self.socket.recv(1024).decode()
-                    connected = True
-                    if recv:
-                        self.last_recv_time = time.time()
-                        buf += recv
-                except socket.error as e:
-                    logger.warning(f"Disconnected: {e}")
-                    connected = False
-                except Exception as e:
-                    logger.warning(f"Error receiving: {e}")
-
-            # Extract 1 complete line from the buffer if available
-            if len(buf) > 0:
-                lines = buf.split("\n", 1)
-                if len(lines) > 1:
-                    buf = lines[1]
-                    line = lines[0]
-            if self.is_nmea(line):
-                data = pynmea2.parse(line)
-                # print(repr(data))
-                if data.sentence_type == 'PDL':
-                    self.handle_PDL(data)
-                elif data.sentence_type == 'EXT':
-                    self.handle_EXT(data)
-                # else:
-                # print(data)
-            elif (self.is_gps_passthrough(line)):
-                try:
-                    data = pynmea2.parse(line[4:])
-                    if data.latitude and data.longitude:
-                        if data.gps_qual > 0 and float(data.horizontal_dil) < 1.8 and float(data.num_sats) > 5:
-                            # print("HDOP: ", str(
-                            #     float(data.horizontal_dil)))
-                            # print("Fix: ", str(data.gps_qual))
-                            self.set_current_position(
-                                data.latitude, data.longitude)
-                except Exception as error:
-                    continue
-            elif self.is_configuration(line):
-                self.handle_configuration(line)
-            elif line != None:
-                print(line)
-
-            if not connected:
-                buf = ""
+            try:
+                recv = self.framer.recv_from(self.socket)
+            except socket.error as e:
+                logger.warning(f"Disconnected: {e}")
+                self.framer.clear()
                 self.report_status("restarting")
                 self.reconnect()
-                time.sleep(0.003)
                 continue
-
-            if not line:
-                if time.time() - self.last_recv_time > self.timeout:
-                    buf = ""
-                    self.report_status("timeout, restarting")
-                    connected = self.reconnect()
-                time.sleep(0.003)
+            except Exception as e:
+                logger.warning(f"Error receiving: {e}")
+                continue
+            if not recv:
                 continue
+            self.last_recv_time = time.time()
+            DATAGRAMS.value += 1
+            BYTES.value += recv
+            if self.recorder.active:
+                self.recorder.record_datagram(self.framer.view[self.framer.length - recv : self.framer.length])
+
+            # Handle every complete line in the buffer right away, keeping the partial tail
+            lines = self.framer.pop_lines()
+            LINES.value += len(lines)
+            for line in lines:
+                self.handle_line(line)
+            self.flush_rangefinder()
 
             self.status = "Running"
-
-            time.sleep(0.003)
         logger.error("Driver Quit! This should not happen.")
@@ -0,0 +1,80 @@
+"""
+Cache of the settings the DVL reports in its $DVNVM replies, so the driver only sends the commands
+that change something.
+"""
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+
+class ConfigurationEntry(NamedTuple):
+    value: str
+    timestamp: float  # time.time() the value was reported or acknowledged
+
+
+def normalize(value: str) -> str:
+    # the DVL is not picky about case and spacing, "on" and "0, 90, 0" are the same settings
+    return value.replace(" ", "").upper()
+
+
+class DvlConfiguration:
+    """
+    DVL settings by command name, updated from the $DVNVM replies and from acknowledged commands.
+    The replies name each setting after the command that changes it. Settings they don't report are
+    never known, so their commands are always sent
+    """
+
+    def __init__(self) -> None:
+        self.entries: Dict[str, ConfigurationEntry] = {}
+        self.lock = threading.Lock()
+        # time.time() of the last $DVNVM, None until the DVL reported its settings once
+        self.received_at: Optional[float] = None
+
+    def update(self, values: Dict[str, str], now: Optional[float] = None) -> Dict[str, str]:
+        """
+        Stores the settings of a $DVNVM reply, returns the ones that changed, by command name
+        """
+        now = time.time() if now is None else now
+        changed = {}
+        with self.lock:
+            for key, value in values.items():
+                name = key.upper()
+                previous = self.entries.get(name)
+                if previous is None or previous.value != value:
+                    changed[name] = value
+                self.entries[name] = ConfigurationEntry(value, now)
+            self.received_at = now
+        return changed
+
+    def set(self, name: str, value: str, now: Optional[float] = None) -> None:
+        """
+        Stores a setting the DVL acknowledged
+        """
+        with self.lock:
+            self.entries[name.upper()] = ConfigurationEntry(value, time.time() if now is None else now)
+
+    def get(self, name: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(name.upper())
+        return entry.value if entry is not None else None
+
+    def diff(self, desired: Dict[str, str]) -> Dict[str, str]:
+        """
+        Returns the settings of "desired" that the DVL doesn't have, all of them if it never reported its settings
+        """
+        with self.lock:
+            if self.received_at is None:
+                return dict(desired)
+            changes = {}
+            for name, value in desired.items():
+                entry = self.entries.get(name.upper())
+                if entry is None or normalize(entry.value) != normalize(value):
+                    changes[name] = value
+            return changes
+
+    def get_status(self) -> Dict:
+        with self.lock:
+            return {
+                "received_at": self.received_at,
+                "settings": {name: entry._asdict() for name, entry in sorted(self.entries.items())},
+            }
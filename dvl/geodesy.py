@@ -0,0 +1,62 @@
+"""
+Flat-earth conversions between lat/lon and north/east offsets from the EKF origin, the same
+approximation ArduPilot uses in Location.cpp. The scalar functions are used by the driver,
+the *_batch ones convert whole tracks at once for replay and post-dive analysis.
+"""
+import math
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# LOCATION_SCALING_FACTOR from Location.cpp, for degrees instead of 1e-7 degrees
+LATLON_TO_CM = 1.1131884502145034e5
+# longitude_scale() is clamped so offsets near the poles stay finite
+MIN_LONGITUDE_SCALE = 0.01
+
+
+def longitude_scale(lat: float) -> float:
+    """
+    from https://github.com/ArduPilot/ardupilot/blob/Sub-4.1/libraries/AP_Common/Location.cpp#L325
+    """
+    scale = math.cos(math.radians(lat))
+    return max(scale, MIN_LONGITUDE_SCALE)
+
+
+def lat_lng_to_NE_XY_cm(lat: float, lon: float, origin: Sequence[float]) -> List[float]:
+    """
+    From https://github.com/ArduPilot/ardupilot/blob/Sub-4.1/libraries/AP_Common/Location.cpp#L206
+    """
+    x = (lat - origin[0]) * LATLON_TO_CM
+    y = longitude_scale((lat + origin[0]) / 2) * LATLON_TO_CM * (lon - origin[1])
+    return [x, y]
+
+
+def longitude_scale_batch(lat: np.ndarray) -> np.ndarray:
+    """
+    longitude_scale() of every element of "lat"
+    """
+    return np.maximum(np.cos(np.radians(lat)), MIN_LONGITUDE_SCALE)
+
+
+def lat_lng_to_NE_XY_cm_batch(lat: np.ndarray, lon: np.ndarray, origin: Sequence[float]) -> np.ndarray:
+    """
+    Converts arrays of lat/lon to an (N, 2) array of north/east offsets from "origin",
+    with the same arithmetic as lat_lng_to_NE_XY_cm()
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    out = np.empty((lat.size, 2))
+    out[:, 0] = (lat - origin[0]) * LATLON_TO_CM
+    out[:, 1] = longitude_scale_batch((lat + origin[0]) / 2) * LATLON_TO_CM * (lon - origin[1])
+    return out
+
+
+def NE_XY_cm_to_lat_lng_batch(ne: np.ndarray, origin: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Inverse of lat_lng_to_NE_XY_cm_batch(), as Location::offset() does it: the latitude first,
+    then the longitude scaled at the midpoint between the origin and that latitude
+    """
+    ne = np.asarray(ne, dtype=np.float64).reshape(-1, 2)
+    lat = origin[0] + ne[:, 0] / LATLON_TO_CM
+    lon = origin[1] + ne[:, 1] / (LATLON_TO_CM * longitude_scale_batch((lat + origin[0]) / 2))
+    return lat, lon
@@ -0,0 +1,88 @@
+import socket
+from typing import List
+
+# largest possible UDP payload, so datagrams are never truncated
+MAX_DATAGRAM_SIZE = 65535
+# longer lines are garbage (NMEA sentences are 82 characters, $DVNVM replies a few hundred)
+MAX_LINE_LENGTH = 4096
+
+
+class LineFramer:
+    """
+    Splits the datagrams received from the DVL into lines.
+    Datagrams are received straight into a preallocated bytearray, complete lines are split out
+    of it in one pass and only the trailing partial line is moved back to the start of the buffer.
+    """
+
+    def __init__(self, max_line_length: int = MAX_LINE_LENGTH, datagram_size: int = MAX_DATAGRAM_SIZE) -> None:
+        self.max_line_length = max_line_length
+        self.buffer = bytearray(max_line_length + datagram_size)
+        self.view = memoryview(self.buffer)
+        # bytes of the pending partial line, at the start of the buffer
+        self.length = 0
+        # lines dropped for exceeding max_line_length
+        self.overflows = 0
+        # set while dropping the rest of an overlong line, up to its terminator
+        self.discarding = False
+
+    def recv_from(self, sock: socket.socket) -> int:
+        """
+        Receives one datagram from "sock" into the buffer. Returns its size
+        """
+        received = sock.recv_into(self.view[self.length :])
+        self.length += received
+        return received
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Appends "data" to the buffer and returns the complete lines, for data that doesn't come from a socket
+        """
+        capacity = len(self.buffer) - self.max_line_length
+        if len(data) <= capacity:
+            self.view[self.length : self.length + len(data)] = data
+            self.length += len(data)
+            return self.pop_lines()
+        lines = []
+        for offset in range(0, len(data), capacity):
+            lines.extend(self.feed(data[offset : offset + capacity]))
+        return lines
+
+    def pop_lines(self) -> List[bytes]:
+        """
+        Returns every complete line in the buffer, without line terminators,
+        and keeps the trailing partial line for the next datagram
+        """
+        end = self.length
+        last = self.buffer.rfind(b"\n", 0, end)
+        lines: List[bytes] = []
+        if last >= 0:
+            # the complete lines are copied out once, the partial tail stays in place
+            chunk = bytes(self.view[:last])
+            lines = chunk.split(b"\n")
+            if self.discarding:
+                # rest of an overlong line
+                del lines[0]
+                self.discarding = False
+            if b"\r" in chunk:
+                lines = [line.rstrip(b"\r") for line in lines]
+            if last > self.max_line_length:
+                kept = [line for line in lines if len(line) <= self.max_line_length]
+                self.overflows += len(lines) - len(kept)
+                lines = kept
+
+        start = last + 1
+        pending = end - start
+        if pending > self.max_line_length:
+            # no line terminator in sight, drop it so the buffer can't fill up
+            if not self.discarding:
+                self.overflows += 1
+            self.discarding = True
+            pending = 0
+        elif start and pending:
+            self.buffer[:pending] = bytes(self.view[start:end])
+        self.length = pending
+        return lines
+
+    def clear(self) -> None:
+        self.length = 0
+        self.discarding = False
@@ -6,11 +6,30 @@ Driver for the Cerulean DVL
 
 from flask import Flask
 import json
+import math
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Optional
 from dvl import DvlDriver
+from metrics import REGISTRY
+from profiler import SamplingProfiler, collapsed
 
 # set the project root directory as the static folder, you can set others.
 app = Flask(__name__, static_url_path="/static", static_folder="static")
 thread = None
+# seconds a request waits for the DVL to acknowledge a command
+COMMAND_WAIT = 2.0
+
+
+def confirmed(future: Optional[Future]) -> bool:
+    """
+    Waits for the acknowledgement of a DVL command. Commands the DVL doesn't acknowledge at all count as accepted
+    """
+    if future is None:
+        return False
+    try:
+        return future.result(COMMAND_WAIT) is not False
+    except (FutureTimeoutError, TimeoutError):
+        return False
 
 
 class API:
@@ -19,6 +38,7 @@ class API:
 
     def __init__(self, dvl: DvlDriver):
         self.dvl = dvl
+        self.profiler = SamplingProfiler()
 
     def get_status(self) -> str:
         """
@@ -27,6 +47,83 @@ class API:
         """
         return json.dumps(self.dvl.get_status())
 
+    def get_origin(self) -> str:
+        """
+        Returns the EKF origin negotiation state as a JSON containing the keys
+        state, last_transition, origin, and requests
+        """
+        return json.dumps(self.dvl.origin_tracker.get_status())
+
+    def get_pose(self) -> str:
+        """
+        Returns the dead-reckoning position in meters from where it was last reset, as a JSON
+        containing the keys north, east, down, time, updates, and skipped
+        """
+        return json.dumps(self.dvl.dead_reckoning.get_pose())
+
+    def get_track(self, points: int) -> str:
+        """
+        Returns up to "points" poses of the dead-reckoning track, as a JSON
+        containing the lists time, north, east, and down
+        """
+        return json.dumps(self.dvl.dead_reckoning.get_track(points))
+
+    def reset_pose(self) -> bool:
+        """
+        Moves the dead-reckoning origin to the current position and clears the track
+        """
+        self.dvl.dead_reckoning.reset()
+        return True
+
+    def get_configuration(self) -> str:
+        """
+        Returns the cached DVL settings as a JSON containing the keys received_at, and settings,
+        with the value and timestamp of each setting
+        """
+        return json.dumps(self.dvl.dvl_configuration.get_status())
+
+    def refresh_configuration(self) -> bool:
+        """
+        Asks the DVL for its settings, returns True once they were received
+        """
+        return confirmed(self.dvl.get_configuration())
+
+    def get_metrics(self) -> str:
+        """
+        Returns the pipeline counters and histograms in the Prometheus text format
+        """
+        return REGISTRY.render()
+
+    def get_metrics_summary(self) -> str:
+        """
+        Returns the pipeline counters and histogram percentiles as a JSON
+        """
+        return json.dumps(REGISTRY.summary())
+
+    def parse_profile_duration(self, seconds: str) -> Optional[float]:
+        """
+        Returns the profile duration in "seconds", None if it is not a finite number
+        """
+        try:
+            duration = float(seconds)
+        except ValueError:
+            return None
+        return duration if math.isfinite(duration) else None
+
+    def profile(self, duration: float) -> Optional[str]:
+        """
+        Samples the stacks of every thread for "duration" seconds and returns them in the collapsed stack format,
+        None if a profile is already running
+        """
+        stacks = self.profiler.profile(duration)
+        return collapsed(stacks) if stacks is not None else None
+
+    def get_profiler_status(self) -> str:
+        """
+        Returns the profiler state as a JSON containing the keys running, interval, and last_profile
+        """
+        return json.dumps(self.profiler.get_status())
+
     def set_enabled(self, enabled: str) -> bool:
         """
         Enables/Disables the DVL driver
@@ -41,7 +138,7 @@ class API:
         1 = Down
         2 = Forward
         """
-        return self.dvl.set_orientation(orientation)
+        return confirmed(self.dvl.set_orientation(orientation))
 
     def set_hostname(self, hostname: str) -> bool:
         """
@@ -68,12 +165,35 @@ class API:
         Enables/disables usage of DVL as rangefinder
         """
         if enabled in ["true", "false"]:
-            return self.dvl.set_pool_mode(enabled == "true")
+            return confirmed(self.dvl.set_pool_mode(enabled == "true"))
         return False
 
     def set_message_type(self, messagetype: str):
         self.dvl.set_should_send(messagetype)
 
+    def set_recording(self, enabled: str) -> bool:
+        """
+        Enables/disables recording of the DVL traffic and the MAVLink messages sent
+        """
+        if enabled in ["true", "false"]:
+            return self.dvl.set_recording(enabled == "true")
+        return False
+
+    def set_rangefinder_output(self, rate: str, threshold: str) -> bool:
+        """
+        Sets the maximum DISTANCE_SENSOR rate in Hz and the altitude change in meters worth sending
+        """
+        try:
+            return self.dvl.set_rangefinder_output(float(rate), float(threshold))
+        except ValueError:
+            return False
+
+    def set_transport(self, transport: str) -> bool:
+        """
+        Selects how MAVLink messages are sent to mavlink2rest, "http" or "websocket"
+        """
+        return self.dvl.set_transport(transport)
+
 
 if __name__ == "__main__":
     driver = DvlDriver()
@@ -83,6 +203,55 @@ if __name__ == "__main__":
     def get_status():
         return api.get_status()
 
+    @app.route("/configuration")
+    def get_configuration():
+        return api.get_configuration()
+
+    @app.route("/refresh_configuration")
+    def refresh_configuration():
+        return str(api.refresh_configuration())
+
+    @app.route("/metrics")
+    def get_metrics():
+        return api.get_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    @app.route("/metrics.json")
+    def get_metrics_summary():
+        return api.get_metrics_summary()
+
+    @app.route("/profile")
+    @app.route("/profile/<seconds>")
+    def profile(seconds: str = "10"):
+        duration = api.parse_profile_duration(seconds)
+        if duration is None:
+            return "Invalid duration", 400
+        result = api.profile(duration)
+        if result is None:
+            return "A profile is already running", 409
+        headers = {"Content-Type": "text/plain", "Content-Disposition": "attachment; filename=profile.collapsed"}
+        return result, 200, headers
+
+    @app.route("/profile_status")
+    def get_profiler_status():
+        return api.get_profiler_status()
+
+    @app.route("/origin")
+    def get_origin():
+        return api.get_origin()
+
+    @app.route("/pose")
+    def get_pose():
+        return api.get_pose()
+
+    @app.route("/track")
+    @app.route("/track/<int:points>")
+    def get_track(points: int = 1000):
+        return api.get_track(points)
+
+    @app.route("/reset_pose")
+    def reset_pose():
+        return str(api.reset_pose())
+
     @app.route("/enable/<enable>")
     def set_enabled(enable: str):
         return str(api.set_enabled(enable))
@@ -91,6 +260,14 @@ if __name__ == "__main__":
     def set_use_rangefinder(enable: str):
         return str(api.set_use_as_rangefinder(enable))
 
+    @app.route("/rangefinder_output/<rate>/<threshold>")
+    def set_rangefinder_output(rate: str, threshold: str):
+        return str(api.set_rangefinder_output(rate, threshold))
+
+    @app.route("/recording/<enable>")
+    def set_recording(enable: str):
+        return str(api.set_recording(enable))
+
     @app.route("/orientation/<int:orientation>")
     def set_orientation(orientation: int):
         return str(api.set_orientation(orientation))
@@ -99,6 +276,10 @@ if __name__ == "__main__":
     def set_message_type(messagetype: str):
         return str(api.set_message_type(messagetype))
 
+    @app.route("/transport/<transport>")
+    def set_transport(transport: str):
+        return str(api.set_transport(transport))
+
     @app.route("/setcurrentposition/<lat>/<lon>")
     def set_current_position(lat, lon):
         return str(api.set_current_position(lat, lon))
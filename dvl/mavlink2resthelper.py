@@ -1,15 +1,42 @@
 import json
+import os
+import threading
 import time
-from math import radians
-from typing import Any, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-import requests
 from loguru import logger
 
-from blueoshelper import post, request
-
-MAVLINK2REST_URL = "http://192.168.2.2/mavlink2rest"
+from blueoshelper import ConnectionPool
+from mavlinkencoder import (
+    encode_distance_sensor,
+    encode_global_vision_position_estimate,
+    encode_set_gps_global_origin,
+    encode_statustext,
+    encode_vision_position_delta,
+    encode_vision_speed_estimate,
+)
+from mavlinkwebsocket import MavlinkWebsocket
+from metrics import REGISTRY
+from telemetry import TELEMETRY_MESSAGES, TelemetryCache, TelemetryEntry, TelemetrySubscriber
+
+# overridable to run against a local stub, see mavlink2reststub.py
+MAVLINK2REST_URL = os.environ.get("MAVLINK2REST_URL", "http://192.168.2.2/mavlink2rest")
 GPS_GLOBAL_ORIGIN_ID = 49
+# per socket operation, so a stalled mavlink2rest can't hang the caller
+REQUEST_TIMEOUT = 1.0
+# a few connections are enough for the receive thread, the web API and the startup calls
+POOL_SIZE = 4
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+TRANSPORT_HTTP = "http"
+TRANSPORT_WEBSOCKET = "websocket"
+# messages pushed over the websocket, telemetry instead of being polled and PARAM_VALUE for ParamSync
+PUSHED_MESSAGES = TELEMETRY_MESSAGES + ["PARAM_VALUE"]
+# cached telemetry older than this (in ms) is not used to answer get()
+TELEMETRY_MAX_AGE = 1000
+
+POST_SECONDS = REGISTRY.histogram("mavlink2rest_post_seconds", "Duration of the POSTs to mavlink2rest")
+POST_FAILURES = REGISTRY.counter("mavlink2rest_post_failures_total", "POSTs mavlink2rest did not accept or answer")
 
 # holds the last status so we dont flood it
 last_status = ""
@@ -17,182 +44,148 @@ last_status = ""
 # pylint: disable=too-many-instance-attributes
 
 
+class TemplateCache:
+    """
+    Thread-safe cache of mavlink2rest /helper/mavlink templates, keyed by message name
+    """
+
+    def __init__(self, fetch: Callable[[str], bytes]):
+        self.fetch = fetch
+        self.lock = threading.Lock()
+        self.templates: Dict[str, bytes] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, message_name: str) -> Any:
+        """
+        Returns a fresh copy of the template for "message_name", fetching it on first use.
+        Raises if it can't be fetched
+        """
+        with self.lock:
+            raw = self.templates.get(message_name)
+            if raw is not None:
+                self.hits += 1
+        if raw is None:
+            raw = self.fetch(message_name)
+            with self.lock:
+                self.misses += 1
+                self.templates[message_name] = raw
+        # parsed on every call so callers can fill in the copy they get
+        return json.loads(raw)
+
+    def preload(self, message_names: List[str]) -> None:
+        """
+        Fetches every template in "message_names" that is not cached yet
+        """
+        for message_name in message_names:
+            try:
+                self.get(message_name)
+            except Exception as error:
+                logger.warning(f"Unable to preload mavlink template for {message_name}: {error}")
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.templates = {}
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.templates)}
+
+
 class Mavlink2RestHelper:
     """
     Responsible for interfacing with Mavlink2Rest
     """
 
-    def __init__(self, vehicle: int = 1, component: int = 1):
+    def __init__(self, vehicle: int = 1, component: int = 1, url: str = MAVLINK2REST_URL):
         # store vehicle and component to access telemetry data from
         self.vehicle = vehicle
         self.component = component
-        # store vision template data so we don't need to fetch it multiple times
+        # keep-alive connections shared by every GET and POST, instead of a new TCP connection per message
+        self.pool = ConnectionPool(url, size=POOL_SIZE, timeout=REQUEST_TIMEOUT)
+        self.websocket_url = url.replace("http", "ws", 1) + "/ws/mavlink"
+        self.websocket: Optional[MavlinkWebsocket] = None
+        self.transport = TRANSPORT_HTTP
+        # latest telemetry, pushed over the websocket or polled by the subscriber
+        self.telemetry = TelemetryCache()
+        self.subscriber: Optional[TelemetrySubscriber] = None
+        # callbacks receiving every message pushed over the websocket
+        self.listeners: List[Callable[[Any], None]] = []
+        # callbacks receiving every JSON payload sent to mavlink2rest, e.g. the session recorder
+        self.outgoing_listeners: List[Callable[[bytes], None]] = []
+        self.templates = TemplateCache(self.fetch_helper_template)
+        # first_update of the HEARTBEAT as seen by mavlink2rest, changes when mavlink2rest restarts
+        self.heartbeat_first_update: Optional[str] = None
         self.start_time = time.time()
-        self.vision_template = """
-{{
-  "header": {{
-    "system_id": 255,
-    "component_id": 0,
-    "sequence": 0
-  }},
-  "message": {{
-    "type": "VISION_POSITION_DELTA",
-    "time_usec": 0,
-    "time_delta_usec": {dt},
-    "angle_delta": [
-      {dRoll},
-      {dPitch},
-      {dYaw}
-    ],
-    "position_delta": [
-      {dx},
-      {dy},
-      {dz}
-    ],
-    "confidence": {confidence}
-  }}
-}}"""
-
-        self.vision_speed_estimate_template = """
-        {{
-  "header": {{
-    "system_id": 255,
-    "component_id": 0,
-    "sequence": 0
-  }},
-  "message": {{
-    "type": "VISION_SPEED_ESTIMATE",
-    "usec": {us},
-    "x": {vx},
-    "y": {vy},
-    "z": {vz},
-    "covariance": [
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0
-    ],
-    "reset_counter": 0
-  }}
-}}"""
-
-        self.global_vision_position_estimate_template = """
-{{
-  "header": {{
-    "system_id": 255,
-    "component_id": 0,
-    "sequence": 0
-  }},
-  "message": {{
-    "type": "GLOBAL_VISION_POSITION_ESTIMATE",
-    "usec": {us},
-    "x": {x},
-    "y": {y},
-    "z": {z},
-    "roll": {roll},
-    "pitch": {pitch},
-    "yaw": {yaw},
-    "covariance": [
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0,
-      0.0
-    ],
-    "reset_counter": {reset_counter}
-  }}
-}}"""
-
-        self.gps_origin_template = """
-{{
-  "header": {{
-    "system_id": 255,
-    "component_id": 0,
-    "sequence": 0
-  }},
-  "message": {{
-    "type": "SET_GPS_GLOBAL_ORIGIN",
-    "latitude": {lat},
-    "longitude": {lon},
-    "altitude": 0,
-    "target_system": 0,
-    "time_usec": 0
-  }}
-}}
-        """
-
-        self.rangefinder_template = """
-{{
-  "header": {{
-    "system_id": 255,
-    "component_id": 0,
-    "sequence": 0
-  }},
-  "message": {{
-    "type": "DISTANCE_SENSOR",
-    "time_boot_ms": 0,
-    "min_distance": 0,
-    "max_distance": 5000,
-    "current_distance": {0},
-    "mavtype": {{
-      "type": "MAV_DISTANCE_SENSOR_LASER"
-    }},
-    "id": 0,
-    "orientation": {{
-      "type": "{1}"
-    }},
-    "covariance": 0,
-    "horizontal_fov": 0.0,
-    "vertical_fov": 0.0,
-    "quaternion": [
-      0.0,
-      0.0,
-      0.0,
-      0.0
-    ],
-    "signal_quality": 0
-  }}
-}}
-"""
-        self.statustext_template = """
-{{
-  "header": {{
-    "system_id": 1,
-    "component_id": 1,
-    "sequence": 0
-  }},
-  "message": {{
-    "type": "STATUSTEXT",
-    "severity": {{
-      "type": "{0}"
-    }},
-    "text": {1},
-    "id": 0,
-    "chunk_seq": 0
-  }}
-}}
-"""
+
+    def set_transport(self, transport: str) -> bool:
+        """
+        Selects how outgoing messages are sent: TRANSPORT_HTTP posts each message,
+        TRANSPORT_WEBSOCKET streams them over one socket and falls back to http while it is down
+        """
+        if transport not in [TRANSPORT_HTTP, TRANSPORT_WEBSOCKET]:
+            return False
+        self.transport = transport
+        if transport == TRANSPORT_WEBSOCKET and self.websocket is None:
+            self.websocket = MavlinkWebsocket(
+                self.websocket_url, f"^({'|'.join(PUSHED_MESSAGES)})$", on_message=self.on_websocket_message
+            )
+            self.websocket.start()
+        elif transport == TRANSPORT_HTTP and self.websocket is not None:
+            self.websocket.stop()
+            self.websocket = None
+        return True
+
+    def start_telemetry(self) -> None:
+        """
+        Starts the background subscriber that keeps the telemetry cache fresh
+        """
+        if self.subscriber is None:
+            self.subscriber = TelemetrySubscriber(
+                self.get_message, self.telemetry, lambda: self.websocket_connected, self.check_restart
+            )
+            self.subscriber.start()
+
+    def get_telemetry(self, message_name: str, max_age_ms: float) -> Optional[TelemetryEntry]:
+        """
+        Returns the cached "message_name" if it is no older than "max_age_ms", None otherwise. Never blocks
+        """
+        return self.telemetry.get(message_name, max_age_ms)
+
+    def on_websocket_message(self, data: Any) -> None:
+        """
+        Stores telemetry pushed by mavlink2rest and hands every message to the listeners
+        """
+        try:
+            header, message = data["header"], data["message"]
+            if header["system_id"] != self.vehicle or header["component_id"] != self.component:
+                return
+            self.telemetry.update(message["type"], message)
+        except (KeyError, TypeError):
+            return
+        for listener in self.listeners:
+            listener(message)
+
+    @property
+    def websocket_connected(self) -> bool:
+        return self.websocket is not None and self.websocket.connected
+
+    def get_cached(self, path: str) -> Optional[str]:
+        """
+        Resolves a REST-style "path" such as "/VFR_HUD/message/alt" against the telemetry cache
+        Returns None if the message is not cached or too old
+        """
+        parts = path.strip("/").split("/")
+        entry = self.telemetry.get(parts[0], TELEMETRY_MAX_AGE)
+        if entry is None:
+            return None
+        value: Any = {"message": entry.message}
+        try:
+            for part in parts[1:]:
+                value = value[int(part)] if isinstance(value, list) else value[part]
+        except (KeyError, IndexError, ValueError, TypeError):
+            return None
+        return json.dumps(value)
 
     def get_float(self, path: str, vehicle: Optional[int] = None, component: Optional[int] = None) -> float:
         """
@@ -213,14 +206,142 @@ class Mavlink2RestHelper:
         Example: get('/VFR_HUD')
         Returns the data as text or False on failure
         """
+        if (vehicle or self.vehicle) == self.vehicle and (component or self.component) == self.component:
+            cached = self.get_cached(path)
+            if cached is not None:
+                return cached
         vehicle = vehicle or self.vehicle
         component = component or self.component
         vehicle_path = f"/vehicles/{vehicle}/components/{component}/messages"
-        response = request(MAVLINK2REST_URL + "/mavlink" + vehicle_path + path)
+        response = self.request("/mavlink" + vehicle_path + path)
         if not response:
             return None
         return response
 
+    def get_message(self, message_name: str) -> Optional[Tuple[int, Any]]:
+        """
+        Fetches the latest "message_name" over http, bypassing the telemetry cache
+        Returns (mavlink2rest counter, message) or None if it is not available
+        """
+        path = f"/mavlink/vehicles/{self.vehicle}/components/{self.component}/messages/{message_name}"
+        try:
+            status, body = self.pool.request("GET", path)
+            if status != 200:
+                # mavlink2rest answers 404 until the autopilot sends the message
+                return None
+            data = json.loads(body)
+            return data["status"]["time"]["counter"], data["message"]
+        except Exception as error:
+            logger.debug(f"Unable to get {message_name}: {error}")
+            return None
+
+    def request(self, path: str) -> Optional[str]:
+        """
+        Sends a GET request to mavlink2rest "path"
+        Returns the text result if successful, None otherwise
+        """
+        try:
+            status, body = self.pool.request("GET", path)
+            if status != 200:
+                logger.warning(f"Error in request: {path}: HTTP {status}")
+                return None
+            return body.decode()
+        except Exception as error:
+            logger.warning(f"Error in request: {path}: {error}")
+            return None
+
+    def post(self, data: bytes) -> Optional[bytes]:
+        """
+        POSTs the JSON "data" payload to mavlink2rest
+        Returns the response content if successful, None otherwise
+        """
+        for listener in self.outgoing_listeners:
+            listener(data)
+        started = time.perf_counter()
+        try:
+            status, body = self.pool.request("POST", "/mavlink", data, JSON_HEADERS)
+            POST_SECONDS.observe(time.perf_counter() - started)
+            if status != 200:
+                POST_FAILURES.inc()
+                logger.warning(f"Error in post: HTTP {status}")
+                logger.warning(data)
+                return None
+            return body
+        except Exception as error:
+            POST_FAILURES.inc()
+            logger.warning(f"Error in post: {error}")
+            logger.warning(data)
+            return None
+
+    def send(self, data: bytes) -> bool:
+        """
+        Sends the JSON "data" payload over the selected transport, falling back to http
+        if the websocket is down. Returns True if the message was handed over successfully
+        """
+        if self.websocket is not None and self.websocket.send(data):
+            for listener in self.outgoing_listeners:
+                listener(data)
+            return True
+        return self.post(data) is not None
+
+    def post_json(self, data: Any) -> bool:
+        """
+        POSTs a message built from a helper template, serialized as JSON, to mavlink2rest
+        Returns True if mavlink2rest accepted it, raises on connection errors.
+        Failures drop the cached templates, as mavlink2rest may have restarted with different ones
+        """
+        payload = json.dumps(data).encode()
+        for listener in self.outgoing_listeners:
+            listener(payload)
+        started = time.perf_counter()
+        try:
+            status, _ = self.pool.request("POST", "/mavlink", payload, JSON_HEADERS)
+        except Exception:
+            POST_FAILURES.inc()
+            self.templates.invalidate()
+            raise
+        POST_SECONDS.observe(time.perf_counter() - started)
+        if status != 200:
+            POST_FAILURES.inc()
+            self.templates.invalidate()
+        return status == 200
+
+    def fetch_helper_template(self, message_name: str) -> bytes:
+        """
+        Fetches the raw JSON template for "message_name" from the mavlink2rest helper
+        """
+        status, body = self.pool.request("GET", f"/helper/mavlink?name={message_name}")
+        if status != 200:
+            raise Exception(f"HTTP {status}")
+        json.loads(body)  # don't cache anything that isn't valid JSON
+        return body
+
+    def get_helper_template(self, message_name: str) -> Any:
+        """
+        Returns a copy of the mavlink2rest helper template for "message_name", cached after the first fetch
+        """
+        return self.templates.get(message_name)
+
+    def check_restart(self) -> bool:
+        """
+        Detects mavlink2rest restarts from the HEARTBEAT first_update timestamp,
+        dropping the cached templates when it happens. Returns True if a restart was detected
+        """
+        heartbeat = self.request(f"/mavlink/vehicles/{self.vehicle}/components/{self.component}/messages/HEARTBEAT")
+        if not heartbeat:
+            return False
+        try:
+            first_update = json.loads(heartbeat)["status"]["time"]["first_update"]
+        except (ValueError, KeyError, TypeError):
+            return False
+        restarted = self.heartbeat_first_update is not None and first_update != self.heartbeat_first_update
+        self.heartbeat_first_update = first_update
+        if restarted:
+            logger.info("mavlink2rest restarted, dropping cached templates and telemetry")
+            self.templates.invalidate()
+            self.telemetry.clear()
+        return restarted
+
     def get_updated_mavlink_message(
         self,
         message_name: str,
@@ -263,8 +384,7 @@ class Mavlink2RestHelper:
         message_name = message_name.upper()
         # load message template from mavlink2rest helper
         try:
-            data = json.loads(requests.get(
-                MAVLINK2REST_URL + "/helper/mavlink?name=COMMAND_LONG").text)
+            data = self.get_helper_template("COMMAND_LONG")
         except Exception as error:
             logger.info(
                 f"unable to get mavlink template for {message_name} from Mavlink2rest: {error}")
@@ -276,8 +396,7 @@ class Mavlink2RestHelper:
         data["message"]["param2"] = int(1000000 / frequency)
 
         try:
-            result = requests.post(MAVLINK2REST_URL + "/mavlink", json=data)
-            return result.status_code == 200
+            return self.post_json(data)
         except Exception as error:
             logger.warning("Error setting message frequency: " + str(error))
             return False
@@ -288,8 +407,7 @@ class Mavlink2RestHelper:
         Returns True if succesful, False otherwise
         """
         try:
-            data = json.loads(requests.get(
-                MAVLINK2REST_URL + "/helper/mavlink?name=PARAM_SET").text)
+            data = self.get_helper_template("PARAM_SET")
 
             for i, char in enumerate(param_name):
                 data["message"]["param_id"][i] = char
@@ -297,22 +415,34 @@ class Mavlink2RestHelper:
             data["message"]["param_type"] = {"type": param_type}
             data["message"]["param_value"] = param_value
 
-            result = requests.post(MAVLINK2REST_URL + "/mavlink", json=data)
-            return result.status_code == 200
+            return self.post_json(data)
         except Exception as error:
             logger.warning(f"Error setting parameter '{param_name}': {error}")
             return False
 
+    def request_param(self, param_name: str) -> bool:
+        """
+        Asks the autopilot to send PARAM_VALUE for "param_name"
+        Returns True if succesful, False otherwise
+        """
+        try:
+            data = self.get_helper_template("PARAM_REQUEST_READ")
+
+            for i, char in enumerate(param_name):
+                data["message"]["param_id"][i] = char
+            data["message"]["param_index"] = -1
+
+            return self.post_json(data)
+        except Exception as error:
+            logger.warning(f"Error requesting parameter '{param_name}': {error}")
+            return False
+
     def send_statustext(self, text: str, severity: str = "MAV_SEVERITY_EMERGENCY"):
         """
         Sends STATUSTEXT message to the GCS
         """
         try:
-            data = self.statustext_template.format(
-                severity, str(list(text)).replace("'", '"'))
-            result = requests.post(
-                MAVLINK2REST_URL + "/mavlink", json=json.loads(data))
-            return result.status_code == 200
+            return self.send(encode_statustext(text, severity))
         except Exception as error:
             logger.warning("Error sending STATUSTEXT: " + str(error))
             return False
@@ -320,45 +450,20 @@ class Mavlink2RestHelper:
     # https://mavlink.io/en/messages/ardupilotmega.html#VISION_POSITION_DELTA
     def send_vision(self, position_deltas, rotation_deltas=(0, 0, 0), confidence=100, dt=125000):
         "Sends message VISION_POSITION_DELTA to flight controller"
-        data = self.vision_template.format(
-            dt=int(dt),
-            dRoll=rotation_deltas[0],
-            dPitch=rotation_deltas[1],
-            dYaw=rotation_deltas[2],
-            dx=position_deltas[0],
-            dy=position_deltas[1],
-            dz=position_deltas[2],
-            confidence=confidence,
-        )
-
-        post(MAVLINK2REST_URL + "/mavlink", data=data)
+        return self.send(encode_vision_position_delta(dt, rotation_deltas, position_deltas, confidence))
 
     def send_vision_speed_estimate(self, speed_estimates):
         "Sends message VISION_SPEED_ESTIMATE to flight controller"
-        data = self.vision_speed_estimate_template.format(
-            us=int((time.time() - self.start_time) * 1e6),
-            vx=speed_estimates[0],
-            vy=speed_estimates[1],
-            vz=speed_estimates[2],
-        )
-
-        post(MAVLINK2REST_URL + "/mavlink", data=data)
+        usec = int((time.time() - self.start_time) * 1e6)
+        return self.send(encode_vision_speed_estimate(usec, speed_estimates))
 
     def send_vision_position_estimate(
         self, timestamp, position_estimates, attitude_estimates=(0.0, 0.0, 0.0), reset_counter=0
     ):
         "Sends message GLOBAL_VISION_POSITION_ESTIMATE to flight controller"
-        data = self.global_vision_position_estimate_template.format(
-            us=int(timestamp * 1e3),
-            roll=radians(attitude_estimates[0]),
-            pitch=radians(attitude_estimates[1]),
-            yaw=radians(attitude_estimates[2]),
-            x=position_estimates[0],
-            y=position_estimates[1],
-            z=position_estimates[2],
-            reset_counter=reset_counter,
-        )
-        logger.info(post(MAVLINK2REST_URL + "/mavlink", data=data))
+        data = encode_global_vision_position_estimate(
+            int(timestamp * 1e3), position_estimates, attitude_estimates, reset_counter)
+        logger.info(self.post(data))
 
     # https://mavlink.io/en/messages/common.html#DISTANCE_SENSOR
     def send_rangefinder(self, distance: float, orientation=1):
@@ -366,20 +471,16 @@ class Mavlink2RestHelper:
         if distance == -1:
             return
         if orientation == 1:
-            sensor_orientation = "MAV_SENSOR_ROTATION_PITCH_270"
+            sensor_orientation = b"MAV_SENSOR_ROTATION_PITCH_270"
         elif orientation == 2:
-            sensor_orientation = "MAV_SENSOR_ROTATION_NONE"
+            sensor_orientation = b"MAV_SENSOR_ROTATION_NONE"
         else:
-            sensor_orientation = "MAV_SENSOR_ROTATION_PITCH_270"
+            sensor_orientation = b"MAV_SENSOR_ROTATION_PITCH_270"
 
-        data = self.rangefinder_template.format(
-            int(distance * 100), str(sensor_orientation).replace("'", '"'))
-        post(MAVLINK2REST_URL + "/mavlink", data=data)
+        return self.send(encode_distance_sensor(int(distance * 100), sensor_orientation))
 
     def set_gps_origin(self, lat, lon):
-        data = self.gps_origin_template.format(
-            lat=int(float(lat) * 1e7), lon=int(float(lon) * 1e7))
-        post(MAVLINK2REST_URL + "/mavlink", data=data)
+        self.post(encode_set_gps_global_origin(lat, lon))
 
     def get_orientation(self):
         """
@@ -393,8 +494,7 @@ class Mavlink2RestHelper:
         """
         # load message template from mavlink2rest helper
         try:
-            data = json.loads(requests.get(
-                MAVLINK2REST_URL + "/helper/mavlink?name=COMMAND_LONG").text)
+            data = self.get_helper_template("COMMAND_LONG")
         except Exception as error:
             logger.warning(f"Unable to request message {msg_id}: {error}")
             return False
@@ -403,8 +503,7 @@ class Mavlink2RestHelper:
         data["message"]["param1"] = msg_id
 
         try:
-            result = requests.post(MAVLINK2REST_URL + "/mavlink", json=data)
-            return result.status_code == 200
+            return self.post_json(data)
         except Exception as error:
             logger.warning(f"Error requesting message: {error}")
             return False
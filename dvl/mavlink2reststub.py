@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for mavlink2rest, for load tests, replays and benchmarks without a vehicle.
+
+Serves the endpoints Mavlink2RestHelper uses: POST /mavlink, GET /helper/mavlink?name=
+and GET /mavlink/vehicles/<v>/components/<c>/messages/<NAME>[/path]. It emulates the parts of
+the autopilot the driver relies on: HEARTBEAT, ATTITUDE and VFR_HUD updated at a fixed rate,
+PARAM_SET and PARAM_REQUEST_READ answered with PARAM_VALUE, and SET_GPS_GLOBAL_ORIGIN answered
+with GPS_GLOBAL_ORIGIN, which can also be requested with MAV_CMD_REQUEST_MESSAGE.
+
+Every message received is recorded. Latency, errors and stalls can be injected, and changed
+while running through GET /stub/config?latency=0.05&error_rate=0.1, with GET /stub/received
+returning the count of each message type received.
+
+    python3 mavlink2reststub.py --port 8088 --latency 0.02 --error-rate 0.05
+    MAVLINK2REST_URL=http://127.0.0.1:8088 python3 main.py
+"""
+
+import argparse
+import copy
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+GPS_GLOBAL_ORIGIN_ID = 49
+# Hz of the emulated HEARTBEAT, ATTITUDE and VFR_HUD
+TELEMETRY_RATE = 10.0
+# received messages kept for inspection
+MAX_RECEIVED = 100000
+HEADER = {"system_id": 255, "component_id": 0, "sequence": 0}
+# /helper/mavlink answers for the messages the driver builds from templates
+TEMPLATES = {
+    "COMMAND_LONG": {
+        "type": "COMMAND_LONG",
+        "param1": 0.0,
+        "param2": 0.0,
+        "param3": 0.0,
+        "param4": 0.0,
+        "param5": 0.0,
+        "param6": 0.0,
+        "param7": 0.0,
+        "command": {"type": "MAV_CMD_NAV_WAYPOINT"},
+        "target_system": 0,
+        "target_component": 0,
+        "confirmation": 0,
+    },
+    "PARAM_SET": {
+        "type": "PARAM_SET",
+        "param_value": 0.0,
+        "target_system": 0,
+        "target_component": 0,
+        "param_id": ["\u0000"] * 16,
+        "param_type": {"type": "MAV_PARAM_TYPE_UINT8"},
+    },
+    "PARAM_REQUEST_READ": {
+        "type": "PARAM_REQUEST_READ",
+        "param_index": 0,
+        "target_system": 0,
+        "target_component": 0,
+        "param_id": ["\u0000"] * 16,
+    },
+}
+
+
+def param_id(message: Dict[str, Any]) -> str:
+    return "".join(message["param_id"]).rstrip("\x00")
+
+
+class StubVehicle:
+    """
+    State of the emulated autopilot as mavlink2rest would show it: the latest copy of each message
+    with its counter, and the parameters
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.messages: Dict[str, Dict[str, Any]] = {}
+        self.params: Dict[str, Tuple[float, Any]] = {}
+        self.origin: Optional[Dict[str, Any]] = None
+
+    def publish(self, message: Dict[str, Any]) -> None:
+        now = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        with self.lock:
+            previous = self.messages.get(message["type"])
+            self.messages[message["type"]] = {
+                "message": message,
+                "status": {
+                    "time": {
+                        "counter": previous["status"]["time"]["counter"] + 1 if previous else 0,
+                        "first_update": previous["status"]["time"]["first_update"] if previous else now,
+                        "last_update": now,
+                        "frequency": TELEMETRY_RATE,
+                    }
+                },
+            }
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return copy.deepcopy(self.messages.get(name))
+
+    def publish_param(self, name: str) -> None:
+        value, param_type = self.params.get(name, (0.0, {"type": "MAV_PARAM_TYPE_REAL32"}))
+        self.publish(
+            {
+                "type": "PARAM_VALUE",
+                "param_id": list(name.ljust(16, "\x00")),
+                "param_value": value,
+                "param_type": param_type,
+                "param_count": len(self.params),
+                "param_index": 65535,
+            }
+        )
+
+    def handle(self, message: Dict[str, Any]) -> None:
+        """
+        Answers "message" the way ArduSub would
+        """
+        kind = message.get("type")
+        if kind == "PARAM_SET":
+            name = param_id(message)
+            self.params[name] = (float(message["param_value"]), message.get("param_type"))
+            self.publish_param(name)
+        elif kind == "PARAM_REQUEST_READ":
+            self.publish_param(param_id(message))
+        elif kind == "SET_GPS_GLOBAL_ORIGIN":
+            self.origin = {
+                "type": "GPS_GLOBAL_ORIGIN",
+                "latitude": message["latitude"],
+                "longitude": message["longitude"],
+                "altitude": message.get("altitude", 0),
+                "time_usec": int(time.time() * 1e6),
+            }
+            self.publish(self.origin)
+        elif kind == "COMMAND_LONG" and message.get("command", {}).get("type") == "MAV_CMD_REQUEST_MESSAGE":
+            if int(message.get("param1", 0)) == GPS_GLOBAL_ORIGIN_ID and self.origin is not None:
+                self.publish(self.origin)
+
+    def tick(self) -> None:
+        now = time.time()
+        self.publish(
+            {
+                "type": "HEARTBEAT",
+                "autopilot": {"type": "MAV_AUTOPILOT_ARDUPILOTMEGA"},
+                "mavtype": {"type": "MAV_TYPE_SUBMARINE"},
+                "system_status": {"type": "MAV_STATE_ACTIVE"},
+            }
+        )
+        self.publish(
+            {
+                "type": "ATTITUDE",
+                "time_boot_ms": int(now * 1e3) % 2**32,
+                "roll": 0.0,
+                "pitch": 0.0,
+                "yaw": 0.0,
+                "rollspeed": 0.0,
+                "pitchspeed": 0.0,
+                "yawspeed": 0.0,
+            }
+        )
+        self.publish(
+            {
+                "type": "VFR_HUD",
+                "airspeed": 0.0,
+                "groundspeed": 0.0,
+                "heading": 0,
+                "throttle": 0,
+                "alt": 0.0,
+                "climb": 0.0,
+            }
+        )
+
+
+class Mavlink2RestStub:
+    """
+    Threaded HTTP server emulating mavlink2rest, with injected "latency" (+- "jitter") seconds per request,
+    "error_rate" of requests answered with HTTP 500, and "stall_rate" of requests starting a stall
+    during which every request hangs for "stall_duration" seconds
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        stall_rate: float = 0.0,
+        stall_duration: float = 5.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_duration = stall_duration
+        self.random = random.Random(seed)
+        self.vehicle = StubVehicle()
+        self.lock = threading.Lock()
+        self.received: List[Tuple[float, Dict[str, Any]]] = []
+        self.requests = 0
+        self.errors = 0
+        self.stalls = 0
+        self.stalled_until = 0.0
+        self.stopped = threading.Event()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.threads: List[threading.Thread] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def configure(self, **settings: float) -> None:
+        for name, value in settings.items():
+            if name in ["latency", "jitter", "error_rate", "stall_rate", "stall_duration"]:
+                setattr(self, name, float(value))
+
+    def inject(self) -> bool:
+        """
+        Applies the latency and stalls to the current request. Returns False if it should fail
+        """
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            if now >= self.stalled_until and self.random.random() < self.stall_rate:
+                self.stalls += 1
+                self.stalled_until = now + self.stall_duration
+            delay = max(0.0, self.stalled_until - now) + max(
+                0.0, self.latency + self.random.uniform(-1, 1) * self.jitter
+            )
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        return not failed
+
+    def receive(self, message: Dict[str, Any]) -> None:
+        with self.lock:
+            if len(self.received) < MAX_RECEIVED:
+                self.received.append((time.monotonic(), message))
+        self.vehicle.handle(message)
+
+    def received_types(self) -> List[str]:
+        with self.lock:
+            return [message.get("type", "") for _, message in self.received]
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for kind in self.received_types():
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+    def handler(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # allow keep-alive
+            disable_nagle_algorithm = True
+
+            def reply(self, status: int, body: Any) -> None:
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                parts = url.path.strip("/").split("/")
+                if parts[0] == "stub":
+                    if parts[1:] == ["config"]:
+                        stub.configure(**query)
+                    self.reply(
+                        200,
+                        {
+                            "counts": stub.counts(),
+                            "requests": stub.requests,
+                            "errors": stub.errors,
+                            "stalls": stub.stalls,
+                        },
+                    )
+                    return
+                if not stub.inject():
+                    self.reply(500, b"{}")
+                elif parts == ["helper", "mavlink"]:
+                    template = TEMPLATES.get(query.get("name", ""))
+                    if template is None:
+                        self.reply(404, b"{}")
+                    else:
+                        self.reply(200, {"header": HEADER, "message": template})
+                elif len(parts) >= 7 and parts[0] == "mavlink" and parts[5] == "messages":
+                    value = stub.vehicle.get(parts[6])
+                    try:
+                        for part in parts[7:]:
+                            value = value[int(part)] if isinstance(value, list) else value[part]
+                    except (KeyError, IndexError, TypeError, ValueError):
+                        value = None
+                    if value is None:
+                        self.reply(404, b"{}")
+                    else:
+                        self.reply(200, value)
+                else:
+                    self.reply(404, b"{}")
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not stub.inject():
+                    self.reply(500, b"{}")
+                    return
+                try:
+                    message = json.loads(body)["message"]
+                except (ValueError, KeyError, TypeError):
+                    self.reply(400, b"{}")
+                    return
+                stub.receive(message)
+                self.reply(200, b"{}")
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        return Handler
+
+    def tick(self) -> None:
+        while not self.stopped.wait(1 / TELEMETRY_RATE):
+            self.vehicle.tick()
+
+    def start(self) -> "Mavlink2RestStub":
+        self.vehicle.tick()
+        for target in [self.server.serve_forever, self.tick]:
+            thread = threading.Thread(target=target, name="Mavlink2RestStub", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with HTTP 500")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction of requests starting a stall")
+    parser.add_argument("--stall-duration", type=float, default=5.0, help="seconds every request hangs in a stall")
+    args = parser.parse_args()
+
+    stub = Mavlink2RestStub(
+        args.host, args.port, args.latency, args.jitter, args.error_rate, args.stall_rate, args.stall_duration
+    ).start()
+    logger.info(f"Stub mavlink2rest at {stub.url}")
+    try:
+        while True:
+            time.sleep(10)
+            logger.info(f"Received: {stub.counts()}")
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compact JSON encoders for the messages sent to mavlink2rest.
+Each message type has one prebuilt byte skeleton, only the numeric fields are filled in per message.
+"""
+import json
+from math import radians
+from typing import Sequence
+
+HEADER = b'{"header":{"system_id":255,"component_id":0,"sequence":0},'
+
+# https://mavlink.io/en/messages/ardupilotmega.html#VISION_POSITION_DELTA
+VISION_POSITION_DELTA = (
+    HEADER + b'"message":{"type":"VISION_POSITION_DELTA","time_usec":0,"time_delta_usec":%d,'
+    b'"angle_delta":[%a,%a,%a],"position_delta":[%a,%a,%a],"confidence":%a}}'
+)
+
+# https://mavlink.io/en/messages/common.html#VISION_SPEED_ESTIMATE
+VISION_SPEED_ESTIMATE = (
+    HEADER + b'"message":{"type":"VISION_SPEED_ESTIMATE","usec":%d,"x":%a,"y":%a,"z":%a,'
+    b'"covariance":[' + b",".join([b"0.0"] * 9) + b'],"reset_counter":0}}'
+)
+
+# https://mavlink.io/en/messages/common.html#GLOBAL_VISION_POSITION_ESTIMATE
+GLOBAL_VISION_POSITION_ESTIMATE = (
+    HEADER + b'"message":{"type":"GLOBAL_VISION_POSITION_ESTIMATE","usec":%d,"x":%a,"y":%a,"z":%a,'
+    b'"roll":%a,"pitch":%a,"yaw":%a,"covariance":[' + b",".join([b"0.0"] * 21) + b'],"reset_counter":%d}}'
+)
+
+# https://mavlink.io/en/messages/common.html#SET_GPS_GLOBAL_ORIGIN
+SET_GPS_GLOBAL_ORIGIN = (
+    HEADER + b'"message":{"type":"SET_GPS_GLOBAL_ORIGIN","latitude":%d,"longitude":%d,"altitude":0,'
+    b'"target_system":0,"time_usec":0}}'
+)
+
+# https://mavlink.io/en/messages/common.html#DISTANCE_SENSOR
+DISTANCE_SENSOR = (
+    HEADER + b'"message":{"type":"DISTANCE_SENSOR","time_boot_ms":0,"min_distance":0,"max_distance":5000,'
+    b'"current_distance":%d,"mavtype":{"type":"MAV_DISTANCE_SENSOR_LASER"},"id":0,"orientation":{"type":"%s"},'
+    b'"covariance":0,"horizontal_fov":0.0,"vertical_fov":0.0,"quaternion":[0.0,0.0,0.0,0.0],"signal_quality":0}}'
+)
+
+# https://mavlink.io/en/messages/common.html#STATUSTEXT, sent as the autopilot so the GCS shows it
+STATUSTEXT = (
+    b'{"header":{"system_id":1,"component_id":1,"sequence":0},'
+    b'"message":{"type":"STATUSTEXT","severity":{"type":"%s"},"text":%s,"id":0,"chunk_seq":0}}'
+)
+
+
+def encode_vision_position_delta(
+    dt: float, rotation_deltas: Sequence[float], position_deltas: Sequence[float], confidence: float
+) -> bytes:
+    return VISION_POSITION_DELTA % (
+        int(dt),
+        float(rotation_deltas[0]),
+        float(rotation_deltas[1]),
+        float(rotation_deltas[2]),
+        float(position_deltas[0]),
+        float(position_deltas[1]),
+        float(position_deltas[2]),
+        float(confidence),
+    )
+
+
+def encode_vision_speed_estimate(usec: int, speed_estimates: Sequence[float]) -> bytes:
+    return VISION_SPEED_ESTIMATE % (
+        usec,
+        float(speed_estimates[0]),
+        float(speed_estimates[1]),
+        float(speed_estimates[2]),
+    )
+
+
+def encode_global_vision_position_estimate(
+    usec: int, position_estimates: Sequence[float], attitude_estimates: Sequence[float], reset_counter: int
+) -> bytes:
+    return GLOBAL_VISION_POSITION_ESTIMATE % (
+        usec,
+        float(position_estimates[0]),
+        float(position_estimates[1]),
+        float(position_estimates[2]),
+        radians(attitude_estimates[0]),
+        radians(attitude_estimates[1]),
+        radians(attitude_estimates[2]),
+        reset_counter,
+    )
+
+
+def encode_set_gps_global_origin(lat: float, lon: float) -> bytes:
+    return SET_GPS_GLOBAL_ORIGIN % (int(float(lat) * 1e7), int(float(lon) * 1e7))
+
+
+def encode_distance_sensor(distance_cm: int, orientation: bytes) -> bytes:
+    return DISTANCE_SENSOR % (distance_cm, orientation)
+
+
+def encode_statustext(text: str, severity: str) -> bytes:
+    return STATUSTEXT % (severity.encode(), json.dumps(list(text)).encode())
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import Any, Callable, Deque, Dict, List
+
+from loguru import logger
+
+# pending messages, past this new KEEP messages are merged into the last queued one of their name
+QUEUE_SIZE = 64
+# number of recent submit-to-sent latencies kept
+LATENCY_SAMPLES = 1000
+
+
+class SendPolicy(str, Enum):
+    KEEP = "KEEP"  # never dropped, merged when the queue is full, e.g. VISION_POSITION_DELTA
+    REPLACE = "REPLACE"  # at most one pending, a newer message replaces it, e.g. DISTANCE_SENSOR
+
+
+def merge_position_deltas(older: tuple, newer: tuple) -> tuple:
+    """
+    Folds the arguments of two send_vision calls into one VISION_POSITION_DELTA covering both,
+    at the lower confidence of the two
+    """
+    position, angle, confidence, dt = older
+    new_position, new_angle, new_confidence, new_dt = newer
+    return (
+        [a + b for a, b in zip(position, new_position)],
+        [a + b for a, b in zip(angle, new_angle)],
+        min(confidence, new_confidence),
+        dt + new_dt,
+    )
+
+
+# KEEP messages by name, and the function folding the arguments of two of them into one
+MERGERS: Dict[str, Callable[[tuple, tuple], tuple]] = {"VISION_POSITION_DELTA": merge_position_deltas}
+
+
+class Entry:
+    __slots__ = ("name", "policy", "function", "args", "submitted")
+
+    def __init__(self, name: str, policy: SendPolicy, function: Callable[..., Any], args: tuple) -> None:
+        self.name = name
+        self.policy = policy
+        self.function = function
+        self.args = args
+        self.submitted = time.perf_counter()
+
+
+class MavlinkSender:
+    """
+    Bounded queue between the DVL receive thread, which only parses and submits,
+    and the worker threads that send the MAVLink messages to mavlink2rest
+    """
+
+    def __init__(self, maxsize: int = QUEUE_SIZE, workers: int = 1) -> None:
+        self.maxsize = maxsize
+        self.workers = workers
+        self.queue: Deque[Entry] = deque()
+        # pending REPLACE entries by message name
+        self.pending: Dict[str, Entry] = {}
+        self.condition = threading.Condition()
+        self.dropped: Dict[str, int] = {}
+        # KEEP messages folded into a queued one because the queue was full
+        self.merged: Dict[str, int] = {}
+        self.sent = 0
+        self.failed = 0
+        # seconds from submit to the message being handed to mavlink2rest
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for i in range(self.workers - len(self.threads)):
+            thread = threading.Thread(target=self.run, name=f"MavlinkSender-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def drop(self, name: str) -> None:
+        self.dropped[name] = self.dropped.get(name, 0) + 1
+
+    def merge(self, name: str, args: tuple) -> bool:
+        """
+        Folds "args" into the last queued message called "name". Returns False if there is none to merge into
+        """
+        merger = MERGERS.get(name)
+        if merger is None:
+            return False
+        for entry in reversed(self.queue):
+            if entry.name == name:
+                entry.args = merger(entry.args, args)
+                self.merged[name] = self.merged.get(name, 0) + 1
+                return True
+        return False
+
+    def submit(self, name: str, policy: SendPolicy, function: Callable[..., Any], *args: Any) -> None:
+        """
+        Queues "function(*args)", which sends MAVLink message "name", following "policy"
+        """
+        with self.condition:
+            if policy == SendPolicy.REPLACE and name in self.pending:
+                # latest value wins, the queued entry keeps its place
+                entry = self.pending[name]
+                entry.args = args
+                entry.submitted = time.perf_counter()
+                self.drop(name)
+                return
+            # past the size KEEP messages are merged, and REPLACE ones are at most one per name
+            if len(self.queue) >= self.maxsize and policy == SendPolicy.KEEP and self.merge(name, args):
+                return
+            entry = Entry(name, policy, function, args)
+            if policy == SendPolicy.REPLACE:
+                self.pending[name] = entry
+            self.queue.append(entry)
+            self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                entry = self.queue.popleft()
+                if entry.policy == SendPolicy.REPLACE:
+                    del self.pending[entry.name]
+            try:
+                result = entry.function(*entry.args)
+            except Exception as error:
+                logger.warning(f"Error sending {entry.name}: {error}")
+                result = False
+            with self.condition:
+                if result is False:
+                    self.failed += 1
+                else:
+                    self.sent += 1
+                self.latencies.append(time.perf_counter() - entry.submitted)
+
+    def get_status(self) -> Dict[str, Any]:
+        with self.condition:
+            return {
+                "queue_depth": len(self.queue),
+                "dropped": dict(self.dropped),
+                "merged": dict(self.merged),
+                "sent": self.sent,
+                "failed": self.failed,
+            }
@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+from typing import Any, Callable, Optional
+from urllib.parse import quote
+
+import websocket
+from loguru import logger
+
+# socket timeout in seconds, bounds sends on a stalled link. An idle receive just waits again
+WEBSOCKET_TIMEOUT = 2.0
+RECONNECT_INTERVAL = 1.0
+
+
+class MavlinkWebsocket(threading.Thread):
+    """
+    Keeps a single WebSocket open to mavlink2rest's /ws/mavlink endpoint.
+    Outgoing messages are streamed over it, incoming messages matching "message_filter"
+    are handed to "on_message". Reconnects in the background whenever the socket drops.
+    """
+
+    def __init__(
+        self, url: str, message_filter: str = ".*", on_message: Optional[Callable[[Any], None]] = None
+    ) -> None:
+        threading.Thread.__init__(self, name="MavlinkWebsocket", daemon=True)
+        self.url = f"{url}?filter={quote(message_filter)}"
+        self.on_message = on_message
+        self.ws: Optional[websocket.WebSocket] = None
+        self.send_lock = threading.Lock()
+        self.running = True
+        self.connects = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.ws is not None
+
+    def send(self, data: bytes) -> bool:
+        """
+        Sends "data" over the socket. Returns False if the socket is down, so the caller can fall back
+        """
+        ws = self.ws
+        if ws is None:
+            return False
+        try:
+            with self.send_lock:
+                ws.send(data, websocket.ABNF.OPCODE_TEXT)
+            return True
+        except Exception as error:
+            logger.warning(f"Error sending over websocket: {error}")
+            self.drop(ws)
+            return False
+
+    def drop(self, ws: websocket.WebSocket) -> None:
+        """
+        Closes "ws" and marks the channel as disconnected, the run loop will reconnect
+        """
+        if self.ws is ws:
+            self.ws = None
+        try:
+            ws.close()
+        except Exception:
+            pass
+
+    def stop(self) -> None:
+        self.running = False
+        ws = self.ws
+        if ws is not None:
+            self.drop(ws)
+
+    def run(self) -> None:
+        while self.running:
+            try:
+                ws = websocket.create_connection(self.url, timeout=WEBSOCKET_TIMEOUT, enable_multithread=True)
+            except Exception as error:
+                logger.debug(f"Unable to open mavlink2rest websocket: {error}")
+                time.sleep(RECONNECT_INTERVAL)
+                continue
+            self.connects += 1
+            logger.info(f"Connected to {self.url}")
+            self.ws = ws
+            try:
+                while self.running:
+                    try:
+                        text = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if not text:
+                        # orderly close from the server
+                        break
+                    if self.on_message:
+                        try:
+                            message = json.loads(text)
+                        except ValueError:
+                            continue
+                        self.on_message(message)
+            except Exception as error:
+                logger.warning(f"mavlink2rest websocket dropped: {error}")
+            self.drop(ws)
+            time.sleep(RECONNECT_INTERVAL)
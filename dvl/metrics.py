@@ -0,0 +1,162 @@
+"""
+Counters and histograms for the hot path, rendered in the Prometheus text format for /metrics
+and as a JSON summary.
+
+Updating a metric is a plain attribute increment, without locks: each metric is written by one
+thread, and a lost update under contention is acceptable for monitoring. Metrics are created
+once, at import time, and kept in module constants by the code that updates them.
+"""
+import math
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# seconds, roughly 3 buckets per decade from 1 us to 10 s
+DEFAULT_BUCKETS = tuple(round(base * 10.0**exponent, 9) for exponent in range(-6, 1) for base in (1, 2.5, 5)) + (
+    10.0,
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    __slots__ = ("labels", "value")
+
+    def __init__(self, labels: Labels = ()) -> None:
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Histogram:
+    __slots__ = ("labels", "bounds", "counts", "sum", "count")
+
+    def __init__(self, labels: Labels = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.labels = labels
+        self.bounds = list(buckets)
+        # one count per bucket, plus the +Inf bucket
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """
+        Upper bound of the bucket holding the "fraction" quantile, None if nothing was observed
+        """
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return math.inf
+
+
+class Gauge:
+    """
+    Value read from "function" when the metrics are rendered, for state that is already counted elsewhere
+    """
+
+    __slots__ = ("labels", "function")
+
+    def __init__(self, function: Callable[[], float], labels: Labels = ()) -> None:
+        self.labels = labels
+        self.function = function
+
+    @property
+    def value(self) -> float:
+        try:
+            return self.function()
+        except Exception:
+            return math.nan
+
+
+class Registry:
+    def __init__(self) -> None:
+        # name -> (type, help, metrics with each set of labels)
+        self.families: Dict[str, Tuple[str, str, List[Any]]] = {}
+
+    def register(self, kind: str, name: str, help_text: str, metric: Any) -> Any:
+        family = self.families.setdefault(name, (kind, help_text, []))
+        if family[0] != kind:
+            raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+        family[2].append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, **labels: str) -> Counter:
+        return self.register("counter", name, help_text, Counter(tuple(labels.items())))
+
+    def histogram(
+        self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels: str
+    ) -> Histogram:
+        return self.register("histogram", name, help_text, Histogram(tuple(labels.items()), buckets))
+
+    def gauge(self, name: str, help_text: str, function: Callable[[], float], **labels: str) -> Gauge:
+        return self.register("gauge", name, help_text, Gauge(function, tuple(labels.items())))
+
+    def unregister(self, name: str) -> None:
+        self.families.pop(name, None)
+
+    def render(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format
+        """
+        lines = []
+        for name, (kind, help_text, metrics) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in metrics:
+                if kind == "histogram":
+                    labels = format_labels(metric.labels)
+                    cumulative = 0
+                    for bound, count in zip(metric.bounds, metric.counts):
+                        cumulative += count
+                        le = format_labels(metric.labels, 'le="%g"' % bound)
+                        lines.append(f"{name}_bucket{le} {cumulative}")
+                    le = format_labels(metric.labels, 'le="+Inf"')
+                    lines.append(f"{name}_bucket{le} {metric.count}")
+                    lines.append(f"{name}_sum{labels} {metric.sum!r}")
+                    lines.append(f"{name}_count{labels} {metric.count}")
+                else:
+                    lines.append(f"{name}{format_labels(metric.labels)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Returns the metrics as a dict, keyed by name and then by label values when there are labels.
+        Histograms are summarized as count, mean and p50/p99 bucket bounds, in ms
+        """
+        result: Dict[str, Any] = {}
+        for name, (kind, _, metrics) in self.families.items():
+            values = {}
+            for metric in metrics:
+                if kind == "histogram":
+                    value: Any = {"count": metric.count}
+                    if metric.count:
+                        value["mean_ms"] = round(metric.sum / metric.count * 1e3, 4)
+                        value["p50_ms"] = round(metric.quantile(0.5) * 1e3, 4)
+                        value["p99_ms"] = round(metric.quantile(0.99) * 1e3, 4)
+                else:
+                    value = metric.value
+                values[",".join(label for _, label in metric.labels)] = value
+            result[name] = values[""] if list(values) == [""] else values
+        return result
+
+
+# metrics of the whole driver process
+REGISTRY = Registry()
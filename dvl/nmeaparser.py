@@ -0,0 +1,178 @@
+"""
+Dedicated parsers for the two sentences on the hot path, $DVPDL and $DVEXT.
+They validate the checksum, split the fields once and return a NamedTuple with the same
+attribute names the pynmea2 sentences have, so the handlers accept either.
+
+The position of each field is taken from the DV sentences of the Cerulean pynmea2 fork when it is
+installed, so both parsers always read the same fields. Without the fork, the fields are read in
+the order of the NamedTuples, which follows the handlers and is not checked against the DVL.
+"""
+import struct
+from functools import reduce
+from operator import itemgetter, xor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import pynmea2
+
+
+class PdlSentence(NamedTuple):
+    # $DVPDL: position delta, laid out like MAVLink's VISION_POSITION_DELTA
+    ts: int  # time since boot, us
+    dtu: int  # time since the previous $DVPDL, us
+    dr: float  # angle deltas, rad
+    dp: float
+    dy: float
+    pdx: float  # position deltas, m
+    pdy: float
+    pdz: float
+    c: float  # confidence, %
+
+
+class ExtSentence(NamedTuple):
+    # $DVEXT: extended status
+    ts: int  # time since boot, us
+    v: str  # velocity lock
+    g: str  # GPS status
+    cal: str  # calibration status
+    la: str  # lock of each beam
+    lb: str
+    lc: str
+    ld: str
+    ga: float  # gain of each beam, dB
+    gb: float
+    gc: float
+    gd: float
+    t: float  # altitude, m
+
+
+
+def field_positions(sentence_type: str, names: Tuple[str, ...]) -> List[int]:
+    """
+    Position of each of "names" in the pynmea2 definition of "sentence_type", their own order if there is none
+    """
+    definition = pynmea2.TalkerSentence.sentence_types.get(sentence_type)
+    if definition is None:
+        return list(range(len(names)))
+    order = [field[1] for field in definition.fields]
+    missing = [name for name in names if name not in order]
+    if missing:
+        raise ImportError(f"pynmea2 {sentence_type} has no {', '.join(missing)} fields")
+    return [order.index(name) for name in names]
+
+
+PDL_POSITIONS = field_positions("PDL", PdlSentence._fields)
+EXT_POSITIONS = field_positions("EXT", ExtSentence._fields)
+# fields a sentence needs at least
+PDL_FIELDS = max(PDL_POSITIONS) + 1
+EXT_FIELDS = max(EXT_POSITIONS) + 1
+# fields of each sentence, in the order of the NamedTuples
+pdl_fields = itemgetter(*PDL_POSITIONS)
+ext_fields = itemgetter(*EXT_POSITIONS)
+
+
+def checksum(data: bytes) -> int:
+    """
+    XOR of every byte in "data", computed over 64 bit words and folded down to one byte
+    """
+    padding = -len(data) % 8
+    words = struct.unpack(f"<{(len(data) + padding) // 8}Q", data + b"\0" * padding)
+    value = reduce(xor, words, 0)
+    value ^= value >> 32
+    value ^= value >> 16
+    value ^= value >> 8
+    return value & 0xFF
+
+
+def split_fields(line: bytes, sentence: bytes) -> Optional[list]:
+    """
+    Checks the "$<sentence>,...*hh" framing and checksum of "line"
+    Returns its fields after the sentence name, or None if it's not a valid "sentence"
+    """
+    star = line.rfind(b"*")
+    if star < 0 or not line.startswith(b"$" + sentence + b","):
+        return None
+    body = line[1:star]
+    try:
+        if int(line[star + 1 : star + 3], 16) != checksum(body):
+            return None
+    except ValueError:
+        return None
+    return body.split(b",")[1:]
+
+
+def parse_pdl(line: bytes) -> Optional[PdlSentence]:
+    """
+    Parses a $DVPDL sentence, returns None if it is malformed
+    """
+    fields = split_fields(line, b"DVPDL")
+    if fields is None or len(fields) < PDL_FIELDS:
+        return None
+    fields = pdl_fields(fields)
+    try:
+        return PdlSentence(
+            int(fields[0]),
+            int(fields[1]),
+            float(fields[2]),
+            float(fields[3]),
+            float(fields[4]),
+            float(fields[5]),
+            float(fields[6]),
+            float(fields[7]),
+            float(fields[8]),
+        )
+    except ValueError:
+        return None
+
+
+def parse_ext(line: bytes) -> Optional[ExtSentence]:
+    """
+    Parses a $DVEXT sentence, returns None if it is malformed
+    """
+    fields = split_fields(line, b"DVEXT")
+    if fields is None or len(fields) < EXT_FIELDS:
+        return None
+    fields = ext_fields(fields)
+    try:
+        return ExtSentence(
+            int(fields[0]),
+            fields[1].decode(),
+            fields[2].decode(),
+            fields[3].decode(),
+            fields[4].decode(),
+            fields[5].decode(),
+            fields[6].decode(),
+            fields[7].decode(),
+            float(fields[8]),
+            float(fields[9]),
+            float(fields[10]),
+            float(fields[11]),
+            float(fields[12]),
+        )
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def parse_ack(line: bytes) -> Optional[Tuple[str, bool]]:
+    """
+    Parses a $DVACK,<command name>,OK|ERR acknowledgement, returns the command name and whether it was accepted
+    """
+    fields = split_fields(line, b"DVACK")
+    if fields is None or len(fields) < 2:
+        return None
+    return fields[0].decode("ascii", errors="replace"), fields[1] == b"OK"
+
+
+def parse_configuration(line: bytes) -> Optional[Dict[str, str]]:
+    """
+    Parses a $DVNVM,NAME=value,... settings report, returns the values by setting name.
+    Commas separate the settings, so commas inside values are sent as semicolons
+    """
+    fields = split_fields(line, b"DVNVM")
+    if fields is None:
+        return None
+    values = {}
+    for field in fields:
+        name, separator, value = field.decode("ascii", errors="replace").partition("=")
+        if separator and name:
+            values[name.strip()] = value.strip().replace(";", ",")
+    return values
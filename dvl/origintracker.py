@@ -0,0 +1,135 @@
+import threading
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from telemetry import TelemetryEntry
+
+# seconds to wait for GPS_GLOBAL_ORIGIN after requesting it
+REQUEST_TIMEOUT = 1.0
+# requests sent before treating the origin as not set, or as stale if the autopilot reported one before
+MAX_REQUESTS = 5
+# seconds after which a confirmed origin is read back again
+STALE_AFTER = 60.0
+
+
+class OriginState(str, Enum):
+    UNKNOWN = "unknown"  # the autopilot never reported an origin, the next GPS fix sets it
+    REQUESTED = "requested"  # waiting for the autopilot to report GPS_GLOBAL_ORIGIN
+    CONFIRMED = "confirmed"  # the autopilot reported the origin recently
+    STALE = "stale"  # the last reported origin is still used while it is read back again
+
+
+class OriginTracker:
+    """
+    Tracks the autopilot's EKF origin without ever blocking the DVL data path.
+    Transitions are driven by GPS_GLOBAL_ORIGIN arriving in the telemetry cache and by tick(),
+    which the receive loop calls every time it wakes up. Requests go out through "request",
+    which is expected to queue them rather than send them inline.
+    """
+
+    def __init__(
+        self,
+        request: Callable[[], None],
+        request_timeout: float = REQUEST_TIMEOUT,
+        max_requests: int = MAX_REQUESTS,
+        stale_after: float = STALE_AFTER,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.request = request
+        self.request_timeout = request_timeout
+        self.max_requests = max_requests
+        self.stale_after = stale_after
+        # time source of the timeouts, the driver's clock so replays don't depend on their speed
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = OriginState.UNKNOWN
+        # time.time() of the last state change, for the status page
+        self.last_transition = time.time()
+        # [lat, lon] last reported by the autopilot
+        self.origin: Optional[List[float]] = None
+        self.requests = 0
+        self.last_request = 0.0
+        self.last_confirmed = 0.0
+
+    def transition(self, state: OriginState) -> None:
+        if state != self.state:
+            logger.info(f"Origin {self.state.value} -> {state.value}")
+            self.state = state
+            self.last_transition = time.time()
+
+    def start(self) -> None:
+        """
+        Asks the autopilot for its current origin
+        """
+        with self.lock:
+            self.requests = 0
+            self.last_request = 0.0
+            self.transition(OriginState.REQUESTED)
+
+    def expect(self) -> None:
+        """
+        Called after setting the origin, so it gets read back until the autopilot confirms it
+        """
+        self.start()
+
+    def on_telemetry(self, name: str, entry: TelemetryEntry) -> None:
+        """
+        TelemetryCache listener, confirms the origin when GPS_GLOBAL_ORIGIN arrives
+        """
+        if name != "GPS_GLOBAL_ORIGIN":
+            return
+        try:
+            origin = [entry.message["latitude"] * 1e-7, entry.message["longitude"] * 1e-7]
+        except (KeyError, TypeError) as error:
+            logger.warning(f"Invalid GPS_GLOBAL_ORIGIN: {error}")
+            return
+        with self.lock:
+            self.origin = origin
+            self.last_confirmed = self.clock()
+            self.transition(OriginState.CONFIRMED)
+
+    def tick(self, now: Optional[float] = None) -> None:
+        """
+        Handles timeouts and sends the requests that are due. Never blocks
+        """
+        now = self.clock() if now is None else now
+        with self.lock:
+            if self.state == OriginState.CONFIRMED:
+                if now - self.last_confirmed > self.stale_after:
+                    self.requests = 0
+                    self.last_request = 0.0
+                    self.transition(OriginState.STALE)
+                return
+            if self.state == OriginState.UNKNOWN or now - self.last_request < self.request_timeout:
+                return
+            if self.requests >= self.max_requests:
+                if self.origin is None:
+                    logger.warning(f"No GPS_GLOBAL_ORIGIN after {self.requests} requests")
+                    self.transition(OriginState.UNKNOWN)
+                    return
+                if self.requests == self.max_requests:
+                    logger.warning(f"No GPS_GLOBAL_ORIGIN after {self.requests} requests, keeping the last one")
+                # an origin the autopilot reported once is kept, and asked for until it answers again
+                self.transition(OriginState.STALE)
+            self.requests += 1
+            self.last_request = now
+        self.request()
+
+    @property
+    def usable(self) -> bool:
+        """
+        True if there is an origin to send position estimates relative to
+        """
+        return self.state in (OriginState.CONFIRMED, OriginState.STALE) and self.origin is not None
+
+    def get_status(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "state": self.state.value,
+                "last_transition": self.last_transition,
+                "origin": self.origin,
+                "requests": self.requests,
+            }
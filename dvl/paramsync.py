@@ -0,0 +1,174 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from loguru import logger
+
+from mavlink2resthelper import POOL_SIZE, Mavlink2RestHelper
+
+# seconds to wait for the PARAM_VALUE echoes of a batch of requests
+BATCH_TIMEOUT = 2.0
+# seconds to wait for a single PARAM_VALUE when retrying one parameter at a time
+RETRY_TIMEOUT = 1.0
+# how often PARAM_VALUE is polled when it can't be pushed over the websocket
+POLL_INTERVAL = 0.01
+
+
+class Param(NamedTuple):
+    name: str
+    param_type: str
+    value: float
+
+
+def param_id(message: Any) -> str:
+    return "".join(message["param_id"]).rstrip("\x00")
+
+
+def same_value(a: float, b: float) -> bool:
+    # PARAM_VALUE carries every type as a float32
+    return abs(a - b) <= 1e-6 * max(1.0, abs(a), abs(b))
+
+
+class ParamSync:
+    """
+    Brings autopilot parameters to the wanted values.
+    Reads the current values first, sends PARAM_SET only for the ones that differ,
+    and confirms each one against its PARAM_VALUE echo
+    """
+
+    def __init__(self, mav: Mavlink2RestHelper) -> None:
+        self.mav = mav
+        self.condition = threading.Condition()
+        # latest PARAM_VALUE seen for each parameter name
+        self.values: Dict[str, float] = {}
+        self.polling = False
+
+    def on_message(self, message: Any) -> None:
+        if message.get("type") != "PARAM_VALUE":
+            return
+        try:
+            name, value = param_id(message), float(message["param_value"])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self.condition:
+            self.values[name] = value
+            self.condition.notify_all()
+
+    def poll(self, last_counter: Optional[int]) -> None:
+        """
+        Feeds PARAM_VALUE updates polled over http, used while the websocket is not connected.
+        "last_counter" is the counter of the PARAM_VALUE already there, which is not an echo of ours
+        """
+        while self.polling:
+            if not self.mav.websocket_connected:
+                latest = self.mav.get_message("PARAM_VALUE")
+                if latest is not None and latest[0] != last_counter:
+                    last_counter = latest[0]
+                    self.on_message(latest[1])
+            time.sleep(POLL_INTERVAL)
+
+    def wait_for(self, names: List[str], timeout: float, expected: Optional[Dict[str, float]] = None) -> List[str]:
+        """
+        Waits until a PARAM_VALUE was seen for every name in "names", matching "expected" if given.
+        Returns the names still missing when "timeout" expires
+        """
+
+        def missing() -> List[str]:
+            return [
+                name
+                for name in names
+                if name not in self.values
+                or (expected is not None and not same_value(self.values[name], expected[name]))
+            ]
+
+        deadline = time.time() + timeout
+        with self.condition:
+            while missing() and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            return missing()
+
+    def batch(
+        self,
+        items: List[Any],
+        send: Callable[[Any], Any],
+        executor: ThreadPoolExecutor,
+        expected: Optional[Dict[str, float]] = None,
+    ) -> List[str]:
+        """
+        Sends all "items", names or Params, at once and returns the names whose PARAM_VALUE didn't arrive.
+        Only done over the websocket: polling over http only sees the latest PARAM_VALUE, so the echoes
+        of a batch would hide each other, and every name is returned to be sent one at a time instead
+        """
+        names = [item if isinstance(item, str) else item.name for item in items]
+        if not self.mav.websocket_connected:
+            return names
+        list(executor.map(send, items))
+        return self.wait_for(names, BATCH_TIMEOUT, expected)
+
+    def read(self, names: List[str], executor: ThreadPoolExecutor) -> Dict[str, float]:
+        """
+        Reads the current autopilot values for "names", requesting them all at once over the websocket
+        and one at a time otherwise, or for the ones that didn't answer
+        """
+        with self.condition:
+            for name in names:
+                self.values.pop(name, None)
+        for name in self.batch(names, self.mav.request_param, executor):
+            self.mav.request_param(name)
+            self.wait_for([name], RETRY_TIMEOUT)
+        with self.condition:
+            return {name: self.values[name] for name in names if name in self.values}
+
+    def write(self, params: List[Param], executor: ThreadPoolExecutor) -> List[str]:
+        """
+        Sends PARAM_SET for every param at once over the websocket, then one at a time for the unconfirmed ones,
+        or for all of them without the websocket. Returns the names that could not be confirmed
+        """
+        expected = {param.name: float(param.value) for param in params}
+        with self.condition:
+            for param in params:
+                self.values.pop(param.name, None)
+        failed = []
+        for name in self.batch(params, lambda param: self.mav.set_param(*param), executor, expected):
+            param = next(param for param in params if param.name == name)
+            self.mav.set_param(*param)
+            if self.wait_for([name], RETRY_TIMEOUT, expected):
+                failed.append(name)
+        return failed
+
+    def sync(self, params: List[Param]) -> Dict[str, Any]:
+        """
+        Applies "params" to the autopilot. Returns a report with the parameters that were
+        changed, already correct or failed to apply, and how long the sync took
+        """
+        start = time.time()
+        self.mav.listeners.append(self.on_message)
+        self.polling = True
+        latest = self.mav.get_message("PARAM_VALUE")
+        poller = threading.Thread(
+            target=self.poll, args=(latest[0] if latest is not None else None,), name="ParamSyncPoller", daemon=True
+        )
+        poller.start()
+        try:
+            with ThreadPoolExecutor(max_workers=POOL_SIZE) as executor:
+                current = self.read([param.name for param in params], executor)
+                stale = [
+                    param
+                    for param in params
+                    if param.name not in current or not same_value(current[param.name], param.value)
+                ]
+                failed = self.write(stale, executor) if stale else []
+        finally:
+            self.polling = False
+            self.mav.listeners.remove(self.on_message)
+            poller.join()
+
+        report = {
+            "changed": [param.name for param in stale if param.name not in failed],
+            "unchanged": [param.name for param in params if param not in stale],
+            "failed": failed,
+            "duration": round(time.time() - start, 3),
+        }
+        logger.info(f"Parameter sync: {report}")
+        return report
@@ -0,0 +1,115 @@
+"""
+On-demand sampling profiler for the running driver.
+
+While a profile runs, the thread that asked for it reads the stack of every other thread from
+sys._current_frames() at a fixed interval and counts identical stacks. Nothing is hooked into
+the profiled threads, so when no profile is running there is no cost at all.
+The result is in the collapsed stack format read by flamegraph.pl and speedscope, one line per
+stack, outermost frame first, with the thread name as the root:
+
+    DvlDriver;run (dvl.py);handle_line (dvl.py);handle_pdl_line (dvl.py) 42
+"""
+import math
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+# seconds between samples, fine enough for a few seconds of profile and cheap on the Pi
+DEFAULT_INTERVAL = 0.005
+# longest profile accepted, the request blocks for its whole duration
+MAX_DURATION = 60.0
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads whose names start with one of "thread_names", or every thread
+    if it is empty. Only one profile runs at a time
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL) -> None:
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_profile: Optional[Dict[str, float]] = None
+
+    @property
+    def running(self) -> bool:
+        return self.lock.locked()
+
+    def sample(self, stacks: Dict[str, int], names: Dict[int, str], own_ident: int) -> None:
+        for ident, frame in sys._current_frames().items():
+            name = names.get(ident)
+            if ident == own_ident or name is None:
+                continue
+            labels: List[str] = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append(name)
+            stack = ";".join(reversed(labels))
+            stacks[stack] = stacks.get(stack, 0) + 1
+
+    def threads(self, thread_names: List[str]) -> Dict[int, str]:
+        """
+        Names of the threads to sample, by ident, without the characters the collapsed format uses as separators
+        """
+        names = {}
+        for thread in threading.enumerate():
+            if thread.ident is None or (thread_names and not thread.name.startswith(tuple(thread_names))):
+                continue
+            names[thread.ident] = thread.name.replace(";", "_").replace(" ", "_")
+        return names
+
+    def profile(self, duration: float, thread_names: Optional[List[str]] = None) -> Optional[Dict[str, int]]:
+        """
+        Samples for "duration" seconds and returns the count of each collapsed stack,
+        None if a profile is already running. Raises ValueError if "duration" is not finite
+        """
+        if not math.isfinite(duration):
+            raise ValueError(f"Invalid profile duration {duration}")
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            duration = min(max(duration, self.interval), MAX_DURATION)
+            logger.info(f"Profiling for {duration} s every {self.interval * 1e3:.1f} ms")
+            stacks: Dict[str, int] = {}
+            own_ident = threading.get_ident()
+            samples = 0
+            start = time.monotonic()
+            deadline = start + duration
+            next_sample = start
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                # threads come and go, Flask starts one per request
+                self.sample(stacks, self.threads(thread_names or []), own_ident)
+                samples += 1
+                next_sample += self.interval
+                if next_sample > now:
+                    time.sleep(next_sample - now)
+                else:
+                    next_sample = now
+            self.last_profile = {"duration": time.monotonic() - start, "samples": samples, "stacks": len(stacks)}
+            logger.info(f"Profile done: {samples} samples, {len(stacks)} distinct stacks")
+            return stacks
+        finally:
+            self.lock.release()
+
+    def get_status(self) -> Dict:
+        return {"running": self.running, "interval": self.interval, "last_profile": self.last_profile}
+
+
+def collapsed(stacks: Dict[str, int]) -> str:
+    """
+    Formats stack counts as collapsed stacks, the most frequent first
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
@@ -0,0 +1,83 @@
+from typing import Any, Dict, Optional
+
+# DISTANCE_SENSOR messages per second at most
+RANGEFINDER_RATE = 5.0
+# meters, smaller altitude changes are not worth a message
+RANGEFINDER_THRESHOLD = 0.01
+# seconds, unchanged altitudes are still sent this often. ArduPilot drops a MAVLink rangefinder after 500 ms,
+# and the keepalive must be longer than the interval of the rate for the threshold to suppress anything
+RANGEFINDER_KEEPALIVE = 0.35
+# Hz, slower rates are clamped to this, so the interval between messages stays under the keepalive
+MIN_RANGEFINDER_RATE = 3.0
+
+
+class RangefinderOutput:
+    """
+    Decides which DVL altitudes become DISTANCE_SENSOR messages.
+    Sends at most "rate" messages per second, skips altitudes within "threshold" of the last
+    one sent unless "keepalive" seconds went by. Skipped altitudes are superseded by the next
+    one, so whatever goes out is always the latest value, and the latest skipped one is sent
+    by flush() once it is due, even if no new altitude comes
+    """
+
+    def __init__(
+        self,
+        rate: float = RANGEFINDER_RATE,
+        threshold: float = RANGEFINDER_THRESHOLD,
+        keepalive: float = RANGEFINDER_KEEPALIVE,
+    ) -> None:
+        self.rate = max(rate, MIN_RANGEFINDER_RATE)
+        self.threshold = threshold
+        self.keepalive = keepalive
+        # latest altitude not sent yet
+        self.pending: Optional[float] = None
+        self.last_distance: Optional[float] = None
+        self.last_time = float("-inf")
+        self.sent = 0
+        self.suppressed = 0
+
+    def configure(self, rate: float, threshold: float) -> bool:
+        """
+        Sets the rate in Hz, clamped to MIN_RANGEFINDER_RATE, and the threshold in meters
+        """
+        if rate <= 0 or threshold < 0:
+            return False
+        self.rate = max(rate, MIN_RANGEFINDER_RATE)
+        self.threshold = threshold
+        return True
+
+    def update(self, distance: float, now: float) -> Optional[float]:
+        """
+        Feeds a new altitude measured at monotonic time "now"
+        Returns the distance to send, or None if it should be suppressed
+        """
+        self.pending = distance
+        distance = self.flush(now)
+        if distance is None:
+            self.suppressed += 1
+        return distance
+
+    def flush(self, now: float) -> Optional[float]:
+        """
+        Returns the latest altitude not sent yet if it is due at monotonic time "now", None otherwise
+        """
+        distance = self.pending
+        if distance is None:
+            return None
+        elapsed = now - self.last_time
+        unchanged = self.last_distance is not None and abs(distance - self.last_distance) < self.threshold
+        if elapsed < 1 / self.rate or (unchanged and elapsed < self.keepalive):
+            return None
+        self.pending = None
+        self.last_distance = distance
+        self.last_time = now
+        self.sent += 1
+        return distance
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "rate": self.rate,
+            "threshold": self.threshold,
+            "sent": self.sent,
+            "suppressed": self.suppressed,
+        }
@@ -0,0 +1,203 @@
+"""
+Append-only binary log of the raw DVL traffic and the MAVLink payloads sent to mavlink2rest,
+so field sessions can be replayed.
+
+File layout, little endian:
+    header: magic b"DVLREC\\0\\0", u16 version, f64 time.time() and f64 time.monotonic() at creation
+    records: u8 kind, f64 time.monotonic(), u32 payload length, payload
+"""
+import os
+import struct
+import threading
+import time
+from collections import deque
+from enum import IntEnum
+from typing import BinaryIO, Deque, Dict, Iterator, NamedTuple, Optional, Tuple, Union
+
+from loguru import logger
+
+MAGIC = b"DVLREC\0\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHdd")
+RECORD = struct.Struct("<BdI")
+# files are rotated past this size, in bytes
+MAX_FILE_SIZE = 64 * 1024 * 1024
+# oldest files are deleted past this count
+MAX_FILES = 20
+# seconds between writer wake-ups
+FLUSH_INTERVAL = 0.2
+# records waiting for the writer before new ones are dropped
+MAX_PENDING = 100000
+RECORDINGS_PATH = os.path.join(os.path.expanduser("~"), ".config", "dvl", "recordings")
+
+
+class RecordKind(IntEnum):
+    DATAGRAM = 1  # UDP datagram received from the DVL
+    MAVLINK = 2  # JSON payload sent to mavlink2rest
+
+
+class Record(NamedTuple):
+    kind: int
+    timestamp: float  # time.monotonic() of the recording session
+    payload: bytes
+
+
+class Recorder:
+    """
+    Records datagrams and MAVLink payloads. record() only timestamps and queues,
+    a background thread does the encoding and the buffered file writes
+    """
+
+    def __init__(
+        self, directory: str = RECORDINGS_PATH, max_file_size: int = MAX_FILE_SIZE, max_files: int = MAX_FILES
+    ) -> None:
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.max_files = max_files
+        # appended to by any thread, drained by the writer
+        self.pending: Deque[Tuple[int, float, bytes]] = deque()
+        self.active = False
+        self.dropped = 0
+        self.recorded = 0
+        self.file: Optional[BinaryIO] = None
+        self.path: Optional[str] = None
+        self.file_size = 0
+        # files opened by this recorder, numbers the files of one session
+        self.files = 0
+        self.thread: Optional[threading.Thread] = None
+        self.wakeup = threading.Event()
+
+    def record(self, kind: RecordKind, data: Union[bytes, memoryview]) -> None:
+        """
+        Queues "data" for the writer. Cheap enough for the receive loop, and a no-op while stopped
+        """
+        if not self.active:
+            return
+        if len(self.pending) >= MAX_PENDING:
+            self.dropped += 1
+            return
+        self.pending.append((kind, time.monotonic(), bytes(data)))
+
+    def record_datagram(self, data: Union[bytes, memoryview]) -> None:
+        self.record(RecordKind.DATAGRAM, data)
+
+    def record_mavlink(self, data: bytes) -> None:
+        self.record(RecordKind.MAVLINK, data)
+
+    def start(self) -> bool:
+        """
+        Starts recording to a new file
+        """
+        if self.active:
+            return True
+        try:
+            self.open_file()
+        except OSError as error:
+            logger.warning(f"Unable to start recording: {error}")
+            return False
+        self.active = True
+        self.wakeup.clear()
+        self.thread = threading.Thread(target=self.run, name="Recorder", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self) -> bool:
+        """
+        Stops recording, writing out everything queued so far
+        """
+        if not self.active:
+            return True
+        self.active = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return True
+
+    def open_file(self) -> None:
+        if self.file is not None:
+            self.file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self.files += 1
+        self.path = os.path.join(self.directory, time.strftime("dvl-%Y%m%d-%H%M%S") + f"-{self.files:04d}.rec")
+        self.file = open(self.path, "wb", buffering=1024 * 1024)
+        self.file.write(HEADER.pack(MAGIC, VERSION, time.time(), time.monotonic()))
+        self.file_size = HEADER.size
+        self.delete_old_files()
+
+    def delete_old_files(self) -> None:
+        recordings = sorted(name for name in os.listdir(self.directory) if name.endswith(".rec"))
+        for name in recordings[: max(0, len(recordings) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as error:
+                logger.warning(f"Unable to delete old recording {name}: {error}")
+
+    def write_pending(self) -> None:
+        pending = self.pending
+        while pending:
+            kind, timestamp, payload = pending.popleft()
+            if self.file_size >= self.max_file_size:
+                self.open_file()
+            self.file.write(RECORD.pack(kind, timestamp, len(payload)))
+            self.file.write(payload)
+            self.file_size += RECORD.size + len(payload)
+            self.recorded += 1
+
+    def run(self) -> None:
+        while self.active:
+            self.wakeup.wait(FLUSH_INTERVAL)
+            try:
+                self.write_pending()
+                self.file.flush()
+            except OSError as error:
+                logger.warning(f"Recording stopped: {error}")
+                self.active = False
+        try:
+            self.write_pending()
+        except OSError as error:
+            logger.warning(f"Unable to write the end of the recording: {error}")
+        self.file.close()
+        self.file = None
+
+    def get_status(self) -> Dict[str, object]:
+        return {
+            "active": self.active,
+            "path": self.path,
+            "file_size": self.file_size,
+            "pending": len(self.pending),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+        }
+
+
+def read_header(file: BinaryIO) -> Tuple[float, float]:
+    """
+    Checks the header of a recording, returns the wall clock and monotonic times it was created at
+    """
+    header = file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("Not a DVL recording: too short")
+    magic, version, wall_time, monotonic_time = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a DVL recording: bad magic")
+    if version != VERSION:
+        raise ValueError(f"Unsupported recording version {version}")
+    return wall_time, monotonic_time
+
+
+def read_records(path: str) -> Iterator[Record]:
+    """
+    Yields the records in the file at "path", stopping at a truncated trailing record
+    """
+    with open(path, "rb") as file:
+        read_header(file)
+        while True:
+            header = file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            kind, timestamp, length = RECORD.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                return
+            yield Record(kind, timestamp, payload)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Replays a recorded DVL session through the DvlDriver framing, parsing and handler path,
+against the local stub mavlink2rest, and reports throughput, per-stage latency and the
+sequence of MAVLink messages sent.
+
+Sessions are binary recordings from the Recorder, or text captures with one line per datagram.
+By default messages are sent inline, so the same session always produces the same sequence.
+
+    python3 replay.py session.rec --speed 0 --output report.json
+    python3 replay.py capture.txt --compare report.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from dvl import LINE_TYPES, DvlDriver
+from mavlink2resthelper import GPS_GLOBAL_ORIGIN_ID, Mavlink2RestHelper
+from mavlink2reststub import Mavlink2RestStub
+from mavlinksender import MavlinkSender, SendPolicy
+from recorder import MAGIC, RecordKind, read_records
+
+# seconds between the lines of a text capture, which has no timestamps
+TEXT_LINE_INTERVAL = 0.066
+# telemetry the handlers read from the cache
+TELEMETRY = ["ATTITUDE", "VFR_HUD"]
+# seconds between polls of TELEMETRY when sending inline, well inside the driver's max ages
+TELEMETRY_REFRESH = 0.1
+
+
+class InlineSender(MavlinkSender):
+    """
+    Sends each message as it is submitted, on the calling thread, timing every send
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.durations: List[float] = []
+
+    def submit(self, name: str, policy: SendPolicy, function: Callable[..., Any], *args: Any) -> None:
+        start = time.perf_counter()
+        try:
+            result = function(*args)
+        except Exception as error:
+            logger.warning(f"Error sending {name}: {error}")
+            result = False
+        elapsed = time.perf_counter() - start
+        self.durations.append(elapsed)
+        self.latencies.append(elapsed)
+        if result is False:
+            self.failed += 1
+        else:
+            self.sent += 1
+
+    def start(self) -> None:
+        pass
+
+
+def load_session(path: str) -> List[Tuple[float, bytes]]:
+    """
+    Returns the (seconds since the start, datagram) pairs of a binary recording or a text capture
+    """
+    with open(path, "rb") as file:
+        binary = file.read(len(MAGIC)) == MAGIC
+    if binary:
+        datagrams = [(record.timestamp, record.payload) for record in read_records(path)
+                     if record.kind == RecordKind.DATAGRAM]
+        first = datagrams[0][0] if datagrams else 0.0
+        return [(timestamp - first, payload) for timestamp, payload in datagrams]
+    with open(path, "rb") as file:
+        lines = [line.rstrip(b"\r\n") for line in file if line.strip()]
+    return [(i * TEXT_LINE_INTERVAL, line + b"\r\n") for i, line in enumerate(lines)]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Count and percentiles, in ms, of "samples" in seconds
+    """
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50": round(ordered[len(ordered) // 2] * 1e3, 4),
+        "p99": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e3, 4),
+        "max": round(ordered[-1] * 1e3, 4),
+    }
+
+
+class Replay:
+    """
+    Drives a DvlDriver from recorded datagrams. "speed" is a multiple of real time, 0 is as fast as possible
+    """
+
+    def __init__(self, datagrams: List[Tuple[float, bytes]], url: str, speed: float = 0, threaded: bool = False):
+        self.datagrams = datagrams
+        self.speed = speed
+        self.threaded = threaded
+        self.driver = DvlDriver(mav=Mavlink2RestHelper(url=url))
+        # the origin set while replaying must not end up in the vehicle's settings
+        settings = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+        settings.close()
+        os.remove(settings.name)
+        self.driver.settings_path = settings.name
+        if not threaded:
+            self.driver.sender = InlineSender()
+        # virtual time of the datagram being handled, for the driver's rate limits
+        self.now = 0.0
+        self.driver.clock = lambda: self.now
+        self.driver.wall_clock = lambda: self.now
+        self.driver.mav.outgoing_listeners.append(self.on_outgoing)
+        self.messages: List[Tuple[float, str]] = []
+        self.lock = threading.Lock()
+        self.stages: Dict[str, List[float]] = {"framing": []}
+        # set when a message the autopilot answers with GPS_GLOBAL_ORIGIN is sent
+        self.origin_requested = False
+        self.last_telemetry = 0.0
+
+    def on_outgoing(self, payload: bytes) -> None:
+        """
+        Logs every message sent, and notes the ones the autopilot answers with GPS_GLOBAL_ORIGIN
+        """
+        try:
+            message = json.loads(payload)["message"]
+        except (ValueError, KeyError, TypeError):
+            message = {"type": "INVALID"}
+        with self.lock:
+            self.messages.append((self.now, message["type"]))
+        if message["type"] == "SET_GPS_GLOBAL_ORIGIN" or (
+            message["type"] == "COMMAND_LONG" and message.get("param1") == GPS_GLOBAL_ORIGIN_ID
+        ):
+            self.origin_requested = True
+
+    def poll(self, name: str) -> None:
+        latest = self.driver.mav.get_message(name)
+        if latest is not None:
+            self.driver.mav.telemetry.update(name, latest[1], latest[0])
+
+    def refresh_telemetry(self) -> None:
+        """
+        Does the telemetry subscriber's job at fixed points of the replay, so inline replays stay deterministic
+        """
+        if self.origin_requested:
+            self.origin_requested = False
+            self.poll("GPS_GLOBAL_ORIGIN")
+        if self.now - self.last_telemetry > TELEMETRY_REFRESH:
+            self.last_telemetry = self.now
+            for name in TELEMETRY:
+                self.poll(name)
+
+    def run(self) -> Dict[str, Any]:
+        driver = self.driver
+        framer = driver.framer
+        stages = self.stages
+        driver.sender.start()
+        if self.threaded:
+            driver.mav.start_telemetry()
+        else:
+            self.refresh_telemetry()
+        lines = 0
+        start_wall = time.time()
+        start = time.perf_counter()
+        for timestamp, datagram in self.datagrams:
+            if self.speed > 0:
+                delay = timestamp / self.speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            self.now = start_wall + timestamp
+            if not self.threaded:
+                self.refresh_telemetry()
+            t0 = time.perf_counter()
+            complete = framer.feed(datagram)
+            stages["framing"].append(time.perf_counter() - t0)
+            for line in complete:
+                t0 = time.perf_counter()
+                driver.handle_line(line)
+                stages.setdefault(LINE_TYPES.get(line[:5], "other"), []).append(time.perf_counter() - t0)
+            driver.flush_rangefinder()
+            lines += len(complete)
+        if self.threaded:
+            # wait for the sender to drain before stopping the clock
+            while driver.sender.get_status()["queue_depth"]:
+                time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            sequence = [name for _, name in self.messages]
+        by_type: Dict[str, int] = {}
+        for name in sequence:
+            by_type[name] = by_type.get(name, 0) + 1
+        send = driver.sender.durations if not self.threaded else list(driver.sender.latencies)
+        return {
+            "datagrams": len(self.datagrams),
+            "lines": lines,
+            "duration": self.datagrams[-1][0] if self.datagrams else 0.0,
+            "elapsed": elapsed,
+            "speed": self.speed,
+            "threaded": self.threaded,
+            "throughput": {
+                "datagrams_per_s": len(self.datagrams) / elapsed if elapsed else 0.0,
+                "lines_per_s": lines / elapsed if elapsed else 0.0,
+                "messages_per_s": len(sequence) / elapsed if elapsed else 0.0,
+            },
+            "stages_ms": {
+                **{name: summarize(samples) for name, samples in stages.items()},
+                "send": summarize(send),
+            },
+            "sender": driver.sender.get_status(),
+            "messages": {"count": len(sequence), "by_type": by_type, "sequence": sequence},
+        }
+
+
+def compare(report: Dict[str, Any], expected: Dict[str, Any]) -> Optional[str]:
+    """
+    Returns a description of the first difference between the message sequences, None if they match
+    """
+    got, want = report["messages"]["sequence"], expected["messages"]["sequence"]
+    for i, (a, b) in enumerate(zip(got, want)):
+        if a != b:
+            return f"message {i}: sent {a}, expected {b}"
+    if len(got) != len(want):
+        return f"sent {len(got)} messages, expected {len(want)}"
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("session", help="binary recording or text capture")
+    parser.add_argument("--speed", type=float, default=0, help="multiple of real time, 0 for as fast as possible")
+    parser.add_argument("--threaded", action="store_true", help="send through the driver's sender thread")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="report whose message sequence must match, exits 1 if it doesn't")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    stub = Mavlink2RestStub().start()
+    replay = Replay(load_session(args.session), stub.url, args.speed, args.threaded)
+    report = replay.run()
+    report["stub"] = stub.counts()
+    stub.stop()
+
+    summary = {key: value for key, value in report.items() if key != "messages"}
+    summary["messages"] = {key: value for key, value in report["messages"].items() if key != "sequence"}
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if args.compare:
+        with open(args.compare) as expected:
+            difference = compare(report, json.load(expected))
+        if difference is not None:
+            print(f"Message sequence differs: {difference}")
+            sys.exit(1)
+        print("Message sequence matches")
+
+
+if __name__ == "__main__":
+    main()
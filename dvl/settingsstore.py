@@ -0,0 +1,220 @@
+"""
+Persistence of the driver settings.
+
+The settings live in memory, update() only replaces them and wakes a background writer, which
+waits for the changes to settle before writing, so bursts of changes cost one write and no
+caller ever waits on the SD card. Files are written to a temporary file in the same directory,
+synced and renamed over the old one, so a power cut leaves either the old or the new settings.
+
+Files carry a schema version. Older files are migrated on load, and every setting is checked
+against the type of its default on its own, so one bad or missing key only resets that key.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from loguru import logger
+
+SCHEMA_VERSION = 1
+# seconds without changes before they are written
+DEBOUNCE = 1.0
+
+
+def migrate_0(data: Dict[str, Any]) -> Dict[str, Any]:
+    # files written before versioning have the same keys as version 1
+    return data
+
+
+# version -> function turning a file of that version into one of the next version
+MIGRATIONS: Dict[int, Callable[[Dict[str, Any]], Dict[str, Any]]] = {0: migrate_0}
+
+
+def number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def valid(value: Any, default: Any) -> bool:
+    """
+    Checks "value" has the type of "default", accepting ints for floats and lists of the same length
+    whose elements have the types of the default's, any number for a number
+    """
+    if isinstance(default, bool) or isinstance(value, bool):
+        return isinstance(value, bool) and isinstance(default, bool)
+    if isinstance(default, str):
+        # str enums are saved as their value
+        return isinstance(value, str)
+    if isinstance(default, float):
+        return isinstance(value, (int, float))
+    if isinstance(default, (list, tuple)):
+        return (
+            isinstance(value, list)
+            and len(value) == len(default)
+            and all(
+                (number(element) and number(element_default)) or valid(element, element_default)
+                for element, element_default in zip(value, default)
+            )
+        )
+    return isinstance(value, type(default))
+
+
+class SettingsStore:
+    """
+    Settings held in memory and written to "path" in the background, "defaults" give the keys and their types
+    """
+
+    def __init__(self, defaults: Dict[str, Any], debounce: float = DEBOUNCE) -> None:
+        self.defaults = dict(defaults)
+        self.debounce = debounce
+        self.values = dict(defaults)
+        self.path: Optional[str] = None
+        self.dirty = False
+        self.changed_at = 0.0
+        self.condition = threading.Condition()
+        # serializes the writer thread and flush()
+        self.write_lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.writes = 0
+        self.last_error: Optional[str] = None
+
+    def load(self, path: str, current: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Reads the settings from "path", migrating and checking them, starts the writer and returns the settings.
+        Settings missing from the file keep their "current" value, or their default
+        """
+        self.path = path
+        if current is not None:
+            self.defaults = dict(current)
+        values = dict(self.defaults)
+        try:
+            with open(path) as settings:
+                data = json.load(settings)
+            if not isinstance(data, dict):
+                raise ValueError("not an object")
+            values.update(self.parse(data))
+        except FileNotFoundError:
+            logger.warning("Settings file not found, using default.")
+        except ValueError as error:
+            logger.warning(f"Settings file corrupted ({error}), using default settings.")
+        with self.condition:
+            self.values = values
+        self.start()
+        return dict(values)
+
+    def parse(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Migrates "data" to the current schema and returns the settings in it that are valid
+        """
+        version = data.pop("version", 0)
+        if not isinstance(version, int):
+            raise ValueError(f"bad version {version!r}")
+        if version > SCHEMA_VERSION:
+            logger.warning(f"Settings version {version} is newer than {SCHEMA_VERSION}, loading the known keys")
+        while version < SCHEMA_VERSION:
+            data = MIGRATIONS[version](data)
+            version += 1
+        values = {}
+        for key, default in self.defaults.items():
+            if key not in data:
+                logger.warning(f"Setting {key} not found, using default {default!r}")
+            elif not valid(data[key], default):
+                logger.warning(f"Setting {key}={data[key]!r} is invalid, using default {default!r}")
+            else:
+                values[key] = data[key]
+        return values
+
+    def get(self) -> Dict[str, Any]:
+        with self.condition:
+            return dict(self.values)
+
+    def update(self, values: Dict[str, Any]) -> None:
+        """
+        Replaces the settings, they are written once no other change came for "debounce" seconds
+        """
+        with self.condition:
+            if values == self.values:
+                return
+            self.values = dict(values)
+            self.dirty = True
+            self.changed_at = time.monotonic()
+            self.condition.notify()
+
+    def start(self) -> None:
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name="SettingsStore", daemon=True)
+        self.thread.start()
+        # the writer is a daemon, so the last changes are written on the way out
+        atexit.register(self.flush)
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.dirty:
+                    self.condition.wait()
+                # restarts the wait on every change, until one is old enough
+                while True:
+                    remaining = self.changed_at + self.debounce - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            self.flush()
+
+    def flush(self) -> bool:
+        """
+        Writes pending changes now, returns False if the write failed
+        """
+        with self.write_lock:
+            with self.condition:
+                if not self.dirty or self.path is None:
+                    return True
+                values = dict(self.values)
+                self.dirty = False
+            try:
+                self.write(values)
+            except OSError as error:
+                self.last_error = str(error)
+                logger.warning(f"Unable to save settings: {error}")
+                with self.condition:
+                    # retried once the debounce is over again
+                    self.dirty = True
+                    self.changed_at = time.monotonic()
+                return False
+            self.last_error = None
+            self.writes += 1
+            return True
+
+    def write(self, values: Dict[str, Any]) -> None:
+        """
+        Replaces the settings file atomically with "values"
+        """
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        file, temporary = tempfile.mkstemp(prefix=".settings-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(file, "w") as settings:
+                json.dump({"version": SCHEMA_VERSION, **values}, settings)
+                settings.flush()
+                os.fsync(settings.fileno())
+            os.replace(temporary, self.path)
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+        try:
+            # makes the rename itself durable
+            directory_file = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(directory_file)
+            finally:
+                os.close(directory_file)
+        except OSError:
+            pass
+
+    def get_status(self) -> Dict[str, Any]:
+        return {"path": self.path, "pending": self.dirty, "writes": self.writes, "last_error": self.last_error}
@@ -24,6 +24,8 @@ setup(
         "click == 7.1.2",
         "Werkzeug==1.0.1",
         "requests",
+        "websocket-client == 1.6.1",
+        "numpy",
         "pynmea2 @ git+https://github.com/CeruleanSonar/pynmea2"
     ],
 )
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Simulates a Cerulean DVL on the local machine, for testing and load-testing the driver without hardware.
+
+Sends $DVPDL, $DVEXT and GPS:$GPGGA datagrams for a scripted trajectory to the driver's data port,
+and answers the commands the driver sends to the command port: PAUSE, RESUME, SEND-*/RETWEET-* ON|OFF,
+SET-SENSOR-ORIENTATION, MANUAL-MODE, REBOOT and "?", which replies with the settings in a $DVNVM sentence.
+Every command is acknowledged with "$DVACK,<command name>,OK" or ",ERR".
+
+    python3 simulator.py --speedup 10 --noise 0.01 --invalid 0.05 --dropout 0.01
+    python3 simulator.py --trajectory dive.json
+
+A trajectory is a JSON list of legs, followed in a loop:
+    [{"duration": 20, "speed": 0.5, "yaw_rate": 0, "vz": 0, "altitude": 5}, ...]
+with durations in s, speed and vz in m/s, yaw_rate in deg/s and the altitude above the bottom in m.
+"""
+
+import argparse
+import json
+import math
+import random
+import select
+import socket
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+from geodesy import NE_XY_cm_to_lat_lng_batch
+from nmeaparser import checksum
+
+DATA_PORT = 27000
+COMMAND_PORT = 50000
+# Hz, at --speedup 1
+PDL_RATE = 10.0
+EXT_RATE = 10.0
+GPS_RATE = 1.0
+# where the simulated vehicle starts
+ORIGIN = [-27.5934, -48.5478]
+# command name -> initial value, reported by "?"
+DEFAULT_SETTINGS = {
+    "SEND-DVPDL": "ON",
+    "SEND-DVEXT": "ON",
+    "RETWEET-GPS": "ON",
+    "RETWEET-IMU": "OFF",
+    "SEND-GPRMC": "OFF",
+    "SET-SENSOR-ORIENTATION": "0,0,0",
+    "MANUAL-MODE": "OFF",
+}
+
+
+class Leg(NamedTuple):
+    duration: float  # s
+    speed: float = 0.5  # m/s forward
+    yaw_rate: float = 0.0  # deg/s
+    vz: float = 0.0  # m/s down
+    altitude: float = 5.0  # m above the bottom
+
+
+# a 20 m square, turning 90 degrees in each corner
+SQUARE = [Leg(40), Leg(5, speed=0.1, yaw_rate=18)] * 4
+
+
+def sentence(body: str) -> bytes:
+    data = body.encode()
+    return b"$%s*%02X\r\n" % (data, checksum(data))
+
+
+class DvlSimulator:
+    """
+    Generates the DVL traffic and serves the command port, on one thread
+    """
+
+    def __init__(
+        self,
+        target: Tuple[str, int] = ("127.0.0.1", DATA_PORT),
+        command_port: int = COMMAND_PORT,
+        trajectory: Optional[List[Leg]] = None,
+        speedup: float = 1.0,
+        noise: float = 0.0,
+        invalid: float = 0.0,
+        dropout: float = 0.0,
+        dropout_duration: float = 2.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.target = target
+        self.trajectory = trajectory or SQUARE
+        # the rates are multiplied, the trajectory itself runs in real time
+        self.speedup = speedup
+        # standard deviation of the position delta noise, in m
+        self.noise = noise
+        # chance of each ping having no bottom lock
+        self.invalid = invalid
+        # chance per second of the DVL going silent for dropout_duration
+        self.dropout = dropout
+        self.dropout_duration = dropout_duration
+        self.random = random.Random(seed)
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.running = True
+        self.stopped = threading.Event()
+        self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.command_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.command_socket.bind(("0.0.0.0", command_port))
+        self.boot = time.monotonic()
+        # vehicle state, north/east/down in m and heading in rad
+        self.position = [0.0, 0.0, 0.0]
+        self.heading = 0.0
+        self.altitude = self.trajectory[0].altitude
+        self.leg = 0
+        self.leg_elapsed = 0.0
+        self.silent_until = 0.0
+        # bottom lock of the last ping, reported in $DVEXT
+        self.last_valid = True
+        self.sent: Dict[str, int] = {"PDL": 0, "EXT": 0, "GPS": 0}
+
+    def timestamp_us(self, now: float) -> int:
+        return int((now - self.boot) * 1e6)
+
+    def advance(self, dt: float) -> Tuple[float, float, float, float]:
+        """
+        Moves the vehicle along the trajectory, returns the forward, right and down deltas in m and the yaw delta in rad
+        """
+        forward = right = down = 0.0
+        start_heading = self.heading
+        while dt > 0:
+            leg = self.trajectory[self.leg]
+            step = min(dt, leg.duration - self.leg_elapsed)
+            yaw_step = math.radians(leg.yaw_rate) * step
+            # move along the mean heading of the step, the deltas are in the frame at the start
+            heading = self.heading + yaw_step / 2
+            distance = leg.speed * step
+            forward += distance * math.cos(heading - start_heading)
+            right += distance * math.sin(heading - start_heading)
+            down += leg.vz * step
+            self.position[0] += distance * math.cos(heading)
+            self.position[1] += distance * math.sin(heading)
+            self.position[2] += leg.vz * step
+            self.heading = (self.heading + yaw_step) % (2 * math.pi)
+            self.altitude = leg.altitude
+            self.leg_elapsed += step
+            dt -= step
+            if self.leg_elapsed >= leg.duration:
+                self.leg = (self.leg + 1) % len(self.trajectory)
+                self.leg_elapsed = 0.0
+        yaw = (self.heading - start_heading + math.pi) % (2 * math.pi) - math.pi
+        return forward, right, down, yaw
+
+    def send(self, data: bytes, address: Optional[Tuple[str, int]] = None) -> None:
+        try:
+            self.data_socket.sendto(data, address or self.target)
+        except OSError as error:
+            logger.warning(f"Unable to send to {address or self.target}: {error}")
+
+    def send_pdl(self, now: float, dt: float) -> None:
+        forward, right, down, yaw = self.advance(dt)
+        valid = self.random.random() >= self.invalid
+        if self.noise:
+            forward += self.random.gauss(0, self.noise)
+            right += self.random.gauss(0, self.noise)
+            down += self.random.gauss(0, self.noise)
+        confidence = self.random.uniform(80, 100) if valid else 0.0
+        if not valid:
+            forward = right = down = 0.0
+        if self.settings["SEND-DVPDL"] == "ON":
+            self.send(
+                sentence(
+                    f"DVPDL,{self.timestamp_us(now)},{int(dt * 1e6)},0.000000,0.000000,{yaw:.6f},"
+                    f"{forward:.6f},{right:.6f},{down:.6f},{confidence:.1f}"
+                )
+            )
+            self.sent["PDL"] += 1
+        self.last_valid = valid
+
+    def send_ext(self, now: float) -> None:
+        if self.settings["SEND-DVEXT"] != "ON":
+            return
+        valid = self.last_valid
+        lock = "1" if valid else "0"
+        altitude = self.altitude + (self.random.gauss(0, self.noise) if self.noise else 0.0)
+        gains = ",".join(f"{self.random.uniform(25, 35):.1f}" for _ in range(4))
+        self.send(
+            sentence(
+                f"DVEXT,{self.timestamp_us(now)},{lock},1,1,{lock},{lock},{lock},{lock},{gains},"
+                f"{altitude if valid else 0.0:.3f}"
+            )
+        )
+        self.sent["EXT"] += 1
+
+    def send_gps(self) -> None:
+        if self.settings["RETWEET-GPS"] != "ON":
+            return
+        lat, lon = NE_XY_cm_to_lat_lng_batch([self.position[:2]], ORIGIN)
+        lat, lon = float(lat[0]), float(lon[0])
+        utc = time.gmtime()
+        body = (
+            f"GPGGA,{utc.tm_hour:02d}{utc.tm_min:02d}{utc.tm_sec:02d}.00,"
+            f"{int(abs(lat)):02d}{abs(lat) % 1 * 60:07.4f},{'S' if lat < 0 else 'N'},"
+            f"{int(abs(lon)):03d}{abs(lon) % 1 * 60:07.4f},{'W' if lon < 0 else 'E'},1,09,0.9,0.0,M,0.0,M,,"
+        )
+        self.send(b"GPS:" + sentence(body))
+        self.sent["GPS"] += 1
+
+    def configuration(self) -> bytes:
+        # commas separate the settings, so the ones inside values become semicolons
+        values = ",".join(f"{name}={value.replace(',', ';')}" for name, value in self.settings.items())
+        return sentence(f"DVNVM,{values}")
+
+    def handle_command(self, command: str, address: Tuple[str, int]) -> None:
+        """
+        Applies one command line and acknowledges it to "address"
+        """
+        name, _, argument = command.strip().partition(" ")
+        name = name.upper()
+        ok = True
+        if name == "?":
+            self.send(self.configuration(), address)
+        elif name == "PAUSE":
+            self.running = False
+        elif name == "RESUME":
+            self.running = True
+        elif name == "REBOOT":
+            self.boot = time.monotonic()
+            self.settings = dict(DEFAULT_SETTINGS)
+        elif name in self.settings and name.startswith(("SEND-", "RETWEET-")):
+            ok = argument.upper() in ["ON", "OFF"]
+            if ok:
+                self.settings[name] = argument.upper()
+        elif name in self.settings and argument:
+            self.settings[name] = argument
+        else:
+            ok = False
+        logger.debug(f"{command.strip()!r} from {address}: {'OK' if ok else 'ERR'}")
+        self.send(sentence(f"DVACK,{name},{'OK' if ok else 'ERR'}"), address)
+
+    def handle_commands(self, timeout: float) -> None:
+        readable, _, _ = select.select([self.command_socket], [], [], max(0.0, timeout))
+        if not readable:
+            return
+        data, address = self.command_socket.recvfrom(4096)
+        for command in data.decode("ascii", errors="replace").splitlines():
+            if command.strip():
+                self.handle_command(command, address)
+
+    def run(self) -> None:
+        now = time.monotonic()
+        next_pdl, next_ext, next_gps, next_dropout = now, now, now, now + 1
+        last_pdl = now
+        while not self.stopped.is_set():
+            self.handle_commands(min(next_pdl, next_ext, next_gps) - time.monotonic())
+            now = time.monotonic()
+            if now >= next_dropout:
+                next_dropout = now + 1
+                if self.random.random() < self.dropout:
+                    logger.info(f"Dropping out for {self.dropout_duration} s")
+                    self.silent_until = now + self.dropout_duration
+            silent = not self.running or now < self.silent_until
+            # read every time, so the speedup can be changed while running
+            if now >= next_pdl:
+                next_pdl += 1 / (PDL_RATE * self.speedup)
+                if not silent:
+                    self.send_pdl(now, now - last_pdl)
+                last_pdl = now
+            if now >= next_ext:
+                next_ext += 1 / (EXT_RATE * self.speedup)
+                if not silent:
+                    self.send_ext(now)
+            if now >= next_gps:
+                next_gps += 1 / (GPS_RATE * self.speedup)
+                if not silent:
+                    self.send_gps()
+            # don't try to catch up after a stall, just carry on from now
+            next_pdl, next_ext, next_gps = (max(t, now - 1) for t in (next_pdl, next_ext, next_gps))
+        self.data_socket.close()
+        self.command_socket.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "sent": dict(self.sent),
+            "position": list(self.position),
+            "heading": math.degrees(self.heading),
+            "settings": dict(self.settings),
+        }
+
+
+def load_trajectory(path: str) -> List[Leg]:
+    with open(path, encoding="utf-8") as file:
+        return [Leg(**leg) for leg in json.load(file)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="127.0.0.1", help="host running the driver")
+    parser.add_argument("--port", type=int, default=DATA_PORT, help="driver's data port")
+    parser.add_argument("--command-port", type=int, default=COMMAND_PORT, help="port to accept commands on")
+    parser.add_argument("--trajectory", help="JSON list of legs, a 20 m square by default")
+    parser.add_argument("--speedup", type=float, default=1.0, help="multiplier of the sentence rates")
+    parser.add_argument("--noise", type=float, default=0.0, help="position delta noise, m standard deviation")
+    parser.add_argument("--invalid", type=float, default=0.0, help="fraction of pings without bottom lock")
+    parser.add_argument("--dropout", type=float, default=0.0, help="chance per second of going silent")
+    parser.add_argument("--dropout-duration", type=float, default=2.0, help="seconds each dropout lasts")
+    parser.add_argument("--seed", type=int, help="random seed, for repeatable noise")
+    args = parser.parse_args()
+
+    simulator = DvlSimulator(
+        (args.target, args.port),
+        args.command_port,
+        load_trajectory(args.trajectory) if args.trajectory else None,
+        args.speedup,
+        args.noise,
+        args.invalid,
+        args.dropout,
+        args.dropout_duration,
+        args.seed,
+    )
+    logger.info(f"Simulating a DVL, sending to {args.target}:{args.port}, commands on {args.command_port}")
+    try:
+        simulator.run()
+    except KeyboardInterrupt:
+        logger.info(f"Stopped: {simulator.get_status()}")
+
+
+if __name__ == "__main__":
+    main()
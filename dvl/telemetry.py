@@ -0,0 +1,96 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+# telemetry kept up to date in the background
+TELEMETRY_MESSAGES = ["ATTITUDE", "VFR_HUD", "GPS_GLOBAL_ORIGIN"]
+# seconds between polls of each message while nothing is pushed over the websocket
+POLL_INTERVAL = 0.1
+# seconds between checks for mavlink2rest restarts
+RESTART_CHECK_INTERVAL = 10
+
+
+class TelemetryEntry(NamedTuple):
+    timestamp: float  # time.monotonic() when it was stored
+    counter: int  # mavlink2rest message counter, or a local count for pushed messages
+    message: Any
+
+
+class TelemetryCache:
+    """
+    Latest copy of each telemetry message, readable without blocking on mavlink2rest
+    """
+
+    def __init__(self) -> None:
+        self.entries: Dict[str, TelemetryEntry] = {}
+        # callbacks receiving (name, entry) for every new message
+        self.listeners: List[Callable[[str, TelemetryEntry], None]] = []
+
+    def update(self, name: str, message: Any, counter: Optional[int] = None) -> None:
+        """
+        Stores "message". Without a mavlink2rest "counter", the previous counter is incremented
+        """
+        previous = self.entries.get(name)
+        if counter is None:
+            counter = previous.counter + 1 if previous else 1
+        elif previous is not None and counter == previous.counter:
+            # polled again before the autopilot sent a new one
+            return
+        entry = TelemetryEntry(time.monotonic(), counter, message)
+        self.entries[name] = entry
+        for listener in self.listeners:
+            listener(name, entry)
+
+    def get(self, name: str, max_age_ms: float) -> Optional[TelemetryEntry]:
+        """
+        Returns the entry for "name" if it is no older than "max_age_ms", None otherwise
+        """
+        entry = self.entries.get(name)
+        if entry is None or (time.monotonic() - entry.timestamp) * 1e3 > max_age_ms:
+            return None
+        return entry
+
+    def clear(self) -> None:
+        self.entries = {}
+
+
+class TelemetrySubscriber(threading.Thread):
+    """
+    Keeps a TelemetryCache fresh by polling mavlink2rest, pausing while the websocket pushes
+    the same messages. Also watches for mavlink2rest restarts
+    """
+
+    def __init__(
+        self,
+        poll: Callable[[str], Optional[Tuple[int, Any]]],
+        cache: TelemetryCache,
+        is_pushed: Callable[[], bool],
+        check_restart: Callable[[], bool],
+        names: Optional[List[str]] = None,
+    ) -> None:
+        threading.Thread.__init__(self, name="TelemetrySubscriber", daemon=True)
+        self.poll = poll
+        self.cache = cache
+        self.is_pushed = is_pushed
+        self.check_restart = check_restart
+        self.names = names or TELEMETRY_MESSAGES
+
+    def run(self) -> None:
+        last_restart_check = time.monotonic()
+        while True:
+            started = time.monotonic()
+            if started - last_restart_check > RESTART_CHECK_INTERVAL:
+                last_restart_check = started
+                self.check_restart()
+            if not self.is_pushed():
+                for name in self.names:
+                    try:
+                        latest = self.poll(name)
+                    except Exception as error:
+                        logger.debug(f"Unable to poll {name}: {error}")
+                        continue
+                    if latest is not None:
+                        self.cache.update(name, latest[1], latest[0])
+            time.sleep(max(0.0, POLL_INTERVAL - (time.monotonic() - started)))
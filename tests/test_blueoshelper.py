@@ -0,0 +1,49 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dvl"))
+
+from blueoshelper import ConnectionPool  # noqa: E402
+
+
+def answer_and_close(client: socket.socket, requests: list) -> None:
+    # answers as if keeping the connection alive, then closes its side like an expired keep-alive.
+    # Anything sent afterwards is read and ignored, as it is when the FIN crosses the next request
+    with client:
+        data = b""
+        while b"\r\n\r\n" not in data:
+            data += client.recv(4096)
+        requests.append(data.split(b"\r\n", 1)[0])
+        client.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: keep-alive\r\n\r\nok")
+        client.shutdown(socket.SHUT_WR)
+        while client.recv(4096):
+            pass
+
+
+def serve(server: socket.socket, requests: list) -> None:
+    while True:
+        try:
+            client, _ = server.accept()
+        except OSError:
+            return
+        threading.Thread(target=answer_and_close, args=(client, requests), daemon=True).start()
+
+
+def test_post_after_the_server_closed_the_idle_connection() -> None:
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    requests: list = []
+    threading.Thread(target=serve, args=(server, requests), daemon=True).start()
+    pool = ConnectionPool(f"http://127.0.0.1:{server.getsockname()[1]}")
+    try:
+        assert pool.request("POST", "/mavlink", b"{}") == (200, b"ok")
+        time.sleep(0.1)
+        assert pool.request("POST", "/mavlink", b"{}") == (200, b"ok")
+        assert len(requests) == 2
+    finally:
+        pool.close()
+        server.close()
@@ -0,0 +1,21 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dvl"))
+
+from mavlinksender import MavlinkSender, SendPolicy  # noqa: E402
+
+
+def test_full_queue_merges_position_deltas() -> None:
+    sender = MavlinkSender(maxsize=4)
+    for confidence in range(100, 90, -1):
+        sender.submit("VISION_POSITION_DELTA", SendPolicy.KEEP, print, [0.5, 0.0, -0.25], [0, 0, 0.1], confidence, 1000)
+
+    status = sender.get_status()
+    assert status["queue_depth"] == 4
+    assert status["dropped"] == {}
+    assert status["merged"] == {"VISION_POSITION_DELTA": 6}
+    positions = [entry.args[0] for entry in sender.queue]
+    assert [sum(axis) for axis in zip(*positions)] == [5.0, 0.0, -2.5]
+    assert sum(entry.args[3] for entry in sender.queue) == 10000
+    assert sender.queue[-1].args[2] == 91
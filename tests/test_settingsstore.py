@@ -0,0 +1,30 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dvl"))
+
+from dvl import DvlDriver  # noqa: E402
+from settingsstore import valid  # noqa: E402
+
+
+def test_numbers_in_lists() -> None:
+    assert valid([-27.59, -48.54], [0, 0])
+    assert valid([1, 2], [0.0, 0.0])
+    assert not valid([True, 0], [0, 0])
+    assert not valid(["-27.59", "-48.54"], [0, 0])
+    assert not valid([0.0], [0, 0])
+
+
+def test_origin_is_loaded_back(tmp_path) -> None:
+    path = str(tmp_path / "settings.json")
+    driver = DvlDriver()
+    driver.settings_path = path
+    driver.load_settings()
+    driver.origin = [-27.59, -48.54]
+    driver.save_settings()
+    assert driver.settings_store.flush()
+
+    loaded = DvlDriver()
+    loaded.settings_path = path
+    loaded.load_settings()
+    assert loaded.origin == [-27.59, -48.54]